@@ -0,0 +1,120 @@
+"""Recall and latency of the nearest neighbour index (`UIIndex`) against
+the exact blocked search, for several numbers of probed clusters. The
+UI#s are synthetic: variants of some screen templates, as repackaged
+apps reuse screens. An untrained network is used unless a model is
+given"""
+
+import argparse
+import os
+import sys
+from os.path import join
+from tempfile import mkdtemp
+from time import perf_counter
+
+import numpy as np
+import torch
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+# before site-packages, which may have another "dataset" module
+for _path in (rootpath, join(rootpath, "mlalgos")):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from ann_index import UIIndex
+from siamese import SiameseModel
+from similarity import embed_uis, top_k_search
+
+
+def gen_template_uis(ui_number: int, templates: np.ndarray, noise: float,
+                     seed: int) -> np.ndarray:
+    """ UI#s that each vary a random template """
+    rnd = np.random.default_rng(seed)
+    picked = templates[rnd.integers(0, len(templates), ui_number)]
+    return (picked + rnd.random(picked.shape) * noise).astype(np.float32)
+
+
+def recall(exact: tuple, approx: tuple) -> float:
+    """ Mean share of the exact neighbours found, over the queries with
+    any exact neighbour """
+    shares = list()
+    for r in range(len(exact[0]) - 1):
+        truth = exact[1][exact[0][r]:exact[0][r + 1]]
+        if len(truth) == 0:
+            continue
+        found = approx[1][approx[0][r]:approx[0][r + 1]]
+        shares.append(len(np.intersect1d(truth, found)) / float(len(truth)))
+    return float(np.mean(shares)) if shares else 1.
+
+
+def bench(sm: SiameseModel, corpus_size: int, query_number: int, k: int,
+          threshold: float, probes: list, clusters: int = 0):
+    rnd = np.random.default_rng(0)
+    templates = rnd.random((max(1, corpus_size // 20), *sm.hash_size))
+    corpus = gen_template_uis(corpus_size, templates, 0.3, 1)
+    names = np.array([f"app{i // 10} ui{i % 10}.xml" for i in range(corpus_size)])
+    queries = gen_template_uis(query_number, templates, 0.3, 2)
+
+    start = perf_counter()
+    index = UIIndex.build(sm, corpus, names, clusters)
+    print(f"index of {len(index)} uis in {index.meta['clusters']} clusters "
+          f"built in {perf_counter() - start:.2f} s")
+    embeddings = embed_uis(sm.net, corpus, sm.device)
+    query_embeddings = embed_uis(sm.net, queries, sm.device)
+
+    start = perf_counter()
+    exact = top_k_search(query_embeddings, embeddings, k, threshold)
+    cost = perf_counter() - start
+    print(f"exact blocked search: {cost * 1000 / query_number:.3f} ms per query "
+          f"(batch of {query_number}), {len(exact[1])} neighbours")
+    start = perf_counter()
+    for q in query_embeddings[:100]:
+        top_k_search(q[None, :], embeddings, k, threshold)
+    print(f"exact blocked search: "
+          f"{(perf_counter() - start) * 1000 / min(100, query_number):.3f} ms "
+          f"per single query")
+
+    print(f"{'n_probe':>8}{'recall@' + str(k):>11}{'ms/query':>10}")
+    for n_probe in probes:
+        start = perf_counter()
+        approx = index.search(query_embeddings, k, threshold, n_probe)
+        cost = perf_counter() - start
+        print(f"{n_probe:>8}{recall(exact, approx):>11.4f}"
+              f"{cost * 1000 / query_number:>10.3f}")
+
+    start = perf_counter()
+    for q in queries[:100]:
+        index.query(q[None], k, threshold, probes[len(probes) // 2])
+    print(f"query of one UI# with n_probe {probes[len(probes) // 2]}, "
+          f"embedding included: "
+          f"{(perf_counter() - start) * 1000 / min(100, query_number):.3f} ms")
+
+
+def parse_arg_bench(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the nearest neighbour index of UI#s")
+    parser.add_argument("--corpus", default=100000, type=int,
+                        help="uis in the index")
+    parser.add_argument("--queries", default=1000, type=int)
+    parser.add_argument("--top_k", "-k", default=10, type=int)
+    parser.add_argument("--threshold", "-t", default=0.6, type=float)
+    parser.add_argument("--probes", default="1,2,4,8,16,32", type=str,
+                        help="numbers of probed clusters")
+    parser.add_argument("--clusters", "-c", default=0, type=int)
+    parser.add_argument("--model", default="", type=str,
+                        help="a trained siamese model of 10,5,5 UI#s")
+    return parser.parse_args(input_args)
+
+
+if __name__ == "__main__":
+    args = parse_arg_bench(sys.argv[1:])
+    model = SiameseModel(load_labelled_dataset=False)
+    if len(args.model) > 0:
+        model.model_path = args.model
+    else:
+        # the index needs a model file
+        model.model_path = join(mkdtemp(prefix="bench_ann_"), "untrained.tar")
+        torch.save(model.net.state_dict(), model.model_path)
+    model.load_model()
+    bench(model, args.corpus, args.queries, args.top_k, args.threshold,
+          [int(a) for a in args.probes.split(",")], args.clusters)
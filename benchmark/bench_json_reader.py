@@ -0,0 +1,198 @@
+"""Compare the json hierarchy readers with the recursive ones they replace.
+Both should give the same nodes, and the iterative ones should also read
+trees deeper than the recursion limit. The json files are loaded with
+orjson when it is installed"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from os import walk
+from os.path import isdir, join
+from tempfile import mkdtemp
+from time import perf_counter
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+for _path in (rootpath, join(rootpath, "hasher")):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+from extract_view_images import read_rico_json_nodes
+from xml2nodes import XMLReader
+from util.util_json import DEEP_RECURSION_LIMIT, load_json, orjson
+
+
+TAGS = ["div", "span", "a", "button", "img", "input", "li", "ul", "p",
+        "h2", "svg", "section", "my-widget"]
+
+
+def gen_dom(json_path: str, node_number: int, max_depth: int = 30,
+            seed: int = 0):
+    """ Write a synthetic web crawler dom with `node_number` nodes. A few
+    nodes have no label or no bounds, like in Rico. The tree is built
+    with a stack, so it can be deeper than the recursion limit """
+    rnd = random.Random(seed)
+
+    def new_node() -> dict:
+        x1, y1 = rnd.randint(-50, 1270), rnd.randint(-50, 5000)
+        node = {"bounds": [x1, y1, x1 + rnd.randint(0, 600),
+                           y1 + rnd.randint(0, 400)], "children": []}
+        if rnd.random() < 0.95:
+            node["componentLabel"] = rnd.choice(TAGS)
+        elif rnd.random() < 0.5:
+            # a labelled node always has bounds
+            del node["bounds"]
+        return node
+
+    root = new_node()
+    stack, count = [root], 1
+    while count < node_number:
+        node = new_node()
+        stack[-1]["children"].append(node)
+        count += 1
+        if len(stack) < max_depth and rnd.random() < 0.5:
+            stack.append(node)
+        else:
+            while len(stack) > 1 and rnd.random() < 0.3:
+                stack.pop()
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, DEEP_RECURSION_LIMIT))
+    try:
+        with open(json_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(root))
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def read_json_nodes_recursive(node: dict, node_dicts: list):
+    """ The recursive `XMLReader.read_json_nodes`, as the reference """
+    _dict = dict()
+    _dict['name'] = node.get('componentLabel', 'view')
+    if 'bounds' in node:
+        b = node['bounds']
+        _dict['lt'] = [str(b[0]), str(b[1])]
+        _dict['rb'] = [str(b[2]), str(b[3])]
+    _dict['visible'] = 'true'
+    _dict['text'] = ''
+    _dict['interact'] = _dict['name'] in ['a', 'button', 'input', 'select', 'textarea']
+    if 'lt' in _dict:
+        node_dicts.append(_dict)
+    if 'children' in node:
+        for child in node['children']:
+            read_json_nodes_recursive(child, node_dicts)
+
+
+def read_rico_json_nodes_recursive(nodes: list, o: dict):
+    """ The recursive `read_rico_json_nodes`, as the reference """
+    if "componentLabel" in o:
+        nodes.append([*o["bounds"], o["componentLabel"]])
+    if "children" in o:
+        for c in o["children"]:
+            read_rico_json_nodes_recursive(nodes, c)
+
+
+def list_jsons(paths: list) -> list:
+    jsons = list()
+    for path in paths:
+        if not isdir(path):
+            jsons.append(path)
+            continue
+        for dirpath, _, filenames in walk(path):
+            jsons += [join(dirpath, n) for n in sorted(filenames)
+                      if n.endswith(".json")]
+    return jsons
+
+
+def best_of(repeat: int, func) -> float:
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        cost = perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return best
+
+
+def bench(jsons: list, repeat: int = 3):
+    # the references (and the json module) recurse once per level
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, DEEP_RECURSION_LIMIT))
+    try:
+        trees = list()
+        for json_path in jsons:
+            with open(json_path, mode="r", encoding="utf-8") as f:
+                tree = json.load(f)
+            assert load_json(json_path) == tree, f"different data in {json_path}"
+            trees.append(tree)
+        for json_path, tree in zip(jsons, trees):
+            a, b = list(), list()
+            read_json_nodes_recursive(tree, a)
+            XMLReader.read_json_nodes(None, tree, b)
+            assert a == b == XMLReader(json_path).node_dicts, \
+                f"different nodes in {json_path}"
+            a, b = list(), list()
+            read_rico_json_nodes_recursive(a, tree)
+            read_rico_json_nodes(b, tree)
+            assert a == b, f"different rico nodes in {json_path}"
+    finally:
+        sys.setrecursionlimit(limit)
+    print(f"{len(jsons)} jsons, same nodes from both readers")
+
+    def load_stdlib():
+        for json_path in jsons:
+            with open(json_path, mode="r", encoding="utf-8") as f:
+                json.load(f)
+
+    def recursive():
+        for tree in trees:
+            read_json_nodes_recursive(tree, list())
+            read_rico_json_nodes_recursive(list(), tree)
+
+    def iterative():
+        for tree in trees:
+            XMLReader.read_json_nodes(None, tree, list())
+            read_rico_json_nodes(list(), tree)
+
+    sys.setrecursionlimit(max(limit, DEEP_RECURSION_LIMIT))
+    try:
+        costs = {"json": best_of(repeat, load_stdlib),
+                 "orjson" if orjson is not None else "json (no orjson)":
+                     best_of(repeat, lambda: [load_json(j) for j in jsons]),
+                 "recursive": best_of(repeat, recursive)}
+    finally:
+        sys.setrecursionlimit(limit)
+    costs["iterative"] = best_of(repeat, iterative)
+    for name, cost in costs.items():
+        print(f"{name}: {cost * 1000 / len(jsons):.2f} ms per json")
+    start = perf_counter()
+    for json_path in jsons:
+        XMLReader(json_path)
+    print(f"XMLReader: {(perf_counter() - start) * 1000 / len(jsons):.2f} ms per json")
+
+
+def parse_arg_bench(input_args: list):
+    parser = argparse.ArgumentParser(description="Benchmark the json readers")
+    parser.add_argument("input_path", nargs="*",
+                        help="json files or folders of jsons. "
+                             "synthetic doms are used if not given")
+    parser.add_argument("--nodes", default=50000, type=int,
+                        help="node number of the synthetic doms")
+    parser.add_argument("--depths", default="30,3000", type=str,
+                        help="max depths of the synthetic doms")
+    parser.add_argument("--repeat", "-r", default=3, type=int)
+    return parser.parse_args(input_args)
+
+
+if __name__ == "__main__":
+    args = parse_arg_bench(sys.argv[1:])
+    if args.input_path:
+        bench(list_jsons(args.input_path), args.repeat)
+    else:
+        tmp = mkdtemp(prefix="bench_json_")
+        for depth in [int(a) for a in args.depths.split(",")]:
+            print(f"--- synthetic dom, {args.nodes} nodes, max depth {depth}")
+            dom = join(tmp, f"dom_{args.nodes}_{depth}.json")
+            gen_dom(dom, args.nodes, depth)
+            bench([dom], args.repeat)
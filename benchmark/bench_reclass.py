@@ -0,0 +1,100 @@
+"""Compare view reidentification models side by side: accuracy at the
+confidence threshold, and views/sec on the current device. Use a view
+image dataset that the models were not trained on, e.g., a held-out
+copy of the view image folders"""
+
+import argparse
+import os
+import sys
+from os.path import join
+from time import perf_counter
+
+import numpy as np
+import torch
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+for _path in (rootpath, join(rootpath, "hasher")):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+from reclass import ImgClassifier, MODEL_TYPES
+
+
+def predict_probs(ic: ImgClassifier, x: np.ndarray, batch_size: int) -> np.ndarray:
+    """Output probabilities of a model for uint8 [n, 28, 28] images"""
+    probs = list()
+    with torch.inference_mode():
+        for i in range(0, len(x), batch_size):
+            imgs = torch.from_numpy(np.asarray(x[i:i + batch_size])) \
+                .float().unsqueeze(1).to(ic.device)
+            probs.append(ic.net(imgs).cpu().numpy())
+    return np.concatenate(probs)
+
+
+def bench(dataset_path: str, models: list, threshold: float = 0.95,
+          batch_size: int = 512, repeat: int = 3):
+    """
+    Args:
+        dataset_path (str): A view image dataset, see `ImgDataSet`
+        models (list): (model type, model name or path) pairs
+        threshold (float): The confidence to take a predicted label
+        batch_size (int): Inference batch size
+        repeat (int): Timing runs per model, the best one is reported
+    """
+    rows = list()
+    for model_type, model_name in models:
+        ic = ImgClassifier(dataset_path, model_type=model_type,
+                           model_name=model_name, confidence_threshold=threshold)
+        model_path = model_name if os.path.exists(model_name) else ic.model_path
+        ic.net.load_state_dict(torch.load(model_path, map_location=ic.device))
+        ic.net.eval()
+        x, y = ic.dataset.x, np.asarray(ic.dataset.y)
+        probs = predict_probs(ic, x, batch_size)
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            predict_probs(ic, x, batch_size)
+            cost = perf_counter() - start
+            best = cost if best is None else min(best, cost)
+
+        predicted = probs.argmax(axis=1)
+        confident = probs.max(axis=1).astype(np.float64) > threshold
+        rows.append((f"{model_type}:{os.path.basename(model_path)}",
+                     sum(p.numel() for p in ic.net.parameters()),
+                     np.mean(predicted == y),
+                     np.mean(confident),
+                     np.mean(predicted[confident] == y[confident])
+                     if confident.any() else float("nan"),
+                     len(x) / best))
+
+    print(f"{len(y)} views, device: {ic.device}, threads: "
+          f"{torch.get_num_threads()}, threshold: {threshold}")
+    print(f"{'model':<36}{'params':>10}{'acc':>8}{'covered':>9}"
+          f"{'acc@t':>8}{'views/sec':>12}")
+    for name, params, acc, coverage, acc_t, speed in rows:
+        print(f"{name:<36}{params:>10}{acc * 100:>7.2f}%{coverage * 100:>8.2f}%"
+              f"{acc_t * 100:>7.2f}%{speed:>12.1f}")
+
+
+def parse_arg_bench(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the view reidentification models")
+    parser.add_argument("dataset_path", help="a view image dataset")
+    parser.add_argument("models", nargs="+",
+                        help="models as type:name, e.g., resnet:reclass_e12_128.tar "
+                             f"tiny:reclass_tiny_e12_128.tar. types: {list(MODEL_TYPES)}")
+    parser.add_argument("--threshold", "-t", default=0.95, type=float)
+    parser.add_argument("--batch_size", "-b", default=512, type=int)
+    parser.add_argument("--repeat", "-r", default=3, type=int)
+    parser.add_argument("--torch_threads", default=0, type=int,
+                        help="intra-op threads of torch, 0 for the default")
+    return parser.parse_args(input_args)
+
+
+if __name__ == "__main__":
+    args = parse_arg_bench(sys.argv[1:])
+    if args.torch_threads > 0:
+        torch.set_num_threads(args.torch_threads)
+    bench(args.dataset_path, [m.split(":", 1) for m in args.models],
+          args.threshold, args.batch_size, args.repeat)
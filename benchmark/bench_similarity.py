@@ -0,0 +1,136 @@
+"""Compare the per-pair detection on a wild dataset with the embed-once
+one of `SiameseModel.detect_on_wild_dataset`. Both should give the same
+scores. Synthetic UI#s are used, and an untrained network unless a
+model is given"""
+
+import argparse
+import os
+import sys
+from os.path import join
+from time import perf_counter
+
+import numpy as np
+import torch
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+# before site-packages, which may have another "dataset" module
+for _path in (rootpath, join(rootpath, "mlalgos")):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from siamese import SiameseModel
+from similarity import PairIndex, embed_uis, iter_cross_app_scores, \
+    top_k_neighbours
+
+
+def gen_uis(ui_number: int, app_number: int, hash_size=(10, 5, 5),
+            seed: int = 0):
+    """ Random UI#s, and names of the UIs arranged by app """
+    rnd = np.random.default_rng(seed)
+    sizes = rnd.multinomial(ui_number - app_number,
+                            np.ones(app_number) / app_number) + 1
+    names = [f"app{a} ui{k}.xml" for a in range(app_number)
+             for k in range(sizes[a])]
+    uis = rnd.random((ui_number, *hash_size)).astype(np.float32)
+    return uis, np.array(names)
+
+
+def pairs_of(names, limit: int) -> np.ndarray:
+    """ The first cross-app pairs, as the list that `WildDataSet` used
+    to materialize """
+    pairs = list()
+    apps = [n.split(' ')[0] for n in names]
+    for i in range(len(apps) - 1):
+        for j in range(i + 1, len(apps)):
+            if apps[i] != apps[j]:
+                pairs.append((i, j))
+                if len(pairs) >= limit:
+                    return np.array(pairs)
+    return np.array(pairs)
+
+
+def per_pair_scores(sm: SiameseModel, uis: np.ndarray, pairs: np.ndarray,
+                    batch_size: int) -> np.ndarray:
+    """ The scores as the per-pair detection gave them """
+    scores = list()
+    with torch.no_grad():
+        for k in range(0, len(pairs), batch_size):
+            p = pairs[k:k + batch_size]
+            ui1, ui2, _ = sm.deal_data((torch.from_numpy(uis[p[:, 0]]),
+                                        torch.from_numpy(uis[p[:, 1]]),
+                                        torch.tensor(-1)))
+            o = sm.net(torch.stack((ui1, ui2), 0))
+            scores.extend([i.item() for i in torch.cosine_similarity(o[0], o[1])])
+    return np.array(scores)
+
+
+def bench(sm: SiameseModel, uis: np.ndarray, names: np.ndarray,
+          reference_pairs: int, batch_size: int = 1024, top_k: int = 10,
+          floor: float = 0.6):
+    pair_index = PairIndex.of_names(names)
+    pair_total = len(pair_index)
+    print(f"{len(uis)} uis of {len(pair_index.offsets) - 1} apps, "
+          f"{pair_total} cross-app pairs")
+
+    start = perf_counter()
+    embeddings = embed_uis(sm.net, uis, sm.device, batch_size)
+    embed_cost = perf_counter() - start
+    start = perf_counter()
+    scores = np.empty(pair_total, dtype=np.float32)
+    k = 0
+    for _, _, block, mask in iter_cross_app_scores(embeddings, pair_index):
+        block = block[mask]
+        scores[k:k + len(block)] = block
+        k += len(block)
+    gemm_cost = perf_counter() - start
+    print(f"embed once: {embed_cost:.3f} s to embed, {gemm_cost:.3f} s for "
+          f"the scores ({pair_total / max(gemm_cost, 1e-9):.3g} pairs/s)")
+
+    start = perf_counter()
+    indptr, indices, top_scores = top_k_neighbours(embeddings, pair_index.offsets,
+                                                   top_k, floor)
+    cost = perf_counter() - start
+    print(f"top {top_k} above {floor}: {cost:.3f} s, {len(indices)} neighbours, "
+          f"{indptr.nbytes + indices.nbytes + top_scores.nbytes} bytes "
+          f"instead of {pair_total * 8} bytes of scores")
+
+    pairs = pairs_of(names, reference_pairs)
+    assert np.array_equal(np.stack(pair_index.pairs(np.arange(len(pairs))), 1)
+                          .reshape(-1, 2), pairs.reshape(-1, 2)), \
+        "different pairs from the pair index"
+    start = perf_counter()
+    reference = per_pair_scores(sm, uis, pairs, batch_size)
+    cost = perf_counter() - start
+    print(f"per pair: {cost:.3f} s for {len(pairs)} pairs "
+          f"({len(pairs) / max(cost, 1e-9):.3g} pairs/s), "
+          f"{cost / max(len(pairs), 1) * pair_total:.1f} s estimated for all")
+    if len(pairs) > 0:
+        print(f"max abs diff of the scores: "
+              f"{np.max(np.abs(scores[:len(pairs)] - reference)):.2e}")
+
+
+def parse_arg_bench(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the detection on a wild dataset")
+    parser.add_argument("--uis", default=5000, type=int)
+    parser.add_argument("--apps", default=500, type=int)
+    parser.add_argument("--reference_pairs", default=200000, type=int,
+                        help="pairs to score one by one as the reference")
+    parser.add_argument("--batch_size", "-b", default=1024, type=int)
+    parser.add_argument("--top_k", "-k", default=10, type=int)
+    parser.add_argument("--threshold", "-t", default=0.6, type=float)
+    parser.add_argument("--model", default="", type=str,
+                        help="a trained siamese model of 10,5,5 UI#s")
+    return parser.parse_args(input_args)
+
+
+if __name__ == "__main__":
+    args = parse_arg_bench(sys.argv[1:])
+    model = SiameseModel(load_labelled_dataset=False)
+    if len(args.model) > 0:
+        model.model_path = args.model
+        model.load_model()
+    model.net.eval()
+    bench(model, *gen_uis(args.uis, args.apps), args.reference_pairs,
+          args.batch_size, args.top_k, args.threshold)
@@ -0,0 +1,126 @@
+"""Compare the minidom XMLReader with the single pass (streaming) one.
+Both readers should give the same node dicts, and the streaming one
+should be faster, especially on large uiautomator dumps"""
+
+import argparse
+import os
+import random
+import sys
+from os import walk
+from os.path import isdir, join
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+for _path in (rootpath, join(rootpath, "hasher")):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+from xml2nodes import XMLReader
+
+
+CLASSES = ["android.widget.Button", "android.widget.TextView",
+           "android.widget.ImageView", "android.widget.EditText",
+           "android.widget.CheckBox", "android.widget.LinearLayout",
+           "android.widget.ScrollView", "android.view.ViewGroup",
+           "android.widget.FrameLayout", "android.view.View"]
+
+
+def gen_dump(xml_path: str, node_number: int, seed: int = 0):
+    """ Write a synthetic uiautomator dump with about `node_number` nodes,
+    including system nodes, invisible nodes and empty TextViews """
+    rnd = random.Random(seed)
+    lines = ["<?xml version='1.0' encoding='UTF-8' standalone='yes' ?>",
+             '<hierarchy rotation="0">']
+    stack, count = [0], 0
+    while count < node_number:
+        depth = len(stack)
+        x1, y1 = rnd.randint(0, 1070), rnd.randint(0, 1910)
+        x2, y2 = min(1080, x1 + rnd.randint(0, 600)), min(1920, y1 + rnd.randint(0, 400))
+        package = rnd.choice(["com.app"] * 30 + ["com.android.systemui", "android"])
+        attrs = f'index="{count}" text="{rnd.choice(["", " ", "hello"])}" ' \
+                f'resource-id="" class="{rnd.choice(CLASSES)}" ' \
+                f'package="{package}" content-desc="" ' \
+                f'checkable="{rnd.choice(["true", "false"])}" checked="false" ' \
+                f'clickable="{rnd.choice(["true", "false"])}" enabled="true" ' \
+                f'focusable="false" focused="false" scrollable="false" ' \
+                f'long-clickable="false" password="false" selected="false" ' \
+                f'visible-to-user="{rnd.choice(["true"] * 5 + ["false"])}" ' \
+                f'bounds="[{x1},{y1}][{x2},{y2}]"'
+        count += 1
+        if depth < 12 and rnd.random() < 0.4:
+            lines.append("  " * depth + f"<node {attrs}>")
+            stack.append(0)
+        else:
+            lines.append("  " * depth + f"<node {attrs} />")
+            while len(stack) > 1 and rnd.random() < 0.3:
+                stack.pop()
+                lines.append("  " * len(stack) + "</node>")
+    while len(stack) > 1:
+        stack.pop()
+        lines.append("  " * len(stack) + "</node>")
+    lines.append("</hierarchy>")
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def list_xmls(paths: list) -> list:
+    xmls = list()
+    for path in paths:
+        if not isdir(path):
+            xmls.append(path)
+            continue
+        for dirpath, _, filenames in walk(path):
+            xmls += [join(dirpath, n) for n in sorted(filenames)
+                     if n.endswith(".xml")]
+    return xmls
+
+
+def bench(xmls: list, repeat: int = 3, naive_xml: bool = False):
+    for only_visible in (True, False):
+        for xml_path in xmls:
+            a = XMLReader(xml_path, only_visible, naive_xml).node_dicts
+            b = XMLReader(xml_path, only_visible, naive_xml,
+                          streaming=True).node_dicts
+            assert a == b, f"different nodes in {xml_path}"
+    print(f"{len(xmls)} xmls, same nodes from both readers")
+
+    costs = dict()
+    for streaming in (False, True):
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            for xml_path in xmls:
+                XMLReader(xml_path, naive_xml=naive_xml, streaming=streaming)
+            cost = perf_counter() - start
+            best = cost if best is None else min(best, cost)
+        costs[streaming] = best
+        print(f"{'streaming' if streaming else 'minidom'}: "
+              f"{best * 1000 / len(xmls):.2f} ms per xml")
+    print(f"speedup: {costs[False] / costs[True]:.1f}x")
+
+
+def parse_arg_bench(input_args: list):
+    parser = argparse.ArgumentParser(description="Benchmark the xml readers")
+    parser.add_argument("input_path", nargs="*",
+                        help="xml files or folders of xmls. "
+                             "synthetic dumps are used if not given")
+    parser.add_argument("--nodes", default="1000,10000,50000", type=str,
+                        help="node numbers of the synthetic dumps")
+    parser.add_argument("--repeat", "-r", default=3, type=int)
+    parser.add_argument("--naivexml", "-n", action="store_true")
+    return parser.parse_args(input_args)
+
+
+if __name__ == "__main__":
+    args = parse_arg_bench(sys.argv[1:])
+    if args.input_path:
+        bench(list_xmls(args.input_path), args.repeat, args.naivexml)
+    else:
+        with TemporaryDirectory(prefix="bench_xml_") as tmp:
+            for n in [int(a) for a in args.nodes.split(",")]:
+                print(f"--- synthetic dump, {n} nodes")
+                dump = join(tmp, f"dump_{n}.xml")
+                gen_dump(dump, n)
+                bench([dump], args.repeat, args.naivexml)
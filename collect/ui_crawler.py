@@ -18,6 +18,7 @@ if rootpath not in sys.path:
 from util.util_log import Logger
 from util.util_xml import is_focus, remove_sysnode, \
     dump_activity_from_apk, read_all_nodes
+from util.util_nodes import NodeTable
 from util.util_file import cal_sha256
 from device import Device
 
@@ -289,19 +290,19 @@ class UICrawler:
             return handled_activity
 
         # get all interactive controls
-        controls = list()
+        controls = NodeTable.from_elements(list())
 
         # we wait up to 5 seconds until an interactive view displays
         # on the main page
         time_delay = 5
         ddl = time.time() + time_delay
         while len(controls) == 0 and time.time() < ddl:
-            controls = list()
             self.dom = self.device.get_current_dom()
             if self.dom is not None:
-                read_all_nodes(controls, self.dom)
-                controls = [self.get_dict(i) for i in controls]
-                controls = [i for i in controls if len(i) > 0]
+                nodes = list()
+                read_all_nodes(nodes, self.dom)
+                nodes = NodeTable.from_elements(nodes)
+                controls = nodes.take(nodes.interact)
                 self._logger.get_logger.info(f"Found {len(controls)} interactive controls on main activity.")
                 time.sleep(10)
 
@@ -309,15 +310,15 @@ class UICrawler:
         main_activity = self.device.get_current_activity()["activity"]
         self._logger.get_logger.info(f"main activity: {main_activity}")
 
-        for c in controls:
+        for i, center in enumerate(controls.centers().tolist()):
             try:
                 self._logger.get_logger.debug(f"starting: {main_activity}")
                 # here, the activity name already contains the package name
                 activity = self.device.start_activity(package_name, main_activity, force_stop=False)
                 self._logger.get_logger.info(f"current activity: {activity}")
-                center = (c['c1'], c['c2'])
-                self._logger.get_logger.info(f"now click: {c['name']}, "
-                                             f"center: {center}, text: {c['text']}")
+                center = tuple(center)
+                self._logger.get_logger.info(f"now click: {controls.name(i)}, "
+                                             f"center: {center}, text: {controls.texts[i]}")
                 self.device.click(*center)
                 self.device.click(*center)
                 time.sleep(10)
@@ -332,41 +333,6 @@ class UICrawler:
 
         return handled_activity
 
-    @staticmethod
-    def get_dict(node) -> dict:
-        """Given a hierarchy node, extract the corresponding
-        view's name, text, center if it is interactive
-
-        Args:
-            node: A node in hierarchy XML
-
-        Returns:
-            A dict. When the view is interactive, its 'c1' and 'c2'
-              note the center coordinate, and 'name' and 'text' provide
-              additional details. Otherwise, return an empty dict
-        """
-        _dict = dict()
-        interact = node.getAttribute('clickable').startswith('t') \
-                   or node.getAttribute('long-clickable').startswith('t') \
-                   or node.getAttribute('checkable').startswith('t')
-        if not interact:
-            return _dict
-
-        _dict['name'] = node.getAttribute('class')
-        bounds = node.getAttribute('bounds').replace(']', '').split('[')
-        if len(bounds) > 1:
-            lt = bounds[1].split(',')
-            rb = bounds[2].split(',')
-            lt = [int(i) for i in lt]
-            rb = [int(i) for i in rb]
-            _dict['c1'] = int(lt[0] + 0.5 * (rb[0] - lt[0]))
-            _dict['c2'] = int(lt[1] + 0.5 * (rb[1] - lt[1]))
-        else:
-            return dict()
-
-        _dict['text'] = node.getAttribute('text')
-        return _dict
-
     def handle_ui(self, package_name: str, activity: str, k: int,
                   handled_activity: set, opt_path: str,
                   save_control: bool = False) -> int:
@@ -2,15 +2,18 @@
 
 import argparse
 import csv
-import json
 import os
 import shutil
 import sys
 import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from os import makedirs, walk, listdir
 from os.path import exists, join
+from typing import Tuple
 
 import cv2
+import numpy as np
 
 curpath = os.path.abspath(os.path.dirname(__file__))
 rootpath = os.path.split(curpath)[0]
@@ -19,10 +22,115 @@ if rootpath not in sys.path:
 
 
 from xml2nodes import XMLReader
+from screen_size import read_image_size
+from util.util_json import load_json, iter_json_nodes
+from util.util_nodes import NodeTable
+
+VIEW_IMG_SIZE = 28
+# written into a view image folder once all its images are written,
+# with the image count
+DONE_MARKER = ".done"
+# written into a view image folder before its images are written, so
+# that a restart knows the folder is left by an interrupted extraction
+STARTED_MARKER = ".started"
+# the reidentification results, which are never deleted
+CLASSIFY_FILE = "classify.txt"
+# finished hierarchies of a dataset, "relative xml path\tview count"
+# per line, so that a restart skips them without touching the disk
+CHECKPOINT_NAME = ".extract_checkpoint"
+# decode flags for a gray screenshot at 1/n of its resolution. jpegs
+# are scaled inside the decoder, so the full image is never built
+REDUCED_READ_FLAGS = {1: cv2.IMREAD_GRAYSCALE,
+                      2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                      4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                      8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+
+def view_img_name(index: int, _class: str) -> str:
+    """ file name of a view image: {node index}_{class name}.jpg """
+    for _invalid_prefix in ['aux', 'com1', 'com2', 'prn', 'con', 'nul']:
+        if _class.startswith(_invalid_prefix):
+            _class = '_' + _class
+            break
+    return f"{index}_{_class}.jpg"
+
+
+def web_tag_name(tag: str) -> str:
+    """ a html tag in a view image name, with the characters that are
+    not letters or digits replaced by _ """
+    return "".join([c if c.isalnum() else "_" for c in tag])
+
+
+def crop_views(img: np.ndarray, views: NodeTable) -> list:
+    """ slice the views out of a decoded screenshot, without copying
+
+    Return:
+        (node index, view image) list. empty views are skipped
+    """
+    crops = list()
+    for i, (h1, v1, h2, v2) in enumerate(views.bounds.tolist()):
+        new_img = img[v1:v2, h1:h2]
+        if new_img.shape[0] == 0 or new_img.shape[1] == 0:
+            # the xml is not with the jpg
+            # (e.g., one is landscape and the other is not)
+            continue
+        crops.append((i, new_img))
+    return crops
+
+
+def read_reduced_screen(img_path: str, reduce: int) -> tuple:
+    """ decode a screenshot once, in gray and at 1/reduce of its size
+
+    Return:
+        ([h, w] uint8 image, (full width, full height)), or (None, None)
+        if the screenshot is missing or broken
+    """
+    if reduce not in REDUCED_READ_FLAGS:
+        raise ValueError(f"unsupported reduce factor: {reduce}")
+    img = cv2.imread(img_path, REDUCED_READ_FLAGS[reduce])
+    if img is None:
+        return None, None
+    # the header tells the exact full size, which the reduced one rounds
+    return img, read_image_size(img_path)
+
+
+def crop_views_reduced(img: np.ndarray, full_size: tuple, views: NodeTable,
+                       size: int = VIEW_IMG_SIZE) -> list:
+    """ `crop_views` on a reduced gray screenshot, with each view
+    resized to size x size by area interpolation. a view is kept or
+    skipped as `crop_views` does on the full screenshot
+
+    Args:
+        img (np.ndarray): the reduced screenshot, see `read_reduced_screen`
+        full_size (tuple): (width, height) of the full screenshot
+        views (NodeTable): views with bounds in the full screenshot
+        size (int): the output size
+
+    Return:
+        (node index, size x size uint8 image) list
+    """
+    full_w, full_h = full_size
+    h, w = img.shape[:2]
+    sx, sy = w / float(full_w), h / float(full_h)
+    crops = list()
+    for i, (h1, v1, h2, v2) in enumerate(views.bounds.tolist()):
+        # the same clipping as slicing the full screenshot
+        h1, h2, _ = slice(h1, h2).indices(full_w)
+        v1, v2, _ = slice(v1, v2).indices(full_h)
+        if h2 <= h1 or v2 <= v1:
+            continue
+        x1, y1 = min(int(h1 * sx), w - 1), min(int(v1 * sy), h - 1)
+        # keep at least a pixel of thin views
+        x2 = max(int(np.ceil(h2 * sx)), x1 + 1)
+        y2 = max(int(np.ceil(v2 * sy)), y1 + 1)
+        crops.append((i, cv2.resize(img[y1:y2, x1:x2], (size, size),
+                                    interpolation=cv2.INTER_AREA)))
+    return crops
 
 
 def extract_view_imgs_from_xml(xml_parent_dir: str, xml_name: str,
-                               skip_existance: bool, naive_xml: bool = False) -> int:
+                               skip_existance: bool, naive_xml: bool = False,
+                               streaming: bool = False, reduce: int = 0) -> int:
     """ use opencv to split a ui screenshot to extract its view images
 
     Args:
@@ -31,54 +139,128 @@ def extract_view_imgs_from_xml(xml_parent_dir: str, xml_name: str,
         skip_existance (bool): if true, skip the existance item
         naive_xml (bool): false when using uiautomator2 xml, if the hierarchy
             is dumped by naive adb, then true
+        streaming (bool): read the xml with the single pass expat reader
+        reduce (int): if set (1, 2, 4 or 8), decode the screenshot in gray
+            at 1/reduce of its size, and write 28x28 view images, which is
+            what the reidentification takes. see `crop_views_reduced`
     Return:
         view images count
     """
     save_path = join(xml_parent_dir, xml_name[:-4])
+    marker = join(save_path, DONE_MARKER)
     if exists(save_path):
         if skip_existance:
-            return len([a for a in listdir(save_path) if
-                        a.endswith('.jpg')])
-        else:
-            shutil.rmtree(save_path)
+            count = done_view_count(save_path)
+            if count is not None:
+                return count
+        clear_view_folder(save_path)
 
     # generate new files
-    makedirs(save_path)
+    makedirs(save_path, exist_ok=True)
+    open(join(save_path, STARTED_MARKER), mode='w').close()
 
-    view_list = XMLReader(join(xml_parent_dir, xml_name),
-                          naive_xml=naive_xml).node_dicts
+    views = XMLReader(join(xml_parent_dir, xml_name),
+                      naive_xml=naive_xml,
+                      streaming=streaming).table
     jpg_path = join(xml_parent_dir, f"{xml_name[:-4]}.jpg")
-    img = cv2.imread(jpg_path, 1)
+    if reduce > 0:
+        img, full_size = read_reduced_screen(jpg_path, reduce)
+    else:
+        img = cv2.imread(jpg_path, 1)
     if img is None:
+        write_done_marker(marker, 0)
         return 0
     k = 0
-    for i, n in enumerate(view_list):
-        _class = n['name']
-        for _invalid_prefix in ['aux', 'com1', 'com2', 'prn', 'con', 'nul']:
-            if _class.startswith(_invalid_prefix):
-                _class = '_' + _class
-                break
-        view_img_path = join(save_path, f"{i}_{_class}.jpg")
-        lt, rb = n["lt"], n["rb"]
-        (h1, v1), (h2, v2) = lt, rb
-        h1, v1, h2, v2 = int(h1), int(v1), int(h2), int(v2)
-
-        new_img = img[v1:v2, h1:h2]
-        if new_img.shape[0] == 0 or new_img.shape[1] == 0:
-            # the xml is not with the jpg
-            # (e.g., one is landscape and the other is not)
-            continue
+    names = views.names
+    crops = crop_views_reduced(img, full_size, views) if reduce > 0 \
+        else crop_views(img, views)
+    for i, new_img in crops:
+        view_img_path = join(save_path, view_img_name(i, names[i]))
         try:
             cv2.imwrite(view_img_path, new_img)
             k += 1
         except cv2.error as e:
             print(f'CV2ERR: {e} for', view_img_path)
+    write_done_marker(marker, k)
     return k
 
 
+def write_done_marker(marker: str, count: int):
+    """ mark a view image folder as finished, see `DONE_MARKER` """
+    with open(marker, mode='w') as f:
+        f.write(str(count))
+    started = join(os.path.dirname(marker), STARTED_MARKER)
+    if exists(started):
+        os.remove(started)
+
+
+def done_view_count(save_path: str) -> int or None:
+    """ the view images count of a finished view image folder, or None
+    if it has to be extracted again. a folder without `DONE_MARKER` is
+    finished unless an extraction started it (`STARTED_MARKER`) or it
+    is empty: it is written before the markers (by an older version, or
+    by reclass.py), or labelled already. the marker is then back-filled
+    with its jpg count """
+    marker = join(save_path, DONE_MARKER)
+    if exists(marker):
+        with open(marker, mode='r') as f:
+            return int(f.read() or 0)
+    if exists(join(save_path, STARTED_MARKER)):
+        return None
+    files = listdir(save_path)
+    count = len([a for a in files if a.endswith('.jpg')])
+    if count == 0 and CLASSIFY_FILE not in files:
+        return None
+    write_done_marker(marker, count)
+    return count
+
+
+def clear_view_folder(save_path: str):
+    """ remove the view images of a folder, but keep its `CLASSIFY_FILE` """
+    for name in listdir(save_path):
+        if name == CLASSIFY_FILE:
+            continue
+        path = join(save_path, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def _extract_chunk(task: tuple) -> list:
+    """ worker of `extract_view_imgs`
+
+    Return:
+        (xml path, view images count) list
+    """
+    xmls, skip_existance, naive_xml, streaming, reduce = task
+    return [(xml, extract_view_imgs_from_xml(xml[0], xml[1], skip_existance,
+                                              naive_xml, streaming, reduce))
+            for xml in xmls]
+
+
+def read_checkpoint(checkpoint: str) -> dict:
+    """ relative xml path -> view images count, see `CHECKPOINT_NAME` """
+    done = dict()
+    if not exists(checkpoint):
+        return done
+    with open(checkpoint, mode='r', encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                # a truncated line
+                break
+            xml, count = line[:-1].rsplit('\t', 1)
+            done[xml] = int(count)
+    return done
+
+
 def extract_view_imgs(folder: str, skip_existance: bool = True,
-                      naive_xml: bool = False):
-    """ walk a given folder and extract view images for all hierarchy trees in it
+                      naive_xml: bool = False, streaming: bool = False,
+                      reduce: int = 0, workers: int = 1, chunk_size: int = 64):
+    """ walk a given folder and extract view images for all hierarchy trees in it.
+    the finished hierarchies are kept in a checkpoint file in the folder,
+    and a view image folder gets a `DONE_MARKER` once it is complete, so
+    an interrupted run can be started again and continues where it stopped
 
     Args:
         folder (str): the target folder. Each subfolder in it contains
@@ -86,85 +268,223 @@ def extract_view_imgs(folder: str, skip_existance: bool = True,
         skip_existance (bool): if true, skip the existance items
         naive_xml (bool): false when using uiautomator2 xml, if the hierarchy
             is dumped by naive adb, then true
+        streaming (bool): read xmls with the single pass expat reader
+        reduce (int): see `extract_view_imgs_from_xml`
+        workers (int): number of processes
+        chunk_size (int): hierarchies per task of a process
     """
+    checkpoint = join(folder, CHECKPOINT_NAME)
+    done = read_checkpoint(checkpoint) if skip_existance else dict()
     all_xml = []
     for dirpath, dirname, filenames in walk(folder):
-        for name in filenames:
+        dirname.sort()
+        for name in sorted(filenames):
             if name.endswith('.xml'):
                 all_xml.append([dirpath, name])
     total = len(all_xml)
     k, total_views = 0, 0
+    todo = list()
     for xml in all_xml:
-        xml_parent_dir, xml_name = xml
-        views = extract_view_imgs_from_xml(xml_parent_dir, xml_name,
-                                           skip_existance, naive_xml)
-        k += 1
-        total_views += views
-        print(f'({k}/{total}) {xml}')
+        rel = os.path.relpath(join(*xml), folder).replace(os.sep, '/')
+        if rel in done:
+            k += 1
+            total_views += done[rel]
+        else:
+            todo.append(xml)
+    if k > 0:
+        print(f'{k}/{total} xmls are done in the checkpoint')
+    tasks = [(todo[i:i + chunk_size], skip_existance, naive_xml, streaming, reduce)
+             for i in range(0, len(todo), chunk_size)]
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_extract_chunk, tasks)
+    else:
+        pool = None
+        results = map(_extract_chunk, tasks)
+    with open(checkpoint, mode='w' if not skip_existance else 'a',
+              encoding='utf-8') as fc:
+        for result in results:
+            for xml, views in result:
+                rel = os.path.relpath(join(*xml), folder).replace(os.sep, '/')
+                fc.write(f'{rel}\t{views}\n')
+                k += 1
+                total_views += views
+                print(f'({k}/{total}) {xml}')
+            fc.flush()
+    if pool is not None:
+        pool.shutdown()
     print(f'done! {total_views} views in total.')
 
 
 def read_rico_json_nodes(nodes: list, o: dict):
-    """ read rico json files"""
-    if "componentLabel" in o:
-        nodes.append([*o["bounds"], o["componentLabel"]])
-    if "children" in o:
-        for c in o["children"]:
-            read_rico_json_nodes(nodes, c)
+    """ read rico json files. the labelled nodes are appended in pre-order
+    as [x1, y1, x2, y2, label] """
+    for n in iter_json_nodes(o):
+        if "componentLabel" in n:
+            nodes.append([*n["bounds"], n["componentLabel"]])
 
 
-def extract_view_imgs_from_rico(rico_root_path: str):
-    """
-    extract view images from rico dataset
+def read_rico_metas(rico_root_path: str, start: int = 0, end: int = None,
+                    shard: Tuple[int, int] = (0, 1)) -> list:
+    """ rows of `ui_details.csv` (ui index, app, trace, ui number in
+    trace) in a range, and in a shard of it (the rows whose position
+    modulo the shard count is the shard index). the header is skipped """
+    with open(join(rico_root_path, "ui_details.csv"), mode="r") as f:
+        metas = [line for line in csv.reader(f)
+                 if len(line) == 4 and line[0].isdigit()]
+    shard_index, shard_count = shard
+    return metas[start:end][shard_index::shard_count]
 
-    Args:
-        rico_root_path (str): the parent path where you put all rico files
-            (unzipped) in it
+
+def _extract_rico_chunk(task: tuple) -> tuple:
+    """ worker of `extract_view_imgs_from_rico`
+
+    Return:
+        uint8 [n, 28, 28] view images, their n labels, count of the
+        uis that are skipped
     """
+    rico_root_path, metas, img_path = task
     json_path = join(rico_root_path, "semantic_annotations")
-    metas = []
-    with open(join(rico_root_path, "ui_details.csv"), mode="r") as f:
-        f_csv = csv.reader(f)
-        for line in f_csv:
-            metas.append(line)
-    print("load meta csv done")
-    m = 0
-    for k, line in enumerate(metas[40000:]):
-        index, app, trace, number = line
-        with open(join(json_path, f"{index}.json"), mode="r", encoding="utf-8") as f:
-            jo = json.load(f)
+    xs, labels, skipped = list(), list(), 0
+    for index, app, trace, number in metas:
         jpg_path = join(rico_root_path, "filtered_traces",
                         app, f"trace_{trace}", "screenshots", f"{number}.jpg")
-
-        views = []
-        read_rico_json_nodes(views, jo)
-        ui_img = cv2.imread(jpg_path, 1)
-        ui_img_h, ui_img_w, _ = ui_img.shape
-        ui_img_original_h, ui_img_original_w, _ = cv2.imread(join(json_path, f"{index}.png")).shape
-        w_scale = float(ui_img_w) / ui_img_original_w
-        h_scale = float(ui_img_h) / ui_img_original_h
+        try:
+            jo = load_json(join(json_path, f"{index}.json"))
+            # the annotation png is only needed for its size
+            ui_img_original_w, ui_img_original_h = \
+                read_image_size(join(json_path, f"{index}.png"))
+        except (OSError, ValueError) as e:
+            print(f"skip rico ui {index}: {e}")
+            skipped += 1
+            continue
+        # we ignore the color of control images
+        ui_img = cv2.imread(jpg_path, cv2.IMREAD_GRAYSCALE)
         if ui_img is None:
+            skipped += 1
             continue
-        for n in views:
-            w1, h1, w2, h2, label = n
-            w1 = int(w1 * w_scale)
-            w2 = int(w2 * w_scale)
-            h1 = int(h1 * h_scale)
-            h2 = int(h2 * h_scale)
-            img = ui_img[h1:h2, w1:w2]
+        ui_img_h, ui_img_w = ui_img.shape
+        w_scale = float(ui_img_w) / ui_img_original_w
+        h_scale = float(ui_img_h) / ui_img_original_h
+        views = []
+        read_rico_json_nodes(views, jo)
+        for k, (w1, h1, w2, h2, label) in enumerate(views):
+            img = ui_img[int(h1 * h_scale):int(h2 * h_scale),
+                         int(w1 * w_scale):int(w2 * w_scale)]
             if img.shape[0] == 0 or img.shape[1] == 0:
                 continue
-            try:
-                img_save_path = join(rico_root_path, "views", label)
-                if not exists(img_save_path):
-                    makedirs(img_save_path)
-                cv2.imwrite(join(img_save_path, f"{m}.jpg"), img)
-                m += 1
-            except cv2.error as e:
-                print(f'CV2ERR: {e}')
+            if img_path:
+                # the ui index and the view order make a unique name
+                label_path = join(img_path, label)
+                makedirs(label_path, exist_ok=True)
+                cv2.imwrite(join(label_path, f"{index}_{k}.jpg"), img)
+            xs.append(cv2.resize(img, (VIEW_IMG_SIZE, VIEW_IMG_SIZE)))
+            labels.append(label)
+    x = np.stack(xs) if len(xs) > 0 \
+        else np.zeros((0, VIEW_IMG_SIZE, VIEW_IMG_SIZE), dtype=np.uint8)
+    return x, labels, skipped
+
+
+def save_packed_views(output_path: str, x: np.ndarray, labels: list):
+    """ write view images and their label names in the packed format
+    of `reclass.ImgDataSet`, with the class names sorted """
+    class_names = sorted(set(labels))
+    label_ids = {c: i for i, c in enumerate(class_names)}
+    makedirs(output_path, exist_ok=True)
+    np.save(join(output_path, "imgdata_x.npy"), x)
+    np.save(join(output_path, "imgdata_y.npy"),
+            np.array([label_ids[c] for c in labels], dtype=np.int16))
+    # written last, so a dataset with the class file is complete
+    with open(join(output_path, "imgdata_classes.txt"), mode='w',
+              encoding='utf-8') as f:
+        f.write(''.join(f"{c}\n" for c in class_names))
+    counts = Counter(labels)
+    for c in class_names:
+        print(c, counts[c])
+
+
+def merge_rico_shards(output_path: str, shard_count: int) -> bool:
+    """ pack the shards written by `extract_view_imgs_from_rico` into the
+    output folder, once all of them are there
+
+    Return:
+        whether the shards are merged
+    """
+    shard_files = [join(output_path, "shards", f"{i}_of_{shard_count}.npz")
+                   for i in range(shard_count)]
+    if not all(exists(f) for f in shard_files):
+        return False
+    xs, labels = list(), list()
+    for shard_file in shard_files:
+        with np.load(shard_file) as data:
+            xs.append(data["x"])
+            labels += data["labels"].tolist()
+    save_packed_views(output_path, np.concatenate(xs), labels)
+    return True
+
+
+def extract_view_imgs_from_rico(rico_root_path: str, output_path: str = "",
+                                start: int = 0, end: int = None,
+                                shard: Tuple[int, int] = (0, 1),
+                                workers: int = 1, chunk_size: int = 256,
+                                save_imgs: bool = False):
+    """
+    extract view images from rico dataset, and pack them as a view
+    image dataset (see `reclass.ImgDataSet`) whose classes are the rico
+    component labels. each worker process takes a chunk of uis and
+    returns their 28x28 gray view images
+
+    Args:
+        rico_root_path (str): the parent path where you put all rico files
+            (unzipped) in it
+        output_path (str): the dataset folder. default: views in
+            rico_root_path
+        start (int): the first ui (row of ui_details.csv) to extract
+        end (int): the ui to stop before. default: the last one
+        shard ((int, int)): (shard index, shard count). a shard takes every
+            shard count-th ui in the range and writes it into the "shards"
+            folder of the dataset. the dataset is packed when the last
+            shard is done, so shards can run on different machines
+        workers (int): number of processes
+        chunk_size (int): uis per task of a process
+        save_imgs (bool): also write the view images into a folder per
+            class, named {ui index}_{view order}.jpg
+    """
+    output_path = output_path or join(rico_root_path, "views")
+    metas = read_rico_metas(rico_root_path, start, end, shard)
+    print(f"load meta csv done, {len(metas)} uis to extract")
+    img_path = output_path if save_imgs else ""
+    tasks = [(rico_root_path, metas[i:i + chunk_size], img_path)
+             for i in range(0, len(metas), chunk_size)]
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_extract_rico_chunk, tasks)
+    else:
+        pool = None
+        results = map(_extract_rico_chunk, tasks)
+    xs, labels, skipped, k = list(), list(), 0, 0
+    for x, _labels, _skipped in results:
+        xs.append(x)
+        labels += _labels
+        skipped += _skipped
         k += 1
-        if k % 1000 == 0:
-            print(k)
+        print(f"({min(k * chunk_size, len(metas))}/{len(metas)}) "
+              f"{sum(len(a) for a in xs)} views")
+    if pool is not None:
+        pool.shutdown()
+    x = np.concatenate(xs) if len(xs) > 0 \
+        else np.zeros((0, VIEW_IMG_SIZE, VIEW_IMG_SIZE), dtype=np.uint8)
+    print(f"{len(x)} views, {skipped} uis skipped")
+    shard_index, shard_count = shard
+    if shard_count == 1:
+        save_packed_views(output_path, x, labels)
+        return
+    shard_path = join(output_path, "shards")
+    makedirs(shard_path, exist_ok=True)
+    np.savez(join(shard_path, f"{shard_index}_of_{shard_count}.npz"),
+             x=x, labels=np.array(labels, dtype=str))
+    if merge_rico_shards(output_path, shard_count):
+        print(f"all {shard_count} shards are packed into {output_path}")
 
 
 def extract_view_imgs_from_web(folder: str):
@@ -187,8 +507,7 @@ def extract_view_imgs_from_web(folder: str):
             continue
             
         try:
-            with open(json_path, mode="r", encoding="utf-8") as f:
-                jo = json.load(f)
+            jo = load_json(json_path)
             
             ui_img = cv2.imread(png_path, 1)
             if ui_img is None:
@@ -215,7 +534,9 @@ def extract_view_imgs_from_web(folder: str):
             # Since we are doing "Web" adaptation, we should probably adapt uihash.py to read json too.
             # But for this step (extraction), let's just focus on images.
             
-            for n in views:
+            # a view image is named by the node index in the json (the
+            # order of `XMLReader`), so that classify.txt matches the nodes
+            for i, n in enumerate(views):
                 # Rico format: [x1, y1, x2, y2, label]
                 w1, h1, w2, h2, label = n
                 w1, h1, w2, h2 = int(w1), int(h1), int(w2), int(h2)
@@ -235,10 +556,10 @@ def extract_view_imgs_from_web(folder: str):
                     continue
                 
                 try:
-                    # Save to screen_dir/m_label.jpg
+                    # Save to screen_dir/{node index}_label.jpg
                     # Sanitize label for filename
-                    safe_label = "".join([c if c.isalnum() else "_" for c in label])
-                    img_filename = f"{m}_{safe_label}.jpg"
+                    safe_label = web_tag_name(label)
+                    img_filename = f"{i}_{safe_label}.jpg"
                     cv2.imwrite(join(screen_dir_path, img_filename), img)
                     m += 1
                 except cv2.error as e:
@@ -268,6 +589,25 @@ def parse_arg_extract_view_images(input_args: list):
                              "and ignore it when using uiautomator2 xml")
     parser.add_argument("--skip", "-s", action="store_true", default=True,
                         help="skip the existance items")
+    parser.add_argument("--stream", action="store_true", default=False,
+                        help="read xmls in a single expat pass instead of a "
+                             "minidom tree")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="processes to extract view images")
+    parser.add_argument("--output", "-o", default="", type=str,
+                        help="with --rico, the view image dataset folder. "
+                             "default: views in input_path")
+    parser.add_argument("--start", default=0, type=int,
+                        help="with --rico, the first ui to extract")
+    parser.add_argument("--end", default=None, type=int,
+                        help="with --rico, the ui to stop before")
+    parser.add_argument("--shard", default="0/1", type=str,
+                        help="with --rico, shard index/shard count, e.g., 0/4")
+    parser.add_argument("--save_imgs", action="store_true",
+                        help="with --rico, also write view images per class")
+    parser.add_argument("--reduce", default=0, type=int, choices=[0, *REDUCED_READ_FLAGS],
+                        help="decode screenshots in gray at 1/reduce of their size "
+                             "and write 28x28 view images. 0: full size crops")
     _args = parser.parse_args(input_args)
     return _args
 
@@ -276,11 +616,17 @@ if __name__ == '__main__':
     args = parse_arg_extract_view_images(sys.argv[1:])
     t1 = time.perf_counter()
     if args.rico:
-        extract_view_imgs_from_rico(args.input_path)
+        shard_index, shard_count = (int(a) for a in args.shard.split('/'))
+        extract_view_imgs_from_rico(args.input_path, args.output,
+                                    args.start, args.end,
+                                    (shard_index, shard_count),
+                                    args.workers, save_imgs=args.save_imgs)
     elif args.web:
         extract_view_imgs_from_web(args.input_path)
     else:
         extract_view_imgs(args.input_path,
-                          skip_existance=args.skip, naive_xml=args.naivexml)
+                          skip_existance=args.skip, naive_xml=args.naivexml,
+                          streaming=args.stream, reduce=args.reduce,
+                          workers=args.workers)
     t2 = time.perf_counter()
     print("time cost:", t2 - t1)
@@ -0,0 +1,185 @@
+"""Skip the reidentification of views whose declared class is reliable.
+A gating policy is learned from a reidentified dataset: for each declared
+class name, how often the reidentified type of a view lands in the same
+UI# channel as `Nodes2Hash.declared_type` of its name. The classes that
+agree often enough go straight to their channel, without the CNN"""
+
+import argparse
+import ast
+import json
+import os
+import sys
+from os import walk
+from os.path import exists, join
+
+from label_store import LabelStore
+from nodes2hash import Nodes2Hash
+from xml2nodes import XMLReader
+
+
+class GatingPolicy:
+    """ Declared class name -> UIHash channel, for the classes whose
+    views skip the reidentification
+
+    Args:
+        classes (dict): declared class name -> channel
+        stats (dict): declared class name -> [views, agreed views] on
+          the labelled set the policy is learned from
+        target (float): the agreement a class needs to be gated
+        min_count (int): the views a class needs to be gated
+    """
+    def __init__(self, classes: dict, stats: dict = None,
+                 target: float = None, min_count: int = None):
+        self.classes = classes
+        self.stats = stats if stats is not None else dict()
+        self.target = target
+        self.min_count = min_count
+
+    @classmethod
+    def load(cls, path: str) -> 'GatingPolicy':
+        with open(path, mode='r', encoding='utf-8') as f:
+            policy = json.load(f)
+        return cls(policy["classes"], policy.get("stats"),
+                   policy.get("target"), policy.get("min_count"))
+
+    def save(self, path: str):
+        with open(path, mode='w', encoding='utf-8') as f:
+            json.dump({"target": self.target, "min_count": self.min_count,
+                       "classes": self.classes, "stats": self.stats},
+                      f, indent=1, sort_keys=True)
+
+    def channel(self, name: str) -> int or None:
+        """ The channel of a declared class, or None if its views have
+        to be reidentified """
+        return self.classes.get(name)
+
+    def agreement(self, skipped: dict) -> float or None:
+        """ The agreement measured on the labelled set, weighted by the
+        views skipped per class
+
+        Args:
+            skipped (dict): declared class name -> skipped views
+        """
+        total = sum(skipped.values())
+        if total == 0:
+            return None
+        agreed = 0.
+        for name, count in skipped.items():
+            views, agreed_views = self.stats.get(name, (0, 0))
+            agreed += count * (agreed_views / views if views > 0 else 0)
+        return agreed / total
+
+    def report(self, skipped: dict, views_total: int):
+        """ Print how many views are skipped, and their agreement """
+        skipped_total = sum(skipped.values())
+        if views_total == 0:
+            return
+        agreement = self.agreement(skipped)
+        print(f"gated views: {skipped_total}/{views_total} "
+              f"({skipped_total / float(views_total) * 100:.2f}%)" +
+              ("" if agreement is None else
+               f", measured label agreement: {agreement * 100:.2f}%"))
+
+
+def agree(name: str, label: int) -> bool:
+    """ Whether a reidentified type puts a view into the channel of its
+    declared class. The "others" type (-1) falls back to the declared
+    class when hashing, so it always agrees """
+    declared = Nodes2Hash.declared_type(name)
+    return label < 0 or label == declared
+
+
+def class_stats(root_path: str, naive_xml: bool = False) -> dict:
+    """ Per declared class agreement of a reidentified dataset. The
+    `classify.txt` files are read, and the label store of the dataset
+    if there is one (the class names then come from the hierarchies)
+
+    Returns:
+        declared class name -> [views, agreed views]
+    """
+    stats = dict()
+
+    def count(name: str, label: int):
+        if name not in stats:
+            stats[name] = [0, 0]
+        stats[name][0] += 1
+        stats[name][1] += int(agree(name, label))
+
+    seen = set()
+    for root, dirs, files in walk(root_path):
+        dirs[:] = sorted(d for d in dirs if d != LabelStore.DIR_NAME)
+        if "classify.txt" not in files:
+            continue
+        try:
+            with open(join(root, "classify.txt"), mode='r') as f:
+                raw_type_dict = ast.literal_eval(f.readline())
+        except (ValueError, SyntaxError) as e:
+            print(f"invalid classify.txt in {root}: {e}")
+            continue
+        for key, label in raw_type_dict.items():
+            count(key.split('_', 1)[1], label)
+        seen.add(os.path.relpath(root, root_path).replace(os.sep, '/'))
+
+    store = LabelStore.of_dataset(root_path)
+    for key in store.keys():
+        xml_path = join(root_path, f"{key}.xml")
+        if key in seen or not exists(xml_path):
+            continue
+        names = XMLReader(xml_path, naive_xml=naive_xml).table.names
+        for i, label in store.get(key).items():
+            if i < len(names):
+                count(names[i], label)
+    return stats
+
+
+def learn_gating_policy(root_path: str, target: float = 0.98,
+                        min_count: int = 50,
+                        naive_xml: bool = False) -> GatingPolicy:
+    """ Learn a gating policy from a reidentified dataset
+
+    Args:
+        root_path (str): the dataset, see `class_stats`
+        target (float): the agreement a class needs to be gated
+        min_count (int): the views a class needs to be gated, so that
+          rare classes are not gated by chance
+        naive_xml (bool): whether the hierarchies are dumped by naive adb
+    """
+    stats = class_stats(root_path, naive_xml)
+    classes = dict()
+    views_total, views_gated = 0, 0
+    print(f"{'declared class':<48}{'views':>8}{'agreement':>11}")
+    for name, (views, agreed) in sorted(stats.items(), key=lambda a: -a[1][0]):
+        rate = agreed / float(views)
+        views_total += views
+        gated = views >= min_count and rate >= target
+        if gated:
+            classes[name] = Nodes2Hash.declared_type(name)
+            views_gated += views
+        print(f"{name:<48}{views:>8}{rate * 100:>10.2f}%{' *' if gated else ''}")
+    if views_total > 0:
+        print(f"{len(classes)} classes gated (*), {views_gated}/{views_total} "
+              f"views ({views_gated / float(views_total) * 100:.2f}%) "
+              f"skip the reidentification")
+    return GatingPolicy(classes, stats, target, min_count)
+
+
+def parse_arg_gating(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Learn a gating policy from a reidentified dataset")
+    parser.add_argument("input_path", help="the reidentified dataset")
+    parser.add_argument("output_path", help="the policy json")
+    parser.add_argument("--target", "-t", default=0.98, type=float,
+                        help="the agreement a declared class needs to be gated")
+    parser.add_argument("--min_count", "-m", default=50, type=int,
+                        help="the views a declared class needs to be gated")
+    parser.add_argument("--naivexml", "-n", action="store_true",
+                        help="assign it when using naive adb")
+    return parser.parse_args(input_args)
+
+
+if __name__ == '__main__':
+    args = parse_arg_gating(sys.argv[1:])
+    policy = learn_gating_policy(args.input_path, args.target,
+                                 args.min_count, args.naivexml)
+    policy.save(args.output_path)
+    print(f"policy saved: {args.output_path}")
@@ -0,0 +1,149 @@
+"""A persistent cache of reidentified view types, shared across runs and
+processes. Repackaged apps and app families reuse the same widgets, so
+most crops of a large dataset have been classified before"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from os.path import exists
+
+import numpy as np
+
+
+def crop_key(img: np.ndarray) -> bytes:
+    """ Content hash of a normalized crop, i.e., the 28x28 uint8 gray
+    image that the model takes """
+    return hashlib.blake2b(np.ascontiguousarray(img, dtype=np.uint8).tobytes(),
+                           digest_size=16).digest()
+
+
+def model_fingerprint(model_path: str, *settings) -> str:
+    """ Hash of a model file and the settings that change its labels,
+    e.g., the confidence threshold """
+    h = hashlib.blake2b(digest_size=16)
+    with open(model_path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    for s in settings:
+        h.update(repr(s).encode('utf-8'))
+    return h.hexdigest()
+
+
+class LabelCache:
+    """ Crop content hash -> view type, kept in a sqlite file. The cache
+    belongs to one model fingerprint: when it is opened with another
+    one, i.e., the model file or the threshold changed, it is emptied.
+    The least recently used entries are evicted beyond `max_entries`.
+    Several processes can share the file
+
+    Args:
+        path (str): the sqlite file
+        fingerprint (str): see `model_fingerprint`
+        max_entries (int): the capacity, 0 for no limit
+    """
+    def __init__(self, path: str, fingerprint: str, max_entries: int = 1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        folder = os.path.dirname(os.path.abspath(path))
+        if not exists(folder):
+            os.makedirs(folder)
+        self._conn = sqlite3.connect(path, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta "
+                               "(name TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS labels (key BLOB "
+                               "PRIMARY KEY, label INTEGER, used INTEGER) "
+                               "WITHOUT ROWID")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS labels_used "
+                               "ON labels (used)")
+            row = self._conn.execute("SELECT value FROM meta WHERE "
+                                     "name = 'fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                if row is not None:
+                    print(f"model changed, clear the label cache {path}")
+                self._conn.execute("DELETE FROM labels")
+                self._conn.execute("INSERT OR REPLACE INTO meta VALUES "
+                                   "('fingerprint', ?)", (fingerprint,))
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM labels").fetchone()[0]
+
+    def get(self, keys: list) -> dict:
+        """ The cached labels of some crop keys, see `crop_key`. The hit
+        entries are marked as recently used
+
+        Returns:
+            crop key -> view type, for the keys in the cache
+        """
+        found = dict()
+        keys = list(set(keys))
+        # stay below the sqlite limit of host parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            found.update(self._conn.execute(
+                f"SELECT key, label FROM labels WHERE key IN "
+                f"({','.join('?' * len(chunk))})", chunk).fetchall())
+        if found:
+            now = time.time_ns()
+            with self._conn:
+                self._conn.executemany("UPDATE labels SET used = ? WHERE key = ?",
+                                       [(now, k) for k in found])
+        return found
+
+    def put(self, labels: dict):
+        """ Add crop key -> view type entries, and evict the least
+        recently used ones beyond the capacity """
+        if not labels:
+            return
+        now = time.time_ns()
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO labels VALUES (?, ?, ?)",
+                                   [(k, int(v), now) for k, v in labels.items()])
+            if self.max_entries > 0:
+                extra = len(self) - self.max_entries
+                if extra > 0:
+                    self._conn.execute("DELETE FROM labels WHERE key IN (SELECT "
+                                       "key FROM labels ORDER BY used LIMIT ?)",
+                                       (extra,))
+                    self.evictions += extra
+
+    def labels(self, imgs: np.ndarray, classify) -> list:
+        """ View types of a batch of crops. Only the crops missing in the
+        cache are classified, and each distinct one only once
+
+        Args:
+            imgs (np.ndarray): [n, 28, 28] uint8 gray crops
+            classify: the function to label crops missing in the cache,
+              which takes and returns like this one
+
+        Returns:
+            View types, in the order of imgs
+        """
+        keys = [crop_key(img) for img in imgs]
+        labels = self.get(keys)
+        missed = dict()
+        for j, k in enumerate(keys):
+            if k not in labels and k not in missed:
+                missed[k] = j
+        # repeated crops in the batch are counted as hits
+        self.hits += len(keys) - len(missed)
+        self.misses += len(missed)
+        if missed:
+            new = dict(zip(missed, classify(imgs[list(missed.values())])))
+            self.put(new)
+            labels.update(new)
+        return [labels[k] for k in keys]
+
+    def report(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return
+        print(f"label cache: {self.hits} hits, {self.misses} misses "
+              f"({self.hits / float(total) * 100:.2f}% hit), "
+              f"{self.evictions} evictions, {len(self)} entries")
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,248 @@
+"""A dataset-level store for the reidentified view types, which
+replaces the per-screen `classify.txt` files"""
+
+import argparse
+import ast
+import os
+import sys
+from os import makedirs, walk
+from os.path import exists, join
+from typing import Tuple
+
+import numpy as np
+
+
+class LabelStore:
+    """ Reidentified view types of all the UIs in a dataset. A UI is
+    keyed by the path of its view image folder relative to the dataset
+    folder, i.e., "pkg/xml name without extension" for apps, or the
+    screen folder name for web pages.
+
+    The store is a folder of three append-only files: `nodes.i32`
+    (node indexes) and `labels.i8` (view types) hold the columns, and
+    `screens.txt` has a "key offset count sequence" line per record. A
+    UI can be written more than once, and the latest record wins. The
+    sequence numbers the writes, and `compact` keeps them, so that it
+    tells whether a UI is labeled again (see `version`). The columns are
+    written before the index line, so an interrupted write leaves no
+    visible record. Only one process should write at a time
+
+    Args:
+        path (str): the store folder
+    """
+    DIR_NAME = ".label_store"
+    INDEX_FILE = "screens.txt"
+    NODE_FILE = "nodes.i32"
+    LABEL_FILE = "labels.i8"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records = dict()
+        self._nodes = None
+        self._labels = None
+        self._size = 0
+        self._sequence = 0
+        index_file = join(path, self.INDEX_FILE)
+        if exists(index_file):
+            label_file = join(path, self.LABEL_FILE)
+            size = os.path.getsize(label_file) if exists(label_file) else 0
+            with open(index_file, mode='r', encoding='utf-8') as f:
+                for k, line in enumerate(f):
+                    if not line.endswith('\n'):
+                        # a truncated line
+                        break
+                    fields = line[:-1].rsplit(' ', 3)
+                    if len(fields) == 3:
+                        # a line without a sequence, numbered by its place
+                        fields.append(k + 1)
+                    key, offset, count, sequence = fields
+                    offset, count, sequence = int(offset), int(count), int(sequence)
+                    self._sequence = max(self._sequence, sequence)
+                    if offset + count <= size:
+                        self._records[key] = (offset, count, sequence)
+            self._size = size
+
+    @classmethod
+    def of_dataset(cls, folder: str) -> 'LabelStore':
+        """ The store kept in a dataset folder """
+        return cls(join(folder, cls.DIR_NAME))
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        return '/'.join(parts)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._records
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def keys(self) -> list:
+        return list(self._records)
+
+    def version(self, key: str) -> int or None:
+        """ The sequence number of the latest record of a UI. It
+        increases whenever the UI is labeled again, and is kept by
+        `compact` """
+        record = self._records.get(key)
+        return None if record is None else record[2]
+
+    def _load_columns(self):
+        if self._nodes is None or len(self._labels) < self._size:
+            self._nodes = np.fromfile(join(self.path, self.NODE_FILE),
+                                      dtype='<i4', count=self._size)
+            self._labels = np.fromfile(join(self.path, self.LABEL_FILE),
+                                       dtype=np.int8, count=self._size)
+
+    def get(self, key: str) -> dict or None:
+        """ node index -> view type of a UI, or None if it is not
+        in the store. -1 means the "others" type """
+        record = self._records.get(key)
+        if record is None:
+            return None
+        self._load_columns()
+        offset, count, _ = record
+        return dict(zip(self._nodes[offset:offset + count].tolist(),
+                        self._labels[offset:offset + count].tolist()))
+
+    def put(self, key: str, node_indexes: list, labels: list):
+        """ Append the view types of a UI
+
+        Args:
+            key (str): the UI key, see `LabelStore`
+            node_indexes (list): node indexes in the hierarchy
+            labels (list): view types, from -1 to 127
+        """
+        if '\n' in key:
+            raise ValueError(f"invalid key for the label store: {key}")
+        if not exists(self.path):
+            makedirs(self.path)
+        nodes = np.asarray(node_indexes, dtype='<i4')
+        labels = np.asarray(labels, dtype=np.int8)
+        if len(nodes) != len(labels):
+            raise ValueError("node indexes and labels differ in length")
+        # continue from the real end of the columns, in case the
+        # last write was interrupted
+        label_file = join(self.path, self.LABEL_FILE)
+        offset = os.path.getsize(label_file) if exists(label_file) else 0
+        with open(join(self.path, self.NODE_FILE), mode='r+b'
+                  if exists(join(self.path, self.NODE_FILE)) else 'wb') as f:
+            f.seek(offset * 4)
+            f.write(nodes.tobytes())
+            f.truncate()
+        with open(label_file, mode='ab') as f:
+            f.write(labels.tobytes())
+        with open(join(self.path, self.INDEX_FILE), mode='a',
+                  encoding='utf-8') as f:
+            f.write(f"{key} {offset} {len(labels)} {self._sequence + 1}\n")
+        self._sequence += 1
+        self._records[key] = (offset, len(labels), self._sequence)
+        self._size = offset + len(labels)
+
+    def compact(self):
+        """ Rewrite the store with the latest records only. Their
+        sequence numbers are kept, so no UI looks relabeled """
+        self._load_columns()
+        keys = sorted(self._records)
+        records = [self._records[k] for k in keys]
+        tmp = f"{self.path}.tmp"
+        if not exists(tmp):
+            makedirs(tmp)
+        offset = 0
+        with open(join(tmp, self.NODE_FILE), mode='wb') as fn, \
+                open(join(tmp, self.LABEL_FILE), mode='wb') as fl, \
+                open(join(tmp, self.INDEX_FILE), mode='w', encoding='utf-8') as fi:
+            for key, (start, count, sequence) in zip(keys, records):
+                fn.write(self._nodes[start:start + count].tobytes())
+                fl.write(self._labels[start:start + count].tobytes())
+                fi.write(f"{key} {offset} {count} {sequence}\n")
+                offset += count
+        for name in (self.INDEX_FILE, self.NODE_FILE, self.LABEL_FILE):
+            os.replace(join(tmp, name), join(self.path, name))
+        os.rmdir(tmp)
+        self.__init__(self.path)
+
+
+def load_type_dict(store: LabelStore, pkg: str, xml: str,
+                   names: list) -> dict or None:
+    """ `Nodes2Hash.load_type_dict`, but read from a label store. The
+    app key is tried first, then the web one (the app folder itself)
+
+    Args:
+        store (LabelStore): the label store of the dataset
+        pkg (str): the app folder
+        xml (str): the hierarchy file name
+        names (list): class names of the nodes, used as the declared types
+    """
+    labels = store.get(LabelStore.key(pkg, os.path.splitext(xml)[0]))
+    if labels is None:
+        labels = store.get(pkg)
+    if labels is None:
+        return None
+    return {str(i): (names[i] if i < len(names) else '', label)
+            for i, label in labels.items()}
+
+
+def read_classify_file(classify_file: str) -> Tuple[list, list]:
+    """ Node indexes and view types in a `classify.txt`, whose keys are
+    "{node index}_{declared type}" """
+    with open(classify_file, mode='r') as f:
+        raw_type_dict = ast.literal_eval(f.readline())
+    indexes, labels = list(), list()
+    for key, label in raw_type_dict.items():
+        indexes.append(int(key.split('_', 1)[0]))
+        labels.append(label)
+    return indexes, labels
+
+
+def import_classify_files(folder: str, store: LabelStore = None,
+                          skip_existance: bool = True) -> LabelStore:
+    """ Import the `classify.txt` files under a dataset folder into its
+    label store. A UI is keyed by the folder of its `classify.txt`
+
+    Args:
+        folder (str): the dataset folder
+        store (LabelStore): default: the store in the dataset folder
+        skip_existance (bool): skip the UIs already in the store
+    """
+    if store is None:
+        store = LabelStore.of_dataset(folder)
+    k = 0
+    for root, dirs, files in walk(folder):
+        dirs[:] = sorted(d for d in dirs if d != LabelStore.DIR_NAME)
+        if "classify.txt" not in files:
+            continue
+        key = os.path.relpath(root, folder).replace(os.sep, '/')
+        if skip_existance and key in store:
+            continue
+        try:
+            indexes, labels = read_classify_file(join(root, "classify.txt"))
+        except (ValueError, SyntaxError) as e:
+            print(f"invalid classify.txt in {root}: {e}")
+            continue
+        store.put(key, indexes, labels)
+        k += 1
+    print(f"{k} uis imported into {store.path}")
+    return store
+
+
+def parse_arg_label_store(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Manage the label store of a dataset")
+    parser.add_argument("command", choices=["import", "compact"],
+                        help="import: import the classify.txt files in a "
+                             "dataset. compact: drop the outdated records")
+    parser.add_argument("input_path", help="the dataset path")
+    parser.add_argument("--notskip", "-s", action="store_false",
+                        help="re-import the uis already in the store")
+    return parser.parse_args(input_args)
+
+
+if __name__ == '__main__':
+    args = parse_arg_label_store(sys.argv[1:])
+    if args.command == "import":
+        import_classify_files(args.input_path, skip_existance=args.notskip)
+    else:
+        label_store = LabelStore.of_dataset(args.input_path)
+        label_store.compact()
+        print(f"{len(label_store)} uis in {label_store.path}")
@@ -1,13 +1,28 @@
 """Given XML nodes, generate UI#"""
 
 from typing import Tuple
-import PIL
 import numpy as np
-from util.util_math import get_iou, amp_small_scaler
-from PIL import Image
 from os.path import join
-from xml2nodes import XMLReader
 import os
+import sys
+
+curpath = os.path.abspath(os.path.dirname(__file__))
+rootpath = os.path.split(curpath)[0]
+if rootpath not in sys.path:
+    sys.path.append(rootpath)
+
+from util.util_math import get_iou, get_iou_matrix, \
+    amp_small_scaler, amp_small_scaler_array
+from util.util_nodes import NodeTable
+from xml2nodes import XMLReader
+from screen_size import probe_screen_size
+
+
+# legacy: the original per-grid loop
+# exact: numpy batch IoU, bit-for-bit equal to legacy
+# fast: numpy batch IoU and vectorized amplification, equal to
+#   legacy up to floating point rounding
+ENGINES = ("exact", "fast", "legacy")
 
 
 class Nodes2Hash:
@@ -16,15 +31,28 @@ class Nodes2Hash:
     Args:
         channels (int): the expected channel number in UIHash
         h_v_ticks ((int, int)): the grid size for each channel
+        engine (str): how to calculate UIHash, one of `ENGINES`
 
     Attributes:
         channels (int): UIHash channel number
+        engine (str): the hashing engine in use
+        grid_size ((int, int)): the grid size for each channel
     """
-    def __init__(self, h_v_ticks: Tuple[int, int], channels: int):
+    def __init__(self, h_v_ticks: Tuple[int, int], channels: int,
+                 engine: str = "exact"):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine}, "
+                             f"choose from {', '.join(ENGINES)}")
         self._screen_h, self._screen_v = 0, 0
         self._h_tick = h_v_ticks[0]
         self._v_tick = h_v_ticks[1]
+        self._grid_cache = None
         self.channels = channels
+        self.engine = engine
+
+    @property
+    def grid_size(self) -> Tuple[int, int]:
+        return self._h_tick, self._v_tick
 
     @staticmethod
     def fine_tune_grid_lt(num: float, tick: int, size: float,
@@ -121,8 +149,10 @@ class Nodes2Hash:
             n['grids'] = (h_1, v_1, h_2, v_2)
             n['area'] = width * height
 
-    def gen_uihash(self, xml_path: str, nodes: list = None,
-                   naive_xml: bool = False) -> np.array:
+    def gen_uihash(self, xml_path: str, nodes: NodeTable or list = None,
+                   naive_xml: bool = False,
+                   screen_size: Tuple[int, int] = None,
+                   type_dict: dict = None) -> np.array:
         """ Given a hierarchy xml, generate uihash. If the view is
         already out-of-screen, then the view will be skipped.
         The value in a grid will be originally given by the IoU
@@ -133,31 +163,217 @@ class Nodes2Hash:
         then we compromise to the claimed view type.
 
         Args:
-            nodes (list): view nodes in ui. if not provided, parse xml
-              nodes here
+            nodes (NodeTable or list): view nodes in ui. if not provided,
+              parse xml nodes here
             xml_path (str): the input hierarchy file.
             naive_xml (bool): false when use uiautomator2 xml, if the hierarchy
               is dumped by naive adb, then true
+            screen_size ((int, int)): screen width and height. if not
+              provided, read it from the screenshot header
+            type_dict (dict): see `load_type_dict`. if not provided,
+              read it from the `classify.txt` of the UI
         """
         if nodes is None:
-            nodes = XMLReader(xml_path, naive_xml=naive_xml).node_dicts
-        base_path = os.path.splitext(xml_path)[0]
-        try:
-            if os.path.exists(f"{base_path}.jpg"):
-                img = Image.open(f"{base_path}.jpg")
-            elif os.path.exists(f"{base_path}.png"):
-                img = Image.open(f"{base_path}.png")
-            else:
-                # Fallback to original logic if neither exists (though unlikely)
-                img = Image.open(f"{xml_path[:-4]}.jpg")
-        except PIL.UnidentifiedImageError:
-            print(f"unable to load image for {base_path}")
+            nodes = XMLReader(xml_path, naive_xml=naive_xml).table
+        if screen_size is None:
+            screen_size = probe_screen_size(xml_path)
+            if screen_size is None:
+                return None
+
+        if type_dict is None:
+            type_dict = self.load_type_dict(xml_path)
+        if type_dict is None:
             return None
-        except FileNotFoundError:
-            print(f"image for {base_path} not exists")
+        return self.hash_nodes(nodes, screen_size, type_dict)
+
+    @staticmethod
+    def load_type_dict(xml_path: str) -> dict or None:
+        """ Read the reidentified view types of a UI from its `classify.txt`
+
+        Args:
+            xml_path (str): the input hierarchy file
+
+        Returns:
+            A dict mapping node index (str) to (declared type, reidentified
+              type), or None if the classify file is missing
+        """
+        # Try Android path first (subdirectory named after xml)
+        type_file = join(os.path.splitext(xml_path)[0], "classify.txt")
+        if not os.path.exists(type_file):
+            # Try Web path (same directory as json/xml)
+            type_file = join(os.path.dirname(xml_path), "classify.txt")
+
+        if not os.path.exists(type_file):
+            print(f"classify.txt not found for {xml_path}")
             return None
-        self._screen_h = img.size[0]
-        self._screen_v = img.size[1]
+
+        type_dict = dict()
+        with open(type_file, mode='r') as f:
+            raw_type_dict = eval(f.readline())
+        for key in raw_type_dict:
+            index, original_type = key.split('_', 1)
+            reidentified_type = raw_type_dict[key]
+            type_dict[index] = (original_type, reidentified_type)
+        return type_dict
+
+    @staticmethod
+    def declared_type(ori_type: str) -> int:
+        """ Map a declared class name to a UIHash channel. It is used
+        when the reidentification model is not confident enough
+
+        Args:
+            ori_type (str): the declared class name of a view
+        """
+        if "RadioB" in ori_type:
+            return 1
+        elif "ToggleB" in ori_type:
+            return 6
+        elif "Button" in ori_type:
+            return 0
+        elif "Check" in ori_type:
+            return 1
+        elif "ListView" in ori_type:
+            return 3
+        elif "TextView" in ori_type:
+            return 5
+        elif "EditT" in ori_type:
+            return 2
+        elif "Switch" in ori_type:
+            return 6
+        elif "CompoundButton" in ori_type:
+            return 1
+        elif "TabW" in ori_type or "$Tab" in ori_type:
+            return 4
+        elif "Spinner" in ori_type:
+            return 7
+        elif "Bar" in ori_type:
+            return 7
+        else:
+            return 7
+
+    def _iou_threshold(self) -> float:
+        """ When the iou is only a tiny part of the view, we dont
+        consider it. The threshold depends on the grid size """
+        if self._h_tick == self._v_tick == 5:
+            return 0.07
+        elif self._h_tick == 4 and self._v_tick == 3:
+            return 0.12
+        elif self._h_tick == 2 and self._v_tick == 2:
+            return 0.2
+        return -1
+
+    def _grid_boxes(self) -> np.array:
+        """ (h_tick * v_tick, 4) boundaries of the grids on the current
+        screen. The arithmetic is the same as the legacy loop """
+        key = (self._screen_h, self._screen_v)
+        if self._grid_cache is not None and self._grid_cache[0] == key:
+            return self._grid_cache[1]
+        size_unit_h = float(self._screen_h) / self._h_tick
+        size_unit_v = float(self._screen_v) / self._v_tick
+        cells = np.arange(self._v_tick * self._h_tick)
+        h1 = (cells % self._h_tick) * size_unit_h
+        v1 = (cells // self._h_tick) * size_unit_v
+        boxes = np.stack((h1, v1, h1 + size_unit_h, v1 + size_unit_v), axis=1)
+        self._grid_cache = (key, boxes)
+        return boxes
+
+    def area4grids(self, nodes: NodeTable) -> Tuple[np.array, np.array]:
+        """ Batch version of the per-grid IoU loop. Builds the
+        (nodes x grids) IoU matrix in one broadcast, and masks the
+        grids which only cover a tiny part of a view
+
+        Args:
+            nodes (NodeTable): input nodes
+
+        Returns:
+            A bool array telling whether a node is on the screen, and
+              the (nodes x grids) matrix of accepted IoU values. The
+              rows for off-screen nodes are zeros
+        """
+        n_grids = self._h_tick * self._v_tick
+        if len(nodes) == 0:
+            return np.zeros(0, dtype=bool), np.zeros((0, n_grids))
+        h, v = self._screen_h, self._screen_v
+        bounds = nodes.bounds.astype(np.float64)
+        # if the left top corner out of the right/bottom bounds
+        # of screen, or the right bottom corner out of the left/top
+        # bounds, skip the view
+        on_screen = (bounds[:, 0] < h) & (bounds[:, 1] < v) & \
+                    (bounds[:, 2] >= 0) & (bounds[:, 3] >= 0)
+
+        iou = get_iou_matrix(bounds, self._grid_boxes())
+        width = (bounds[:, 2] - bounds[:, 0]) / (float(h) / self._h_tick)
+        height = (bounds[:, 3] - bounds[:, 1]) / (float(v) / self._v_tick)
+        area = width * height  # n area (compared to one grid)
+        valid = on_screen & (area != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accepted = (iou / area[:, None]) > self._iou_threshold()
+        accepted &= valid[:, None]
+        return on_screen, np.where(accepted, iou, 0.)
+
+    def hash_nodes(self, nodes: NodeTable or list,
+                   screen_size: Tuple[int, int],
+                   type_dict: dict) -> np.array:
+        """ Generate uihash from parsed nodes
+
+        Args:
+            nodes (NodeTable or list): view nodes in ui
+            screen_size ((int, int)): screen width and height
+            type_dict (dict): node index (str) -> (declared type,
+              reidentified type), see `load_type_dict`
+        """
+        self._screen_h, self._screen_v = screen_size
+        if self.engine == "legacy":
+            if isinstance(nodes, NodeTable):
+                nodes = nodes.to_dicts()
+            return self._hash_nodes_legacy(nodes, type_dict)
+        if not isinstance(nodes, NodeTable):
+            nodes = NodeTable.from_dicts(nodes)
+
+        on_screen, area = self.area4grids(nodes)
+        mat = np.zeros((self.channels, self._h_tick * self._v_tick))
+        indexes, channels = [], []
+        for i in np.flatnonzero(on_screen):
+            key = str(i)
+            if key not in type_dict:
+                continue
+            ori_type, _c = type_dict[key]
+            if _c < 0:
+                # use the declared class name instead
+                _c = self.declared_type(ori_type)
+            indexes.append(i)
+            channels.append(_c)
+
+        if self.engine == "exact":
+            # each view re-amplifies its whole channel, so the
+            # accumulation is sequential. amp(0) is exactly 0, hence
+            # only non-zero grids need the (scalar) log
+            for i, _c in zip(indexes, channels):
+                mat[_c] += area[i]
+                row = mat[_c]
+                nz = np.flatnonzero(row)
+                row[nz] = [amp_small_scaler(x) for x in row[nz]]
+            return mat
+
+        # fast engine: the k-th view of every channel is scattered in
+        # the same step, so the loop runs max(views per channel) times
+        channels = np.array(channels, dtype=np.int64)
+        indexes = np.array(indexes, dtype=np.int64)
+        ranks = np.zeros(len(channels), dtype=np.int64)
+        seen = dict()
+        for k, _c in enumerate(channels.tolist()):
+            ranks[k] = seen.get(_c, 0)
+            seen[_c] = ranks[k] + 1
+        for r in range(int(ranks.max()) + 1 if len(ranks) else 0):
+            step = ranks == r
+            _cs = channels[step]
+            np.add.at(mat, _cs, area[indexes[step]])
+            mat[_cs] = amp_small_scaler_array(mat[_cs])
+        return mat
+
+    def _hash_nodes_legacy(self, nodes: list, type_dict: dict) -> np.array:
+        """ The original per-grid implementation. It is kept as the
+        reference for the batch engines """
         for n in nodes:
             h, v = self._screen_h, self._screen_v
             # if the left top corner out of the
@@ -190,35 +406,11 @@ class Nodes2Hash:
                     continue
                 # when the iou is only a tiny part of the view
                 # we dont consider it
-                t = -1
-                if self._h_tick == self._v_tick == 5:
-                    t = 0.07
-                elif self._h_tick == 4 and self._v_tick == 3:
-                    t = 0.12
-                elif self._h_tick == 2 and self._v_tick == 2:
-                    t = 0.2
+                t = self._iou_threshold()
                 if iou / area > t:
                     n['area4grids'][i] = iou
 
         mat = np.zeros((self.channels, self._h_tick * self._v_tick))
-        type_dict = dict()
-        
-        # Try Android path first (subdirectory named after xml)
-        type_file = join(xml_path[:-4], "classify.txt")
-        if not os.path.exists(type_file):
-            # Try Web path (same directory as json/xml)
-            type_file = join(os.path.dirname(xml_path), "classify.txt")
-            
-        if not os.path.exists(type_file):
-             print(f"classify.txt not found for {xml_path}")
-             return None
-
-        with open(type_file, mode='r') as f:
-            raw_type_dict = eval(f.readline())
-        for key in raw_type_dict:
-            index, original_type = key.split('_', 1)
-            reidentified_type = raw_type_dict[key]
-            type_dict[index] = (original_type, reidentified_type)
         for i, n in enumerate(nodes):
             if "area4grids" not in n:
                 continue
@@ -231,35 +423,43 @@ class Nodes2Hash:
                 continue
             if _c < 0:
                 # use the declared class name instead
-                if "RadioB" in ori_type:
-                    _c = 1
-                elif "ToggleB" in ori_type:
-                    _c = 6
-                elif "Button" in ori_type:
-                    _c = 0
-                elif "Check" in ori_type:
-                    _c = 1
-                elif "ListView" in ori_type:
-                    _c = 3
-                elif "TextView" in ori_type:
-                    _c = 5
-                elif "EditT" in ori_type:
-                    _c = 2
-                elif "Switch" in ori_type:
-                    _c = 6
-                elif "CompoundButton" in ori_type:
-                    _c = 1
-                elif "TabW" in ori_type or "$Tab" in ori_type:
-                    _c = 4
-                elif "Spinner" in ori_type:
-                    _c = 7
-                elif "Bar" in ori_type:
-                    _c = 7
-                else:
-                    _c = 7
+                _c = self.declared_type(ori_type)
 
             for j, k in enumerate(n['area4grids']):
                 mat[_c][j] += k
             # update the values
             mat[_c] = [amp_small_scaler(i) for i in mat[_c]]
         return mat
+
+
+if __name__ == '__main__':
+    # regression: the batch engines against the legacy loop
+    from random import randint, random, seed
+    seed(0)
+    for grid in [(5, 5), (4, 3), (2, 2), (10, 10), (3, 3)]:
+        legacy = Nodes2Hash(grid, 8, engine="legacy")
+        exact = Nodes2Hash(grid, 8, engine="exact")
+        fast = Nodes2Hash(grid, 8, engine="fast")
+        for _ in range(300):
+            size = (randint(200, 1440), randint(300, 2560))
+            nodes, types = [], dict()
+            for k in range(randint(0, 60)):
+                x1, y1 = randint(-100, size[0] + 50), randint(-100, size[1] + 50)
+                x2 = x1 + randint(-5, size[0])
+                y2 = y1 + randint(-5, size[1])
+                if random() < 0.05:
+                    x2 = x1
+                name = ["Button", "TextView", "ImageView", "EditText",
+                        "CheckBox", "Switch", "View"][randint(0, 6)]
+                nodes.append({"name": f"android.widget.{name}",
+                              "lt": [str(x1), str(y1)],
+                              "rb": [str(x2), str(y2)]})
+                if random() < 0.9:
+                    types[str(k)] = (name, randint(-1, 7))
+            expected = legacy.hash_nodes([dict(n) for n in nodes], size, types)
+            table = NodeTable.from_dicts(nodes)
+            assert np.array_equal(expected, exact.hash_nodes(nodes, size, types))
+            assert np.array_equal(expected, exact.hash_nodes(table, size, types))
+            assert np.allclose(expected, fast.hash_nodes(table, size, types),
+                               rtol=1e-12, atol=1e-12)
+    print('test pass')
@@ -2,6 +2,7 @@
 
 import argparse
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Tuple
 
 import torch.optim as optim
@@ -26,52 +27,108 @@ rootpath = os.path.split(curpath)[0]
 if rootpath not in sys.path:
     sys.path.append(rootpath)
 
+from gating import GatingPolicy
+from label_cache import LabelCache, model_fingerprint
+from label_store import LabelStore
+from xml2nodes import XMLReader
+from extract_view_images import crop_views, crop_views_reduced, \
+    read_reduced_screen, view_img_name, write_done_marker, DONE_MARKER, \
+    REDUCED_READ_FLAGS
+from util.util_export import QUANTIZE_MODES, load_artifact, quantize_net, \
+    save_artifact
+
+
+def load_class_imgs(sub_class: str) -> np.ndarray:
+    """Read the view images in a class folder as a uint8 [n, 28, 28]
+    gray image array. Broken images are skipped"""
+    data = []
+    for img_file in listdir(sub_class):
+        img = cv2.imread(join(sub_class, img_file))
+        try:
+            img = cv2.resize(img, (28, 28))
+        except:
+            continue
+        # we ignore the color of control images
+        data.append(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    return np.stack(data) if len(data) > 0 \
+        else np.zeros((0, 28, 28), dtype=np.uint8)
+
 
 class ImgDataSet(Dataset):
-    """Build and load the view image dataset"""
-    def __init__(self, root_path: str):
-        npy_file = join(root_path, "imgdata.npy")
-        self._class_names = listdir(root_path)
-        self._class_names = [i for i in self._class_names if not i.endswith('.npy')]
-        if not exists(npy_file):
-            print("generate dataset...")
-            data = []
-            for i, _class in enumerate(self._class_names):
-                print(_class)
-                sub_class = f'{root_path}\\{_class}'
-                img_files = listdir(sub_class)
-                for img_file in img_files:
-                    img = cv2.imread(join(sub_class, img_file))
-                    try:
-                        img = cv2.resize(img, (28, 28))
-                    except:
-                        continue
-                    # we ignore the color of control images
-                    img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                    data.append([img, i])
-            if len(data) > 0:
-                np.save(join(root_path, "imgdata.npy"),
-                        data, allow_pickle=True)
-                self.data = np.load(npy_file, allow_pickle=True)
-                self._classnum = np.max(self.data[:, 1]) + 1
+    """Build and load the view image dataset. The images are packed in
+    `imgdata_x.npy` (uint8 [N, 28, 28]) and the labels in `imgdata_y.npy`
+    (int16 [N]), which are memory-mapped at load. `imgdata_classes.txt`
+    keeps the class names in the label order. A pickled `imgdata.npy`
+    of [img, label] pairs made before is converted on the first load.
+
+    An item is a batch: the dataset takes a list of indexes (see
+    `torch.utils.data.BatchSampler`) and returns the images and labels
+    in two arrays
+
+    Args:
+        root_path (str): The dataset folder, with a sub folder of view
+          images for each class
+        workers (int): Number of processes to read the class folders
+    """
+    X_FILE = "imgdata_x.npy"
+    Y_FILE = "imgdata_y.npy"
+    CLASS_FILE = "imgdata_classes.txt"
+    LEGACY_FILE = "imgdata.npy"
+
+    def __init__(self, root_path: str, workers: int = 1):
+        x_file, y_file = join(root_path, self.X_FILE), join(root_path, self.Y_FILE)
+        class_file = join(root_path, self.CLASS_FILE)
+        if not exists(class_file):
+            legacy_file = join(root_path, self.LEGACY_FILE)
+            if exists(legacy_file):
+                print("convert the dataset...")
+                # the legacy labels follow the listdir order
+                class_names = [i for i in listdir(root_path)
+                               if os.path.isdir(join(root_path, i))]
+                data = np.load(legacy_file, allow_pickle=True)
+                x = np.stack(data[:, 0]).astype(np.uint8) if len(data) > 0 \
+                    else np.zeros((0, 28, 28), dtype=np.uint8)
+                y = data[:, 1].astype(np.int16) if len(data) > 0 \
+                    else np.zeros(0, dtype=np.int16)
             else:
-                self.data = []
-                self._classnum = len(self._class_names)
-        else:
-            self.data = np.load(npy_file, allow_pickle=True)
-            self._classnum = np.max(self.data[:, 1]) + 1
+                print("generate dataset...")
+                class_names = sorted(i for i in listdir(root_path)
+                                     if os.path.isdir(join(root_path, i)))
+                sub_classes = [join(root_path, c) for c in class_names]
+                if workers > 1:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        xs = list(pool.map(load_class_imgs, sub_classes))
+                else:
+                    xs = [load_class_imgs(c) for c in sub_classes]
+                for _class, _x in zip(class_names, xs):
+                    print(_class, len(_x))
+                x = np.concatenate(xs) if len(xs) > 0 \
+                    else np.zeros((0, 28, 28), dtype=np.uint8)
+                y = np.repeat(np.arange(len(xs), dtype=np.int16),
+                              [len(_x) for _x in xs])
+            np.save(x_file, x)
+            np.save(y_file, y)
+            # written last, so a dataset with the class file is complete
+            with open(class_file, mode='w', encoding='utf-8') as f:
+                f.write(''.join(f"{c}\n" for c in class_names))
+        with open(class_file, mode='r', encoding='utf-8') as f:
+            self._class_names = [line.rstrip('\n') for line in f]
+        self.x = np.load(x_file, mmap_mode='r')
+        self.y = np.load(y_file, mmap_mode='r')
+        self._classnum = int(self.y.max()) + 1 if len(self.y) > 0 \
+            else len(self._class_names)
         # shuffle the data by shuffling the indices
-        self.index = [i for i in range(self.__len__())]
+        self.index = np.arange(self.__len__())
         np.random.shuffle(self.index)
         print("dataset ready")
 
-    def __getitem__(self, idx: int):
+    def __getitem__(self, idx):
+        """Images and labels of a list of indexes, or of one index"""
         idx = self.index[idx]
-        i, label = self.data[idx]
-        return i, label
+        return np.asarray(self.x[idx]), np.asarray(self.y[idx])
 
     def __len__(self):
-        return len(self.data)
+        return len(self.y)
 
     @property
     def class_num(self):
@@ -103,6 +160,41 @@ class ImgNet(nn.Module):
         return x
 
 
+class TinyImgNet(nn.Module):
+    def __init__(self, class_num: int):
+        """A compact convolutional neural network for the 28x28 gray
+        view images. It is much cheaper than `ImgNet` on CPUs, and is
+        best trained by distillation from an `ImgNet` model
+
+        Args:
+            class_num: neural number of the output fc layer
+        """
+        super(TinyImgNet, self).__init__()
+
+        def block(c_in: int, c_out: int) -> list:
+            return [nn.Conv2d(c_in, c_out, kernel_size=3, padding=1, bias=False),
+                    nn.BatchNorm2d(c_out), nn.ReLU(inplace=True)]
+
+        self.features = nn.Sequential(
+            *block(1, 16), nn.MaxPool2d(2),   # 14x14
+            *block(16, 32), nn.MaxPool2d(2),  # 7x7
+            *block(32, 64),
+            nn.AdaptiveAvgPool2d(1))
+        self.fc = nn.Linear(64, class_num)
+        self.target = [i for i in range(class_num)]
+
+    def forward(self, x):
+        x = self.features(x / 255.)
+        x = self.fc(torch.flatten(x, 1))
+        x = f.softmax(x, dim=1)
+        return x
+
+
+# model_type -> (network, default model name prefix)
+MODEL_TYPES = {"resnet": (ImgNet, "reclass"),
+               "tiny": (TinyImgNet, "reclass_tiny")}
+
+
 class ImgClassifier:
     def __init__(self, dataset_path: str,
                  lr_init: float = 0.001,
@@ -111,7 +203,15 @@ class ImgClassifier:
                  batch_size: int = 32,
                  retrain_model: bool = False,
                  model_name: str = "",
-                 confidence_threshold: float = 0.95):
+                 confidence_threshold: float = 0.95,
+                 dataset_workers: int = 1,
+                 model_type: str = "resnet",
+                 teacher_model: str = "",
+                 distill_temperature: float = 4.0,
+                 distill_alpha: float = 0.7,
+                 artifact: str = "",
+                 label_cache: str = "",
+                 label_cache_size: int = 1000000):
         """
 
         Args:
@@ -125,18 +225,41 @@ class ImgClassifier:
             retrain_model (bool): Retrain and update the model if
               the model exists
             model_name (str): Name for output model. If not assign it,
-              it will be `reclass_e{epoch}_{batch_size}.tar`
+              it will be `reclass_e{epoch}_{batch_size}.tar`, or
+              `reclass_tiny_e{epoch}_{batch_size}.tar` for the tiny model
             confidence_threshold (float): The confidence to take the
               predicted label
+            dataset_workers (int): Number of processes to build the
+              dataset, see `ImgDataSet`
+            model_type (str): "resnet" for `ImgNet`, or "tiny" for
+              `TinyImgNet`
+            teacher_model (str): Name (in the model folder) or path of an
+              `ImgNet` model. If given, the model is trained by
+              distillation from it
+            distill_temperature (float): Temperature to soften the
+              outputs of both models in distillation
+            distill_alpha (float): Weight of the distillation loss. The
+              rest goes to the loss on the true labels
+            artifact (str): Path of a TorchScript artifact made by
+              `export`. If given, it is used for predicting instead of
+              the model
+            label_cache (str): Path of a `LabelCache` file. If given,
+              identical view crops are classified only once, across
+              runs and processes
+            label_cache_size (int): Capacity of the label cache
         """
+        if model_type not in MODEL_TYPES:
+            raise ValueError(f"unknown model type: {model_type}")
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu")
         print(f"DEVICE: {self.device}")
         self.epoch = epoch
         self.batch_size = batch_size
-        self.dataset = ImgDataSet(dataset_path)
+        self.dataset = ImgDataSet(dataset_path, workers=dataset_workers)
         self._class_names = self.dataset.class_names
-        self.net = ImgNet(self.dataset.class_num).to(self.device)
+        network, model_prefix = MODEL_TYPES[model_type]
+        self.model_type = model_type
+        self.net = network(self.dataset.class_num).to(self.device)
 
         self.lr = lr_init
         self.lr_init = lr_init
@@ -152,34 +275,185 @@ class ImgClassifier:
         self.tr_samp = sampler.SubsetRandomSampler(self.train_idx)
         self.val_samp = sampler.SubsetRandomSampler(self.valid_idx)
         _model_name = model_name if len(model_name) > 3 else \
-            f"reclass_e{self.epoch}_{self.batch_size}.tar"
+            f"{model_prefix}_e{self.epoch}_{self.batch_size}.tar"
         model_root_path = join(os.path.abspath(os.path.dirname(__file__)),
                                "..", "models")
         if not exists(model_root_path):
             makedirs(model_root_path)
         self.model_path = join(model_root_path, _model_name)
+        self.teacher_path = teacher_model
+        if len(teacher_model) > 0 and not exists(teacher_model):
+            self.teacher_path = join(model_root_path, teacher_model)
+        self.distill_temperature = distill_temperature
+        self.distill_alpha = distill_alpha
+        self.artifact_path = artifact
         self.retrain_model = retrain_model
         self.confidence_threshold = confidence_threshold
+        self.label_cache_path = label_cache
+        self.label_cache_size = label_cache_size
+        self.label_cache = None
 
     @property
     def class_names(self):
         return self._class_names
 
     def deal_data(self, data):
+        """Turn a batch of uint8 images and int16 labels into the input
+        and target tensors. The images are not copied until the float
+        conversion"""
         i, label = data
-        i = np.array([a.unsqueeze_(0).numpy() for a in i])
-        i = torch.from_numpy(i).float()
-        label = label.long()
+        i = torch.as_tensor(i).unsqueeze(1).float()
+        label = torch.as_tensor(label).long()
         i, label = i.to(self.device), label.to(self.device)
         return i, label
 
-    def train(self, trainloader, validloader, draw_history: bool = False):
+    def load_model(self):
+        """Load the trained model for predicting, or the artifact if
+        given. An artifact runs on the cpu"""
+        if len(self.artifact_path) > 0:
+            self.net, meta = load_artifact(self.artifact_path)
+            if meta.get("class_num", self.dataset.class_num) != self.dataset.class_num:
+                raise ValueError(f"the artifact has {meta['class_num']} classes, "
+                                 f"but the dataset has {self.dataset.class_num}")
+            self.device = torch.device("cpu")
+            print(f"artifact loaded: {self.artifact_path} "
+                  f"(quantization: {meta.get('quantize')})")
+        else:
+            self.net.load_state_dict(
+                torch.load(self.model_path, map_location=self.device))
+        self.net.eval()
+        if len(self.label_cache_path) > 0:
+            # cached labels are only valid for the same model and threshold
+            fingerprint = model_fingerprint(
+                self.artifact_path or self.model_path, self.model_type,
+                self.dataset.class_num, float(self.confidence_threshold))
+            self.label_cache = LabelCache(self.label_cache_path, fingerprint,
+                                          self.label_cache_size)
+
+    def export(self, mode: str = "dynamic", artifact_path: str = "",
+               calib_batches: int = 8) -> str:
+        """Export the model as a frozen TorchScript artifact for cpu
+        inference, and print a drift report against the float model
+
+        Args:
+            mode (str): Quantization, see `util.util_export.QUANTIZE_MODES`
+            artifact_path (str): The output file. Default: next to the
+              model, `{model name}_{mode}.pt`
+            calib_batches (int): Training batches to calibrate the static
+              quantization
+
+        Returns:
+            The artifact path
+        """
+        if not exists(self.model_path):
+            self.train_and_test()
+        self.net.load_state_dict(
+            torch.load(self.model_path, map_location=self.device))
+        self.net.eval()
+        if len(artifact_path) == 0:
+            artifact_path = f"{os.path.splitext(self.model_path)[0]}_{mode}.pt"
+        calib_idx = self.train_idx[:calib_batches * self.batch_size]
+        calib_inputs = [
+            self.deal_data(self.dataset[calib_idx[i:i + self.batch_size]])[0].cpu()
+            for i in range(0, len(calib_idx), self.batch_size)]
+        net = quantize_net(self.net, mode, calib_inputs)
+        save_artifact(net, calib_inputs[0], artifact_path,
+                      {"network": type(self.net).__name__,
+                       "model_type": self.model_type,
+                       "class_num": self.dataset.class_num,
+                       "class_names": self.class_names,
+                       "quantize": mode,
+                       "source": os.path.basename(self.model_path)})
+        self.drift_report(artifact_path)
+        return artifact_path
+
+    def drift_report(self, artifact_path: str, batch_size: int = 512):
+        """Compare an artifact with the float model on the test subset:
+        agreement of the predicted labels, accuracy at the confidence
+        threshold, and cpu latency"""
+        start = perf_counter()
+        artifact, meta = load_artifact(artifact_path)
+        artifact_startup = perf_counter() - start
+        start = perf_counter()
+        float_net = type(self.net)(self.dataset.class_num)
+        float_net.load_state_dict(torch.load(self.model_path, map_location="cpu"))
+        float_net.eval()
+        float_startup = perf_counter() - start
+
+        x, y = self.dataset[self.test_idx]
+        probs, costs = dict(), dict()
+        for name, net in (("float", float_net), ("artifact", artifact)):
+            outputs = list()
+            with torch.no_grad():
+                # warm up, the first runs of a TorchScript module are slow
+                net(torch.from_numpy(x[:batch_size]).float().unsqueeze(1))
+                start = perf_counter()
+                for i in range(0, len(x), batch_size):
+                    imgs = torch.from_numpy(x[i:i + batch_size]).float().unsqueeze(1)
+                    outputs.append(net(imgs).numpy())
+            costs[name] = (perf_counter() - start) / max(1, len(outputs))
+            probs[name] = np.concatenate(outputs) if outputs \
+                else np.zeros((0, self.dataset.class_num))
+
+        def labels_at_threshold(p: np.ndarray) -> np.ndarray:
+            confident = p.max(axis=1).astype(np.float64) > self.confidence_threshold
+            return np.where(confident, p.argmax(axis=1), -1)
+
+        labels = {k: labels_at_threshold(p) for k, p in probs.items()}
+        print(f"drift report of {artifact_path} "
+              f"(quantization: {meta.get('quantize')}) on {len(y)} test samples")
+        if len(y) > 0:
+            top1_agreement = np.mean(probs["float"].argmax(axis=1)
+                                     == probs["artifact"].argmax(axis=1))
+            label_agreement = np.mean(labels["float"] == labels["artifact"])
+            max_diff = np.max(np.abs(probs["float"] - probs["artifact"]))
+            print(f"\ttop-1 agreement: {top1_agreement * 100:.2f}%")
+            print(f"\tlabel agreement (confidence={self.confidence_threshold}): "
+                  f"{label_agreement * 100:.2f}%")
+            print(f"\tmax abs diff of the outputs: {max_diff:.5f}")
+            for name in ("float", "artifact"):
+                confident = labels[name] > -1
+                acc = np.mean(labels[name][confident] == y[confident]) * 100 \
+                    if confident.any() else float("nan")
+                print(f"\t{name}: acc {acc:.2f}% for {confident.sum()} samples "
+                      f"(confidence={self.confidence_threshold}), "
+                      f"{costs[name] * 1000:.1f} ms per batch of {batch_size} on cpu")
+        print(f"\tstartup: float {float_startup * 1000:.1f} ms, "
+              f"artifact {artifact_startup * 1000:.1f} ms")
+
+    def load_teacher(self) -> nn.Module or None:
+        """The `ImgNet` model to distill from, or None"""
+        if len(self.teacher_path) == 0:
+            return None
+        teacher = ImgNet(self.dataset.class_num).to(self.device)
+        teacher.load_state_dict(
+            torch.load(self.teacher_path, map_location=self.device))
+        teacher.eval()
+        print(f"distill from {self.teacher_path}")
+        return teacher
+
+    def distill_loss(self, o, o_teacher, t):
+        """Knowledge distillation loss (Hinton et al.). The networks
+        output probabilities, so their logs are used as the logits"""
+        temp = self.distill_temperature
+        log_o = torch.log(o.clamp_min(1e-12))
+        log_o_teacher = torch.log(o_teacher.clamp_min(1e-12))
+        soft_loss = f.kl_div(f.log_softmax(log_o / temp, dim=1),
+                             f.softmax(log_o_teacher / temp, dim=1),
+                             reduction="batchmean") * temp * temp
+        hard_loss = f.nll_loss(log_o, t)
+        return self.distill_alpha * soft_loss + (1 - self.distill_alpha) * hard_loss
+
+    def train(self, trainloader, validloader, draw_history: bool = False,
+              teacher: nn.Module = None):
         """training & validating
 
         Args:
             trainloader: Dataload for the training subset
             validloader: Dataload for the validating subset
             draw_history (bool): whether to show a history plot
+            teacher (nn.Module): The model to distill from. The training
+              loss is `distill_loss` if it is given
         """
         loss_tr, loss_val = [], []
         for e in range(self.epoch):
@@ -196,7 +470,12 @@ class ImgClassifier:
                 i, t = self.deal_data(data)
                 self.optimizer.zero_grad()
                 o = self.net(i)
-                loss = f.nll_loss(torch.log(o), t)
+                if teacher is not None:
+                    with torch.no_grad():
+                        o_teacher = teacher(i)
+                    loss = self.distill_loss(o, o_teacher, t)
+                else:
+                    loss = f.nll_loss(torch.log(o), t)
                 loss.backward()
                 self.optimizer.step()
                 train_loss.append(loss.item())
@@ -275,21 +554,24 @@ class ImgClassifier:
               f'{(sum_correct / sum_total * 100):.2f}%')
         print(f'acc for {num_predict} samples (confidence={self.confidence_threshold}): '
               f'{(num_predict_correct / num_predict * 100):.2f}%')
-        for i, name in enumerate(self.class_names):
+        # classes after the last labeled one have no output
+        for i, name in enumerate(self.class_names[:self.dataset.class_num]):
             if max(confuse_mat[i]) == 0:
                 continue
             acc = confuse_mat[i][i] / sum(confuse_mat[i])
             print(f"Acc of {name}: {acc}")
 
     def train_and_test(self):
-        trainloader = DataLoader(self.dataset,
-                                 batch_size=self.batch_size,
-                                 sampler=self.tr_samp)
-        testloader = DataLoader(torch.utils.data.Subset(
-            self.dataset, self.test_idx), batch_size=self.batch_size)
-        validloader = DataLoader(self.dataset,
-                                 batch_size=self.batch_size,
-                                 sampler=self.val_samp)
+        # the dataset is indexed by batches, see `ImgDataSet`
+        trainloader = DataLoader(self.dataset, batch_size=None,
+                                 sampler=sampler.BatchSampler(
+                                     self.tr_samp, self.batch_size, False))
+        testloader = DataLoader(self.dataset, batch_size=None,
+                                sampler=sampler.BatchSampler(
+                                    self.test_idx, self.batch_size, False))
+        validloader = DataLoader(self.dataset, batch_size=None,
+                                 sampler=sampler.BatchSampler(
+                                     self.val_samp, self.batch_size, False))
 
         # training
         start = perf_counter()
@@ -298,7 +580,7 @@ class ImgClassifier:
                 torch.load(self.model_path, map_location=self.device))
             print("model loaded")
         else:
-            self.train(trainloader, validloader)
+            self.train(trainloader, validloader, teacher=self.load_teacher())
             torch.save(self.net.state_dict(), self.model_path)
 
         # predicting
@@ -310,7 +592,10 @@ class ImgClassifier:
         print("Training time:", mid - start)
         print("Testing time:", stop - mid)
 
-    def predict(self, root_opt_path: str, skip_existance: bool = True):
+    def predict(self, root_opt_path: str, skip_existance: bool = True,
+                label_store: bool = False, batch_size: int = 512,
+                io_threads: int = 4, num_threads: int = 0,
+                gating: GatingPolicy = None):
         """Predict views for a UI dataset
 
         Args:
@@ -318,21 +603,33 @@ class ImgClassifier:
               `opt_`)
             skip_existance (bool): If a view is already labeled, than
               skip it
+            label_store (bool): Write the results into the `LabelStore`
+              of root_opt_path instead of a classify.txt per UI
+            batch_size (int): Number of view images in an inference batch.
+              The batches run across UIs
+            io_threads (int): Number of threads to decode view images
+            num_threads (int): Number of threads for torch, 0 to keep
+              the default
+            gating (GatingPolicy): Views of the gated declared classes
+              go to their channels without being reidentified
 
         Returns:
             No return value. The results will be saved in the input folders
         """
-        if not exists(self.model_path):
+        if len(self.artifact_path) == 0 and not exists(self.model_path):
             self.train_and_test()
         print(f"reidentify views in {root_opt_path}...")
-        self.net.load_state_dict(
-            torch.load(self.model_path, map_location=self.device))
+        self.load_model()
         dlist = []
+        store = LabelStore.of_dataset(root_opt_path) if label_store else None
         for root, dirs, _ in walk(root_opt_path):
+            dirs[:] = [d for d in dirs if d != LabelStore.DIR_NAME]
             for d in dirs:
                 d = join(root, d)
-                _list = str(listdir(d))
-                if ".xml\'" in _list or _list == "[]":
+                entries = listdir(d)
+                _list = str(entries)
+                # a folder of 0 view has the marker only
+                if ".xml\'" in _list or _list == "[]" or entries == [DONE_MARKER]:
                     continue
                 dlist.append(d)
         total = len(dlist)
@@ -340,50 +637,296 @@ class ImgClassifier:
         k = 0
         print(f"reidentify views for {total} uis")
         self.net.eval()
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
         start = perf_counter()
+        uis, results = [], []
+        gated, views_total = dict(), 0
         for d in dlist:
             output_file = join(d, "classify.txt")
-            if exists(output_file) and skip_existance:
+            key = os.path.relpath(d, root_opt_path).replace(os.sep, '/')
+            if skip_existance and (key in store if label_store
+                                   else exists(output_file)):
                 continue
             imgs = listdir(d)
             imgs = [i for i in imgs if i.endswith(".jpg")]
-            imgs = sorted(imgs)
             labels = dict()
-            for i, img_f in enumerate(imgs):
-                img = cv2.imread(join(d, img_f))
-                try:
-                    img = cv2.resize(img, (28, 28))
-                except:
-                    continue
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-                img = np.expand_dims(img, 0)
-                img = np.expand_dims(img, 0)
-                img = torch.from_numpy(img).float().to(self.device)
-                pre_vec = self.net(img)
-                pre_vec_array = pre_vec.cpu().detach().numpy()
-                max_value = np.max(pre_vec_array)
-                if max_value > self.confidence_threshold:
-                    max_index = torch.Tensor.argmax(pre_vec)
-                    if self.device.type == "cpu":
-                        pre_label = int(max_index.detach().numpy())
-                    else:
-                        pre_label = int(max_index.cpu().numpy())
-                    views_identified += 1
-                else:
-                    # the "others" type
-                    pre_label = -1
-                labels[img_f[:-4]] = pre_label
-                views_handled += 1
-
-            with open(output_file, mode='w+') as fc:
-                fc.write(str(labels))
-                k += 1
-                print(f'\t({k}/{total}) {d}')
+            if gating is not None:
+                # the image name is {node index}_{declared class}.jpg
+                for img_f in imgs:
+                    name = img_f[:-4].split('_', 1)[1]
+                    channel = gating.channel(name)
+                    if channel is not None:
+                        labels[img_f[:-4]] = channel
+                        gated[name] = gated.get(name, 0) + 1
+            views_total += len(imgs)
+            uis.append((d, key, sorted(i for i in imgs if i[:-4] not in labels)))
+            results.append(labels)
+        # views of all the uis are classified in batches. a ui is
+        # written once its last view is classified
+        items = [(u, img_f) for u, (_, _, imgs) in enumerate(uis)
+                 for img_f in imgs]
+        remaining = [len(imgs) for _, _, imgs in uis]
+
+        def finish(u: int):
+            nonlocal k
+            d, key, _ = uis[u]
+            labels = results[u]
+            if gating is not None:
+                # keep the image order of an ungated run
+                labels = {i: labels[i] for i in sorted(labels)}
+            if label_store:
+                store.put(key, [int(i.split('_', 1)[0]) for i in labels],
+                          list(labels.values()))
+            else:
+                with open(join(d, "classify.txt"), mode='w+') as fc:
+                    fc.write(str(labels))
+            results[u] = None
+            k += 1
+            print(f'\t({k}/{total}) {d}')
+
+        for u, count in enumerate(remaining):
+            if count == 0:
+                finish(u)
+        batches = [items[i:i + batch_size]
+                   for i in range(0, len(items), batch_size)]
+        with ThreadPoolExecutor(max_workers=io_threads) as pool:
+            def submit(batch: list) -> list:
+                return [pool.submit(self.load_view_img, join(uis[u][0], img_f))
+                        for u, img_f in batch]
+
+            # decode the next batch while classifying the current one
+            pending = submit(batches[0]) if batches else None
+            for b, batch in enumerate(batches):
+                futures = pending
+                pending = submit(batches[b + 1]) if b + 1 < len(batches) else None
+                imgs = [future.result() for future in futures]
+                valid = [j for j, img in enumerate(imgs) if img is not None]
+                labels = self.classify_imgs(np.stack([imgs[j] for j in valid])) \
+                    if valid else []
+                for j, pre_label in zip(valid, labels):
+                    u, img_f = batch[j]
+                    results[u][img_f[:-4]] = pre_label
+                views_handled += len(labels)
+                views_identified += len([a for a in labels if a > -1])
+                for u, _ in batch:
+                    remaining[u] -= 1
+                    if remaining[u] == 0:
+                        finish(u)
+        end = perf_counter()
+        print("time span:", end - start)
+        if views_handled > 0:
+            print(f"reidentified views: {views_identified}/{views_handled} "
+                  f"({(views_identified / float(views_handled) * 100):.2f}%), "
+                  f"{views_handled / (end - start):.1f} views/sec")
+        if gating is not None:
+            gating.report(gated, views_total)
+        if self.label_cache is not None:
+            self.label_cache.report()
+
+    @staticmethod
+    def load_view_img(img_path: str) -> np.ndarray or None:
+        """Read a view image as a 28x28 gray image, or None if it is broken"""
+        img = cv2.imread(img_path)
+        try:
+            img = cv2.resize(img, (28, 28))
+        except:
+            return None
+        # we ignore the color of control images
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    def classify_imgs(self, imgs: np.ndarray) -> list:
+        """Reidentify a batch of 28x28 gray view images. The threshold and
+        argmax are applied to the whole batch. With the label cache, only
+        the images missing in it go through the model
+
+        Returns:
+            Predicted labels. -1 for the "others" type, i.e., when the
+              model is not confident enough
+        """
+        if self.label_cache is not None:
+            return self.label_cache.labels(imgs, self.infer_imgs)
+        return self.infer_imgs(imgs)
+
+    def infer_imgs(self, imgs: np.ndarray) -> list:
+        """`classify_imgs` without the label cache"""
+        imgs = torch.from_numpy(imgs).float().unsqueeze(1).to(self.device)
+        with torch.inference_mode():
+            pre_vec_array = self.net(imgs).cpu().numpy()
+        confident = pre_vec_array.max(axis=1).astype(np.float64) \
+            > self.confidence_threshold
+        return np.where(confident, pre_vec_array.argmax(axis=1), -1).tolist()
+
+    def classify_views(self, views: list) -> list:
+        """Reidentify view images in one batch
+
+        Args:
+            views (list): BGR view images of any size
+
+        Returns:
+            Predicted labels. -1 for the "others" type, i.e., when the
+              model is not confident enough
+        """
+        if len(views) == 0:
+            return []
+        return self.classify_imgs(np.stack(
+            [cv2.cvtColor(cv2.resize(v, (28, 28)), cv2.COLOR_BGR2GRAY)
+             for v in views]))
+
+    def reidentify_uis(self, root_path: str, skip_existance: bool = True,
+                       naive_xml: bool = False, streaming: bool = False,
+                       save_view_imgs: bool = False, num_threads: int = 0,
+                       gating: GatingPolicy = None, reduce: int = 0):
+        """Reidentify views straight from the UIs, without view image
+        files: each screenshot is decoded once, its views are sliced in
+        memory and classified in one batch, and the labels are written
+        into the `LabelStore` of root_path
+
+        Args:
+            root_path (str): Root path for the app UIs (xmls and jpgs)
+            skip_existance (bool): Skip the UIs already in the store
+            naive_xml (bool): True if the hierarchy is dumped by naive adb
+            streaming (bool): Read xmls with the single pass expat reader
+            save_view_imgs (bool): Also write the view images like
+              `extract_view_images.py` does, for debugging
+            num_threads (int): Number of threads for torch, 0 to keep
+              the default
+            gating (GatingPolicy): Views of the gated declared classes
+              go to their channels without being reidentified
+            reduce (int): If set (1, 2, 4 or 8), decode the screenshots
+              in gray at 1/reduce of their size, see `crop_views_reduced`.
+              Check the labels with `validate_reduce` first
+        """
+        if len(self.artifact_path) == 0 and not exists(self.model_path):
+            self.train_and_test()
+        print(f"reidentify views in {root_path}...")
+        self.load_model()
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        store = LabelStore.of_dataset(root_path)
+        all_xml = []
+        for dirpath, dirnames, filenames in walk(root_path):
+            dirnames[:] = sorted(d for d in dirnames if d != LabelStore.DIR_NAME)
+            all_xml += [(dirpath, name) for name in sorted(filenames)
+                        if name.endswith('.xml')]
+        total = len(all_xml)
+        views_handled, views_identified = 0, 0
+        gated, views_total = dict(), 0
+        print(f"reidentify views for {total} uis")
+        start = perf_counter()
+        for k, (dirpath, xml_name) in enumerate(all_xml):
+            save_path = join(dirpath, xml_name[:-4])
+            key = os.path.relpath(save_path, root_path).replace(os.sep, '/')
+            if skip_existance and key in store:
+                continue
+            if reduce > 0:
+                img, full_size = read_reduced_screen(f"{save_path}.jpg", reduce)
+            else:
+                img = cv2.imread(f"{save_path}.jpg", 1)
+            if img is None:
+                continue
+            views = XMLReader(join(dirpath, xml_name), naive_xml=naive_xml,
+                              streaming=streaming).table
+            crops = crop_views_reduced(img, full_size, views) if reduce > 0 \
+                else crop_views(img, views)
+            names = views.names
+            if save_view_imgs:
+                if not exists(save_path):
+                    makedirs(save_path)
+                for i, view in crops:
+                    cv2.imwrite(join(save_path, view_img_name(i, names[i])), view)
+                write_done_marker(join(save_path, DONE_MARKER), len(crops))
+            channels = [None] * len(crops)
+            if gating is not None:
+                for j, (i, _) in enumerate(crops):
+                    channels[j] = gating.channel(names[i])
+                    if channels[j] is not None:
+                        gated[names[i]] = gated.get(names[i], 0) + 1
+            views_total += len(crops)
+            pending = [view for (_, view), c in zip(crops, channels) if c is None]
+            if reduce == 0:
+                labels = self.classify_views(pending)
+            else:
+                labels = self.classify_imgs(np.stack(pending)) if pending else []
+            views_handled += len(labels)
+            views_identified += len([a for a in labels if a > -1])
+            labels = iter(labels)
+            labels = [next(labels) if c is None else c for c in channels]
+            store.put(key, [i for i, _ in crops], labels)
+            print(f'\t({k + 1}/{total}) {key}')
         end = perf_counter()
         print("time span:", end - start)
         if views_handled > 0:
             print(f"reidentified views: {views_identified}/{views_handled} "
-                  f"({(views_identified / float(views_handled) * 100):.2f}%)")
+                  f"({(views_identified / float(views_handled) * 100):.2f}%), "
+                  f"{views_handled / (end - start):.1f} views/sec")
+        if gating is not None:
+            gating.report(gated, views_total)
+        if self.label_cache is not None:
+            self.label_cache.report()
+
+    def validate_reduce(self, root_path: str, reduce: int = 2,
+                        min_agreement: float = 0.98, naive_xml: bool = False,
+                        streaming: bool = False, limit: int = 0) -> bool:
+        """Compare the labels of the reduced screenshot decoding (see
+        `reidentify_uis`) with the full size one on some UIs, and time
+        the decoding and cropping of both. Nothing is written
+
+        Args:
+            root_path (str): Root path for the app UIs (xmls and jpgs)
+            reduce (int): The reduce factor to check
+            min_agreement (float): The label agreement to pass
+            naive_xml (bool): True if the hierarchy is dumped by naive adb
+            streaming (bool): Read xmls with the single pass expat reader
+            limit (int): Number of UIs to check, 0 for all
+
+        Returns:
+            Whether the agreement reaches min_agreement
+        """
+        self.load_model()
+        all_xml = []
+        for dirpath, dirnames, filenames in walk(root_path):
+            dirnames[:] = sorted(d for d in dirnames if d != LabelStore.DIR_NAME)
+            all_xml += [(dirpath, name) for name in sorted(filenames)
+                        if name.endswith('.xml')]
+        if limit > 0:
+            all_xml = all_xml[:limit]
+        views_total, views_agreed, screens = 0, 0, 0
+        cost_full, cost_reduced = 0., 0.
+        for dirpath, xml_name in all_xml:
+            jpg_path = join(dirpath, f"{xml_name[:-4]}.jpg")
+            views = XMLReader(join(dirpath, xml_name), naive_xml=naive_xml,
+                              streaming=streaming).table
+            start = perf_counter()
+            img = cv2.imread(jpg_path, 1)
+            if img is None:
+                continue
+            full = [(i, cv2.cvtColor(cv2.resize(v, (28, 28)), cv2.COLOR_BGR2GRAY))
+                    for i, v in crop_views(img, views)]
+            cost_full += perf_counter() - start
+            start = perf_counter()
+            img, full_size = read_reduced_screen(jpg_path, reduce)
+            reduced = crop_views_reduced(img, full_size, views)
+            cost_reduced += perf_counter() - start
+            screens += 1
+            if len(full) == 0:
+                continue
+            labels_full = dict(zip([i for i, _ in full], self.infer_imgs(
+                np.stack([v for _, v in full]))))
+            labels_reduced = dict(zip([i for i, _ in reduced], self.infer_imgs(
+                np.stack([v for _, v in reduced])))) if reduced else dict()
+            views_total += len(labels_full)
+            views_agreed += len([i for i, a in labels_full.items()
+                                 if labels_reduced.get(i) == a])
+        if views_total == 0:
+            print("no views to validate")
+            return False
+        agreement = views_agreed / float(views_total)
+        print(f"{screens} uis, {views_total} views, label agreement at 1/{reduce}: "
+              f"{agreement * 100:.2f}% (min {min_agreement * 100:.2f}%)")
+        print(f"decode and crop per ui: full {cost_full / screens * 1000:.2f} ms, "
+              f"reduced {cost_reduced / screens * 1000:.2f} ms")
+        return agreement >= min_agreement
 
 
 def parse_arg_reclass(input_args: list):
@@ -392,7 +935,8 @@ def parse_arg_reclass(input_args: list):
     parser.add_argument("dataset_path",
                         help="the path for view image dataset. "
                              "I get the view type names according to it")
-    parser.add_argument("input_path", help="input path")
+    parser.add_argument("input_path", nargs="?", default="",
+                        help="input path. not needed with --export")
     parser.add_argument("--lr", "-l", default=0.003, type=float,
                         help="training learning rate of the model")
     parser.add_argument("--decay", "-d", default='4,0.1', type=str,
@@ -408,6 +952,58 @@ def parse_arg_reclass(input_args: list):
                         help="retrain and overwrite the existing model")
     parser.add_argument("--notskip", "-s", action="store_false",
                         help="do not skip the reidentified items")
+    parser.add_argument("--label_store", action="store_true",
+                        help="write the results into the label store of "
+                             "input_path instead of a classify.txt per ui")
+    parser.add_argument("--predict_batch", default=512, type=int,
+                        help="inference batch size when predicting")
+    parser.add_argument("--io_threads", default=4, type=int,
+                        help="threads to decode view images when predicting")
+    parser.add_argument("--torch_threads", default=0, type=int,
+                        help="intra-op threads of torch, 0 for the default")
+    parser.add_argument("--fused", "-f", action="store_true",
+                        help="reidentify views straight from the uis in input_path "
+                             "(no extract_view_images.py needed), and write the "
+                             "results into its label store")
+    parser.add_argument("--save_view_imgs", action="store_true",
+                        help="with --fused, also write the view images for debugging")
+    parser.add_argument("--naivexml", "-n", action="store_true",
+                        help="with --fused, assign it when using naive adb")
+    parser.add_argument("--stream", action="store_true",
+                        help="with --fused, read xmls with the single pass reader")
+    parser.add_argument("--dataset_workers", default=1, type=int,
+                        help="processes to build the view image dataset")
+    parser.add_argument("--model_type", default="resnet", choices=list(MODEL_TYPES),
+                        help="resnet: the ResNet-18 based model. tiny: a compact "
+                             "CNN, much faster on CPUs")
+    parser.add_argument("--teacher", default="", type=str,
+                        help="train the model by distillation from this ResNet "
+                             "model (a name in the model folder or a path)")
+    parser.add_argument("--temperature", default=4.0, type=float,
+                        help="distillation temperature")
+    parser.add_argument("--alpha", default=0.7, type=float,
+                        help="weight of the distillation loss")
+    parser.add_argument("--export", choices=QUANTIZE_MODES,
+                        help="export the model as a TorchScript artifact with "
+                             "this quantization, report the drift, and exit")
+    parser.add_argument("--artifact", default="", type=str,
+                        help="predict with this TorchScript artifact")
+    parser.add_argument("--gating", default="", type=str,
+                        help="a gating policy learned by gating.py. views of "
+                             "the gated declared classes skip the reidentification")
+    parser.add_argument("--reduce", default=0, type=int, choices=[0, *REDUCED_READ_FLAGS],
+                        help="with --fused, decode screenshots in gray at 1/reduce "
+                             "of their size. 0: full size")
+    parser.add_argument("--validate_reduce", action="store_true",
+                        help="compare the labels of --reduce (default 2) with the "
+                             "full size decoding on input_path, and exit")
+    parser.add_argument("--min_agreement", default=0.98, type=float,
+                        help="with --validate_reduce, the label agreement to pass")
+    parser.add_argument("--label_cache", default="", type=str,
+                        help="a sqlite file to cache the labels of view crops "
+                             "across runs, emptied when the model changes")
+    parser.add_argument("--cache_size", default=1000000, type=int,
+                        help="entries kept in the label cache, 0 for no limit")
     _args = parser.parse_args(input_args)
     return _args
 
@@ -422,10 +1018,41 @@ if __name__ == '__main__':
                            epoch=args.epoch, batch_size=args.batch_size,
                            lr_init=args.lr, lr_decay=(lr_decay_e, lr_decay_r),
                            retrain_model=args.retrain,
-                           confidence_threshold=args.threshold)
+                           confidence_threshold=args.threshold,
+                           dataset_workers=args.dataset_workers,
+                           model_type=args.model_type,
+                           teacher_model=args.teacher,
+                           distill_temperature=args.temperature,
+                           distill_alpha=args.alpha,
+                           artifact=args.artifact,
+                           label_cache=args.label_cache,
+                           label_cache_size=args.cache_size)
+        policy = GatingPolicy.load(args.gating) if args.gating else None
 
         # output predictions for elements imgs
-        ic.predict(args.input_path, skip_existance=args.notskip)
+        if args.export is not None:
+            ic.export(args.export)
+        elif len(args.input_path) == 0:
+            print("please provide an input path")
+            exit(1)
+        elif args.validate_reduce:
+            if not ic.validate_reduce(args.input_path, args.reduce or 2,
+                                      args.min_agreement, args.naivexml,
+                                      args.stream):
+                exit(1)
+        elif args.fused:
+            ic.reidentify_uis(args.input_path, skip_existance=args.notskip,
+                              naive_xml=args.naivexml, streaming=args.stream,
+                              save_view_imgs=args.save_view_imgs,
+                              num_threads=args.torch_threads,
+                              gating=policy, reduce=args.reduce)
+        else:
+            ic.predict(args.input_path, skip_existance=args.notskip,
+                       label_store=args.label_store,
+                       batch_size=args.predict_batch,
+                       io_threads=args.io_threads,
+                       num_threads=args.torch_threads,
+                       gating=policy)
 
     except ValueError:
         print("invalid decay for learning rate. example: 4,0.1")
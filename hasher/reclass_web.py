@@ -7,6 +7,11 @@ import os
 import argparse
 from os import listdir, walk
 from os.path import join, exists
+from typing import Tuple
+
+from label_store import LabelStore
+from extract_view_images import web_tag_name
+from util.util_nodes import NodeTable
 
 # UIHash Class Mapping (based on nodes2hash.py logic)
 # 0: Button
@@ -41,11 +46,35 @@ TAG_MAP = {
     "iframe": 7
 }
 
-def reclass_web(input_path: str):
+def tag_type_dict(nodes: NodeTable, screen_size: Tuple[int, int]) -> dict:
+    """
+    The view types of a web page, mapped from the tags of its nodes in
+    memory. It is what `Nodes2Hash.load_type_dict` reads from the
+    classify.txt that extract_view_images.py --web and `reclass_web`
+    write, without any view image: the nodes whose box is empty on the
+    screenshot get no view image, hence no type
+    """
+    w, h = screen_size
+    type_dict = {}
+    for i, (name, (w1, h1, w2, h2)) in enumerate(zip(nodes.names,
+                                                     nodes.bounds.tolist())):
+        # the clipping of extract_view_imgs_from_web
+        w1, w2 = max(0, min(w1, w)), max(0, min(w2, w))
+        h1, h2 = max(0, min(h1, h)), max(0, min(h2, h))
+        if w2 <= w1 or h2 <= h1:
+            continue
+        tag = web_tag_name(name)
+        type_dict[str(i)] = (tag, TAG_MAP.get(tag, 7))
+    return type_dict
+
+
+def reclass_web(input_path: str, label_store: bool = False):
     """
-    Scan input_path for subdirectories (screens) and generate classify.txt
+    Scan input_path for subdirectories (screens) and generate classify.txt,
+    or write the labels into the label store of input_path
     """
     print(f"Reclassifying Web UIs in {input_path}...")
+    store = LabelStore.of_dataset(input_path) if label_store else None
     
     # Find screen directories (those starting with web_)
     dirs = [d for d in listdir(input_path) if os.path.isdir(join(input_path, d)) and d.startswith("web_")]
@@ -83,18 +112,24 @@ def reclass_web(input_path: str):
             except Exception as e:
                 print(f"Error parsing {img_file}: {e}")
         
-        # Write classify.txt
-        with open(classify_file, 'w') as f:
-            f.write(str(labels))
+        if label_store:
+            store.put(d, [int(key.split('_', 1)[0]) for key in labels],
+                      list(labels.values()))
+        else:
+            # Write classify.txt
+            with open(classify_file, 'w') as f:
+                f.write(str(labels))
             
         if (k+1) % 10 == 0:
             print(f"Processed {k+1}/{total}")
             
-    print(f"Done! Generated classify.txt for {total} screens.")
+    print(f"Done! Generated labels for {total} screens.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Tag-based Classifier for Web UIHash")
     parser.add_argument("input_path", help="Path to output_web directory")
+    parser.add_argument("--label_store", action="store_true",
+                        help="Write into the label store of input_path instead of classify.txt")
     args = parser.parse_args()
     
-    reclass_web(args.input_path)
+    reclass_web(args.input_path, label_store=args.label_store)
@@ -0,0 +1,164 @@
+"""Find out the screen size of a UI without decoding its screenshot"""
+
+import json
+import os
+import struct
+from os.path import exists, join
+from typing import Tuple
+
+import PIL
+from PIL import Image
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# start of frame markers, which hold the image size. C4 (DHT),
+# C8 (JPG) and CC (DAC) share the range but are not frames
+JPEG_SOF = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+def read_image_size(img_path: str) -> Tuple[int, int]:
+    """ Read (width, height) from the header of a PNG or JPEG file.
+    Other formats, or headers that can not be parsed, are left to PIL,
+    which also opens an image lazily, but costs more per call
+
+    Raises:
+        FileNotFoundError: the image does not exist
+        PIL.UnidentifiedImageError: the file is not an image
+    """
+    with open(img_path, mode='rb') as f:
+        head = f.read(24)
+        try:
+            if head[:8] == PNG_SIGNATURE and head[12:16] == b'IHDR':
+                width, height = struct.unpack('>II', head[16:24])
+                return width, height
+            if head[:2] == b'\xff\xd8':
+                f.seek(2)
+                while True:
+                    byte = f.read(1)
+                    while byte and byte != b'\xff':
+                        byte = f.read(1)
+                    while byte == b'\xff':
+                        byte = f.read(1)
+                    if not byte:
+                        break
+                    marker = byte[0]
+                    if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+                        # markers without a payload
+                        continue
+                    if marker in (0xd9, 0xda):
+                        # end of image, or start of scan
+                        break
+                    length, = struct.unpack('>H', f.read(2))
+                    if marker in JPEG_SOF:
+                        height, width = struct.unpack('>xHH', f.read(5))
+                        return width, height
+                    f.seek(length - 2, os.SEEK_CUR)
+        except struct.error:
+            pass
+    with Image.open(img_path) as img:
+        return img.size
+
+
+def probe_screen_size(xml_path: str) -> Tuple[int, int] or None:
+    """ The size of the screenshot next to a hierarchy file. The .jpg
+    is preferred, then the .png
+
+    Returns:
+        (width, height), or None if the screenshot is missing or broken
+    """
+    base_path = os.path.splitext(xml_path)[0]
+    try:
+        if exists(f"{base_path}.jpg"):
+            return read_image_size(f"{base_path}.jpg")
+        elif exists(f"{base_path}.png"):
+            return read_image_size(f"{base_path}.png")
+        else:
+            # Fallback to original logic if neither exists (though unlikely)
+            return read_image_size(f"{xml_path[:-4]}.jpg")
+    except PIL.UnidentifiedImageError:
+        print(f"unable to load image for {base_path}")
+        return None
+    except FileNotFoundError:
+        print(f"image for {base_path} not exists")
+        return None
+
+
+class ScreenSizes:
+    """ Screen sizes of the UIs in a dataset folder (the folder of app
+    folders). A size is taken from the root bounds of the hierarchy if
+    `root_bounds` is set and they are available. Otherwise the screenshot
+    header is read, and with `index` set, the result is kept in a sidecar
+    json in the dataset folder, so later runs do not touch the images.
+    A changed screenshot is not detected, so delete the sidecar after
+    replacing screenshots
+
+    Note that the root bounds do not always cover the whole screenshot,
+    e.g., when the system bars are excluded, so they are off by default
+
+    Args:
+        folder (str): the dataset folder
+        index (bool): keep the sizes in the sidecar index
+        root_bounds (bool): use the root bounds of the hierarchy
+
+    Attributes:
+        sizes (dict): "pkg/xml name" -> [width, height]
+    """
+    INDEX_NAME = ".screen_sizes.json"
+
+    def __init__(self, folder: str, index: bool = True,
+                 root_bounds: bool = False):
+        self.folder = folder
+        self.index = index
+        self.root_bounds = root_bounds
+        self.sizes = dict()
+        self._new = dict()
+        self._index_path = join(folder, self.INDEX_NAME)
+        if index and exists(self._index_path):
+            try:
+                with open(self._index_path, mode='r') as f:
+                    self.sizes = json.load(f)
+            except ValueError:
+                print(f"broken screen size index {self._index_path}, rebuild it")
+
+    def screen_size(self, pkg: str, xml: str,
+                    root_bounds: Tuple[int, int] = None) -> Tuple[int, int] or None:
+        """ (width, height) of a UI, or None if its screenshot is
+        missing or broken. See `probe_screen_size`
+
+        Args:
+            pkg (str): the app folder
+            xml (str): the hierarchy file name
+            root_bounds ((int, int)): the right-bottom corner of the
+              root view, see `XMLReader.root_bounds`
+        """
+        if self.root_bounds and root_bounds is not None:
+            return root_bounds
+        key = f"{pkg}/{xml}"
+        if key in self.sizes:
+            return tuple(self.sizes[key])
+        size = probe_screen_size(join(self.folder, pkg, xml))
+        if size is not None and self.index:
+            self.sizes[key] = self._new[key] = list(size)
+        return size
+
+    def pop_new(self) -> dict:
+        """ The sizes read since the last call """
+        new, self._new = self._new, dict()
+        return new
+
+    def update(self, sizes: dict):
+        self.sizes.update(sizes)
+        self._new.update(sizes)
+
+    def save(self):
+        """ Write the index if any size is added """
+        if not self.index or len(self._new) == 0:
+            return
+        tmp = f"{self._index_path}.tmp"
+        try:
+            with open(tmp, mode='w') as f:
+                json.dump(self.sizes, f)
+            os.replace(tmp, self._index_path)
+            self._new = dict()
+        except OSError as e:
+            print(f"unable to save the screen size index {self._index_path}: {e}")
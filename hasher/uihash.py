@@ -1,7 +1,12 @@
 """Generate UI# for a large scale UIs"""
 
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
 from os import listdir, makedirs
+from shutil import rmtree
+from tempfile import mkdtemp
 from typing import Tuple
 
 import numpy as np
@@ -16,18 +21,376 @@ if rootpath not in sys.path:
     sys.path.append(rootpath)
 
 from xml2nodes import XMLReader
-from nodes2hash import Nodes2Hash
+from nodes2hash import Nodes2Hash, ENGINES
+from screen_size import ScreenSizes, probe_screen_size
+from label_store import LabelStore, load_type_dict
+from reclass_web import tag_type_dict
+
+
+def list_uis(folder: str, pkg: str) -> list:
+    """ Hierarchy files of an app, in the order of their names """
+    xmls = listdir(join(folder, pkg))
+    return sorted(i for i in xmls if i.endswith("xml") or i.endswith("json"))
+
+
+def _stat(file_path: str) -> list or None:
+    """ [mtime_ns, size] of a file, or None if it does not exist """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def ui_fingerprint(xml_path: str, labels: LabelStore = None) -> dict:
+    """ Fingerprints of the files that determine the UI# of a UI:
+    the hierarchy, the screenshot and the reidentified view types.
+    Candidates are probed in the same order as `probe_screen_size`.
+    With a label store, the versions of its records are included, which
+    change only when a UI is labeled again """
+    base_path = os.path.splitext(xml_path)[0]
+    img = _stat(f"{base_path}.jpg") or _stat(f"{base_path}.png")
+    classify = _stat(join(base_path, "classify.txt")) or \
+        _stat(join(os.path.dirname(xml_path), "classify.txt"))
+    fingerprint = {"xml": _stat(xml_path), "img": img, "classify": classify}
+    if labels is not None:
+        pkg = os.path.basename(os.path.dirname(xml_path))
+        fingerprint["labels"] = [
+            labels.version(LabelStore.key(pkg, os.path.basename(base_path))),
+            labels.version(pkg)]
+    return fingerprint
+
+
+class HashManifest:
+    """ Fingerprints of the UIs behind a UI# dataset. It is stored
+    next to the npy files and makes `gen_hash_data` incremental: an app
+    is re-hashed only when its UIs change. Every finished app is
+    appended to a journal at once, so that an interrupted run resumes
+    from where it stopped. `save` folds the journal into the manifest.
+
+    Args:
+        manifest_path (str): path of the manifest json
+        settings (dict): hashing settings. The manifest is discarded
+          when they change
+
+    Attributes:
+        apps (dict): app key -> {"folder", "pkg", "count", "uis"}, where
+          "uis" maps a xml name to its `ui_fingerprint`
+        reset (bool): whether a previous manifest is discarded
+    """
+    def __init__(self, manifest_path: str, settings: dict):
+        self._path = manifest_path
+        self._journal = f"{manifest_path}.journal"
+        self.settings = settings
+        self.apps = dict()
+        self.reset = False
+        data = None
+        if exists(self._path):
+            with open(self._path, mode='r', encoding='utf-8') as f:
+                data = json.load(f)
+        if data is not None and data["settings"] == settings:
+            self.apps = data["apps"]
+            if exists(self._journal):
+                with open(self._journal, mode='r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            # the last line of an interrupted run
+                            break
+                        if record["app"] is None:
+                            self.apps.pop(record["key"], None)
+                        else:
+                            self.apps[record["key"]] = record["app"]
+        else:
+            self.reset = data is not None
+            if exists(self._journal):
+                os.remove(self._journal)
+            self.save()
+
+    def update(self, key: str, app: dict or None):
+        """ Record (or drop, when app is None) an app in the journal """
+        if app is None:
+            self.apps.pop(key, None)
+        else:
+            self.apps[key] = app
+        with open(self._journal, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps({"key": key, "app": app}) + "\n")
+
+    def save(self):
+        tmp = f"{self._path}.tmp"
+        with open(tmp, mode='w', encoding='utf-8') as f:
+            json.dump({"settings": self.settings, "apps": self.apps}, f)
+        os.replace(tmp, self._path)
+        if exists(self._journal):
+            os.remove(self._journal)
+
+
+def hash_key(k: int, grid_size: Tuple[int, int]) -> str:
+    """ Key of the k-th grid size in a shard file. The first one is
+    "hash", as a shard of a single grid size """
+    return "hash" if k == 0 else f"hash_{grid_size[0]}x{grid_size[1]}"
+
+
+def hash_package(folder: str, pkg: str, hasher: Nodes2Hash or list,
+                 filter_few_nodes: int = 6,
+                 naive_xml: bool = False,
+                 xmls: list = None,
+                 known: dict = None,
+                 streaming: bool = False,
+                 sizes: ScreenSizes = None,
+                 labels: LabelStore = None,
+                 web_tags: bool = False) -> Tuple[list, list]:
+    """ Generate uihash for all the UIs of an app. The xmls are
+    handled in the order of their names
+
+    Args:
+        hasher (Nodes2Hash or list): a hasher, or a list of hashers (of
+          different grid sizes). A UI is read once for all of them
+        xmls (list): the UIs to handle, default: `list_uis`
+        known (dict): xml name -> its previous uihash (a list of them
+          for a list of hashers, or None if the UI was filtered out).
+          These UIs are reused instead of re-hashed
+        streaming (bool): read xmls with the single pass expat reader
+        sizes (ScreenSizes): where to get screen sizes from. by default
+          the screenshot headers are read
+        labels (LabelStore): where to read view types from. UIs not in
+          the store fall back to their `classify.txt`
+        web_tags (bool): map the view types of web pages from their html
+          tags in memory (see `tag_type_dict`), without view images or
+          `classify.txt`
+
+    Returns:
+        uihash list (a list of them for a list of hashers), and the
+          "pkg xml" name list
+    """
+    hashers = hasher if isinstance(hasher, list) else [hasher]
+    hash_lists = [list() for _ in hashers]
+    apk_xml_list = list()
+    if xmls is None:
+        xmls = list_uis(folder, pkg)
+    for xml in xmls:
+        if known is not None and xml in known:
+            ui_hash = known[xml]
+        else:
+            xml_path = join(folder, pkg, xml)
+            reader = XMLReader(xml_path, naive_xml=naive_xml,
+                               streaming=streaming)
+            nodes = reader.table
+            if filter_few_nodes > 0:
+                if len(nodes) < filter_few_nodes:
+                    continue
+            screen_size = None
+            if sizes is not None:
+                screen_size = sizes.screen_size(pkg, xml, reader.root_bounds)
+                if screen_size is None:
+                    continue
+            type_dict = None
+            if web_tags:
+                if screen_size is None:
+                    screen_size = probe_screen_size(xml_path)
+                    if screen_size is None:
+                        continue
+                type_dict = tag_type_dict(nodes, screen_size)
+            elif labels is not None:
+                type_dict = load_type_dict(labels, pkg, xml, nodes.names)
+            # what `Nodes2Hash.gen_uihash` does, once for all the hashers
+            if screen_size is None:
+                screen_size = probe_screen_size(xml_path)
+            if screen_size is not None and type_dict is None:
+                type_dict = Nodes2Hash.load_type_dict(xml_path)
+            ui_hash = None if screen_size is None or type_dict is None else \
+                [h.hash_nodes(nodes, screen_size, type_dict) for h in hashers]
+            if ui_hash is not None and not isinstance(hasher, list):
+                ui_hash = ui_hash[0]
+        if ui_hash is not None:
+            if not isinstance(hasher, list):
+                ui_hash = [ui_hash]
+            for hash_list, _hash in zip(hash_lists, ui_hash):
+                hash_list.append(_hash)
+            apk_xml_list.append(f"{pkg} {xml}")
+    return (hash_lists if isinstance(hasher, list) else hash_lists[0]), \
+        apk_xml_list
+
+
+# per-process states for `_hash_shard`, see `_init_shard_worker`
+_shard_hasher = None
+_shard_args = dict()
+_shard_sizes = dict()
+_shard_labels = dict()
+
+
+def _init_shard_worker(hash_grid_sizes: list, type_number: int,
+                       engine: str, shard_path: str,
+                       filter_few_nodes: int, naive_xml: bool,
+                       streaming: bool = False, size_index: bool = False,
+                       root_bounds: bool = False, label_store: bool = False,
+                       web_tags: bool = False):
+    """ Every worker process owns a Nodes2Hash per grid size, and the
+    `ScreenSizes` and `LabelStore` of the input paths """
+    global _shard_hasher, _shard_args, _shard_sizes, _shard_labels
+    _shard_hasher = [Nodes2Hash(g, type_number, engine=engine)
+                     for g in hash_grid_sizes]
+    _shard_args = dict(shard_path=shard_path,
+                       filter_few_nodes=filter_few_nodes,
+                       naive_xml=naive_xml,
+                       streaming=streaming,
+                       size_index=size_index,
+                       root_bounds=root_bounds,
+                       label_store=label_store,
+                       web_tags=web_tags)
+    _shard_sizes = dict()
+    _shard_labels = dict()
+
+
+def _hash_shard(task: tuple) -> Tuple[int, int, dict, dict]:
+    """ Hash one app, and dump the results into its shard file.
+
+    A task is (index, folder, pkg, shard name, previous manifest record).
+    The record is None unless in the incremental mode. Then, an app
+    whose UIs are all unchanged is skipped, and the unchanged UIs of
+    other apps are reused from the previous shard.
+
+    Returns:
+        The task index, the UI count, the UI fingerprints (None
+          unless in the incremental mode), and the newly read screen
+          sizes for the size index
+    """
+    index, folder, pkg, shard_name, previous = task
+    shard_file = join(_shard_args["shard_path"], shard_name)
+    sizes = None
+    if _shard_args["size_index"] or _shard_args["root_bounds"]:
+        if folder not in _shard_sizes:
+            _shard_sizes[folder] = ScreenSizes(
+                folder, index=_shard_args["size_index"],
+                root_bounds=_shard_args["root_bounds"])
+        sizes = _shard_sizes[folder]
+    labels = None
+    if _shard_args["label_store"]:
+        if folder not in _shard_labels:
+            _shard_labels[folder] = LabelStore.of_dataset(folder)
+        labels = _shard_labels[folder]
+    xmls = list_uis(folder, pkg)
+    fingerprints, known = None, None
+    if previous is not None:
+        fingerprints = {x: ui_fingerprint(join(folder, pkg, x), labels)
+                        for x in xmls}
+        old = previous.get("uis", dict())
+        shard_ready = previous.get("count", 0) == 0 or exists(shard_file)
+        if shard_ready and fingerprints == old:
+            return index, previous.get("count", 0), fingerprints, dict()
+        if shard_ready:
+            known = {x: None for x in xmls
+                     if x in old and old[x] == fingerprints[x]}
+        if known and exists(shard_file):
+            with np.load(shard_file) as shard:
+                hashes = [shard[hash_key(k, h.grid_size)]
+                          for k, h in enumerate(_shard_hasher)]
+                for j, name in enumerate(shard["name"].tolist()):
+                    xml = name[len(pkg) + 1:]
+                    if xml in known:
+                        known[xml] = [a[j] for a in hashes]
+
+    hash_lists, apk_xml_list = hash_package(
+        folder, pkg, _shard_hasher,
+        filter_few_nodes=_shard_args["filter_few_nodes"],
+        naive_xml=_shard_args["naive_xml"],
+        xmls=xmls, known=known,
+        streaming=_shard_args["streaming"],
+        sizes=sizes, labels=labels,
+        web_tags=_shard_args["web_tags"])
+    if len(apk_xml_list) > 0:
+        tmp = f"{shard_file}.tmp"
+        with open(tmp, mode="wb") as f:
+            np.savez(f, name=np.array(apk_xml_list),
+                     **{hash_key(k, h.grid_size): np.array(a) for k, (h, a)
+                        in enumerate(zip(_shard_hasher, hash_lists))})
+        os.replace(tmp, shard_file)
+    elif exists(shard_file):
+        os.remove(shard_file)
+    return index, len(apk_xml_list), fingerprints, \
+        dict() if sizes is None else sizes.pop_new()
+
+
+def merge_shards(shard_path: str, shards: list,
+                 hash_npy: str, name_npy: str, key: str = "hash"):
+    """ Concatenate shards into the hash/name npy files. Shards are
+    copied one by one into a memory-mapped output, so that only one
+    shard is held in memory at a time
+
+    Args:
+        shard_path (str): folder of the shard files
+        shards (list): (shard name, count) of the shards, in output order
+        hash_npy (str): output path for UI#s
+        name_npy (str): output path for names
+        key (str): the UI#s to take from the shards, see `hash_key`
+    """
+    shards = [(i, c) for i, c in shards if c > 0]
+    total = sum(c for _, c in shards)
+    apk_xml_list = list()
+    if total == 0:
+        np.save(hash_npy, [], allow_pickle=True)
+        np.save(name_npy, apk_xml_list, allow_pickle=True)
+        return
+
+    out = None
+    k = 0
+    for shard_name, count in shards:
+        with np.load(join(shard_path, shard_name)) as shard:
+            hashes = shard[key]
+            if out is None:
+                out = np.lib.format.open_memmap(
+                    hash_npy, mode="w+", dtype=hashes.dtype,
+                    shape=(total,) + hashes.shape[1:])
+            out[k:k + count] = hashes
+            apk_xml_list.extend(shard["name"].tolist())
+        k += count
+    out.flush()
+    del out
+    np.save(name_npy, apk_xml_list, allow_pickle=True)
 
 
 def gen_hash_data(ipt_paths: list,
                   opt_path: str,
                   view_img_dataset: str,
-                  hash_grid_size: Tuple[int, int] = (5, 5),
+                  hash_grid_size: Tuple[int, int] or list = (5, 5),
                   filter_few_nodes: int = 6,
                   input_dataset_name: str = "",
                   naive_xml: bool = False,
-                  num_classes: int = 0):
-    """ Generate uihash for one or more input path(s). """
+                  num_classes: int = 0,
+                  engine: str = "exact",
+                  workers: int = 1,
+                  incremental: bool = False,
+                  streaming: bool = False,
+                  size_index: bool = False,
+                  root_bounds: bool = False,
+                  label_store: bool = False,
+                  web_tags: bool = False):
+    """ Generate uihash for one or more input path(s). Apps are
+    hashed one by one (or by a pool of `workers` processes) into
+    shard files, which are merged in the order of input path, app
+    name and xml name.
+
+    In the incremental mode, the shards are kept in the output path
+    together with a `HashManifest`. Later runs only hash new or changed
+    UIs, drop the removed ones, and rebuild the npy files from the
+    shards. An interrupted run resumes from the last finished app.
+    With `streaming`, the xmls are read by the single pass expat reader.
+
+    Screen sizes are read from the screenshot headers. With `size_index`,
+    they are also kept in a sidecar index in each input path (see
+    `ScreenSizes`), and later runs do not touch the screenshots. With
+    `root_bounds`, the root bounds of a hierarchy are used when available.
+    With `label_store`, view types are read from the `LabelStore` in each
+    input path instead of the `classify.txt` files. With `web_tags`, view
+    types of web pages are mapped from their html tags, and an input path
+    with the jsons of web_crawler.py in it is hashed as one app.
+
+    `hash_grid_size` can be a list of grid sizes. Each UI is then read
+    once, and a dataset is written for every grid size, the same as a
+    run with that grid size alone """
+    grid_sizes = [tuple(hash_grid_size)] if isinstance(hash_grid_size[0], int) \
+        else [tuple(g) for g in hash_grid_size]
 
     if len(opt_path) == 0:
         opt_path = join(os.path.abspath(os.path.dirname(__file__)),
@@ -37,52 +400,141 @@ def gen_hash_data(ipt_paths: list,
         makedirs(opt_path)
         print("hash npy output path:", opt_path)
 
-    hash_list = list()
-    apk_xml_list = list()
-    
     if num_classes > 0:
         type_number = num_classes
+    elif exists(join(view_img_dataset, "imgdata_classes.txt")):
+        # the classes of a packed view image dataset, see `ImgDataSet`
+        with open(join(view_img_dataset, "imgdata_classes.txt"),
+                  mode='r', encoding='utf-8') as f:
+            type_number = len(f.read().splitlines()) + 1
     else:
         classes_names = listdir(view_img_dataset)
         classes_names = [c for c in classes_names if
                          os.path.isdir(os.path.join(view_img_dataset, c))]
         # +1: others (images in most cases)
         type_number = len(classes_names) + 1
-        
-    k = 0
-    for folder in ipt_paths:
-        print(f"----------entering: {folder}----------")
-        pkgs = listdir(folder)
-        total = len(pkgs)
-        hasher = Nodes2Hash(hash_grid_size, type_number)
-
-        for i, pkg in enumerate(sorted(pkgs)):
-            print(f'{i + 1}/{total} {pkg}')
-            if not os.path.isdir(join(folder, pkg)):
-                continue
-            xmls = listdir(join(folder, pkg))
-            xmls = [i for i in xmls if i.endswith("xml") or i.endswith("json")]
-            for xml in xmls:
-                xml_path = join(folder, pkg, xml)
-                nodes = XMLReader(xml_path, naive_xml=naive_xml).node_dicts
-                if filter_few_nodes > 0:
-                    if len(nodes) < filter_few_nodes:
-                        continue
-                ui_hash = hasher.gen_uihash(xml_path=xml_path, nodes=nodes)
-                if ui_hash is not None:
-                    hash_list.append(ui_hash)
-                    apk_xml_list.append(f"{pkg} {xml}")
-                    k += 1
-    print(k, "xmls to hashes.")
-
-    postfix = f"_{input_dataset_name}" \
-              f"_{hash_grid_size[0]}x{hash_grid_size[1]}" \
+
+    postfixes = [f"_{input_dataset_name}_{g[0]}x{g[1]}x{type_number}"
+                 .replace("__", "_") for g in grid_sizes]
+    # the manifest and shards of an incremental run, shared by the
+    # grid sizes
+    postfix = f"_{input_dataset_name}_" \
+              f"{'+'.join(f'{g[0]}x{g[1]}' for g in grid_sizes)}" \
               f"x{type_number}"
     postfix = postfix.replace("__", "_")
-    np.save(join(opt_path, f"hash{postfix}.npy"),
-            hash_list, allow_pickle=True)
-    np.save(join(opt_path, f"name{postfix}.npy"),
-            apk_xml_list, allow_pickle=True)
+
+    manifest = None
+    if incremental:
+        settings = {"grid_size": list(grid_sizes[0]), "channels": type_number,
+                    "engine": engine, "filter": filter_few_nodes,
+                    "naive_xml": naive_xml}
+        if len(grid_sizes) > 1:
+            settings["grid_sizes"] = [list(g) for g in grid_sizes]
+        if label_store:
+            settings["label_store"] = True
+        if web_tags:
+            settings["web_tags"] = True
+        # both change the screen sizes, and so the hashes. a cached
+        # size is not checked against a replaced screenshot
+        if root_bounds:
+            settings["root_bounds"] = True
+        if size_index:
+            settings["size_index"] = True
+        shard_path = join(opt_path, f"shards{postfix}")
+        manifest = HashManifest(join(opt_path, f"manifest{postfix}.json"),
+                                settings)
+        if manifest.reset and exists(shard_path):
+            print("hash settings changed, rebuild all")
+            rmtree(shard_path)
+        if not exists(shard_path):
+            makedirs(shard_path)
+    else:
+        shard_path = mkdtemp(prefix=".shards_", dir=opt_path)
+
+    try:
+        tasks, progress = list(), dict()
+        for folder in ipt_paths:
+            pkgs = sorted(listdir(folder))
+            if web_tags and any(i.endswith(".json") for i in pkgs):
+                # the output folder of a web crawl
+                folder, pkgs = os.path.split(os.path.abspath(folder))
+                pkgs = [pkgs]
+            folder_tag = sha1(os.path.abspath(folder).encode()).hexdigest()[:8]
+            for i, pkg in enumerate(pkgs):
+                if not os.path.isdir(join(folder, pkg)) or \
+                        pkg == LabelStore.DIR_NAME:
+                    continue
+                index = len(tasks)
+                progress[index] = (folder, f'{i + 1}/{len(pkgs)} {pkg}')
+                if manifest is None:
+                    tasks.append((index, folder, pkg, f"{index}.npz", None))
+                else:
+                    key = f"{folder_tag}_{pkg}"
+                    tasks.append((index, folder, pkg, f"{key}.npz",
+                                  manifest.apps.get(key, dict())))
+
+        init_args = (grid_sizes, type_number, engine, shard_path,
+                     filter_few_nodes, naive_xml, streaming,
+                     size_index, root_bounds, label_store, web_tags)
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=_init_shard_worker,
+                                       initargs=init_args)
+            results = pool.map(_hash_shard, tasks)
+        else:
+            pool = None
+            _init_shard_worker(*init_args)
+            results = map(_hash_shard, tasks)
+
+        size_indexes = {folder: ScreenSizes(folder) for folder in
+                        dict.fromkeys(task[1] for task in tasks)} \
+            if size_index else dict()
+        shards = list()
+        k = 0
+        current_folder = None
+        try:
+            for index, count, fingerprints, new_sizes in results:
+                folder, info = progress[index]
+                if folder != current_folder:
+                    print(f"----------entering: {folder}----------")
+                    current_folder = folder
+                print(info)
+                _, _, pkg, shard_name, previous = tasks[index]
+                shards.append((shard_name, count))
+                k += count
+                if new_sizes:
+                    size_indexes[folder].update(new_sizes)
+                if manifest is not None:
+                    app = {"folder": folder, "pkg": pkg,
+                           "count": count, "uis": fingerprints}
+                    if app != previous:
+                        manifest.update(shard_name[:-4], app)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            for sizes in size_indexes.values():
+                sizes.save()
+        print(k, "xmls to hashes.")
+
+        if manifest is not None:
+            # apps removed from the input paths
+            current = set(shard_name[:-4] for _, _, _, shard_name, _ in tasks)
+            for key in [a for a in manifest.apps if a not in current]:
+                manifest.update(key, None)
+                if exists(join(shard_path, f"{key}.npz")):
+                    os.remove(join(shard_path, f"{key}.npz"))
+
+        for k, (grid_size, _postfix) in enumerate(zip(grid_sizes, postfixes)):
+            merge_shards(shard_path, shards,
+                         join(opt_path, f"hash{_postfix}.npy"),
+                         join(opt_path, f"name{_postfix}.npy"),
+                         key=hash_key(k, grid_size))
+        if manifest is not None:
+            manifest.save()
+    finally:
+        # the shards of a run that is not incremental are never reused
+        if manifest is None:
+            rmtree(shard_path, ignore_errors=True)
 
 
 def parse_arg_uihash(input_args: list):
@@ -100,13 +552,43 @@ def parse_arg_uihash(input_args: list):
                         help="make it 'ori' when the only ipt_path is the original apps "
                              "in a labeled dataset like RePack, and 're' for the repackaged "
                              "apps. Just keep it unset when working on an unlabeled dataset")
-    parser.add_argument("--grid_size", "-g", default='5,5', type=str,
-                        help="expected grid size for UI#. format: tick_horizontal,tick_vertical")
+    parser.add_argument("--grid_size", "-g", default=['5,5'], type=str, nargs='+',
+                        help="expected grid size for UI#. format: tick_horizontal,tick_vertical. "
+                             "give more than one (e.g., 5,5 4,3 10,10) to write a "
+                             "dataset for each in one pass")
     parser.add_argument("--filter", "-f", default=5, type=int,
                         help="0 to remove filter, otherwise the threshold of "
                              "the minimal accepted visible nodes in a UI")
     parser.add_argument("--num_classes", "-c", default=0, type=int,
                         help="Manually specify number of classes (bypasses view_image_path check)")
+    parser.add_argument("--engine", "-e", default="exact", choices=ENGINES,
+                        help="exact: batch IoU, identical to the original loop. "
+                             "fast: also vectorize the amplification (differs "
+                             "in floating point rounding). legacy: the original loop")
+    parser.add_argument("--workers", "-w", default=1, type=int,
+                        help="number of processes to hash apps in parallel")
+    parser.add_argument("--incremental", "-i", action="store_true",
+                        help="keep a manifest and per-app shards in the output "
+                             "path, and only hash new or changed UIs next time. "
+                             "an interrupted run resumes from the last app")
+    parser.add_argument("--stream", action="store_true",
+                        help="read xmls in a single expat pass instead of a "
+                             "minidom tree. faster, and gives the same nodes")
+    parser.add_argument("--size_index", action="store_true",
+                        help="keep the screen sizes in a sidecar index in each "
+                             "input path, so later runs do not open screenshots. "
+                             "delete it after replacing screenshots")
+    parser.add_argument("--root_bounds", action="store_true",
+                        help="take the screen size from the root bounds of a "
+                             "hierarchy when available. they may exclude the "
+                             "system bars of a screenshot")
+    parser.add_argument("--label_store", action="store_true",
+                        help="read view types from the label store in each input "
+                             "path (see label_store.py), instead of classify.txt")
+    parser.add_argument("--web_tags", action="store_true",
+                        help="map the view types of web pages from their html tags "
+                             "(see reclass_web.py), without view images. an input "
+                             "path can be the output folder of web_crawler.py")
 
     _args = parser.parse_args(input_args)
     return _args
@@ -117,9 +599,10 @@ if __name__ == "__main__":
     args = parse_arg_uihash(sys.argv[1:])
     print(f"Parsed args: {args}", flush=True)
     try:
-        t1, t2 = args.grid_size.split(',')
-        t1, t2 = int(t1), int(t2)
-        grid_size = (t1, t2)
+        grid_size = list()
+        for g in args.grid_size:
+            t1, t2 = g.split(',')
+            grid_size.append((int(t1), int(t2)))
         start = perf_counter()
         gen_hash_data(ipt_paths=args.input_path[0],
                       opt_path=args.output_path,
@@ -128,9 +611,17 @@ if __name__ == "__main__":
                       filter_few_nodes=args.filter,
                       input_dataset_name=args.dataset_name,
                       naive_xml=args.naivexml,
-                      num_classes=args.num_classes)
+                      num_classes=args.num_classes,
+                      engine=args.engine,
+                      workers=args.workers,
+                      incremental=args.incremental,
+                      streaming=args.stream,
+                      size_index=args.size_index,
+                      root_bounds=args.root_bounds,
+                      label_store=args.label_store,
+                      web_tags=args.web_tags)
         end = perf_counter()
-        print(f"time cost {args.grid_size}:", end - start)
+        print(f"time cost {' '.join(args.grid_size)}:", end - start)
 
     except ValueError:
         print("invalid value for grid_size. example: 5,5")
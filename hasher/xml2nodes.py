@@ -3,29 +3,49 @@
 import xml.dom.minidom as mdom
 from xml.dom.minidom import parseString, Element
 from xml.parsers import expat
-from util.util_xml import xml_init, valid_xml, read_all_nodes
+from util.util_xml import xml_init, valid_xml, read_all_nodes, \
+    is_removal_package
 from util.util_log import Logger
+from util.util_nodes import NodeTable, NodeTableBuilder
+from util.util_json import load_json, iter_json_nodes
 
 
-import json
-
 class XMLReader:
     """Read a view hierarchy XML (given by uiautomator) or JSON (Rico/Web) and
-    turn it into a dictionary
+    turn it into a `NodeTable`
+
+    Args:
+        xml_path (str): Path to the hierarchy file
+        only_visible (bool): Keep visible views only
+        naive_xml (bool): True if the hierarchy is dumped by naive adb
+        streaming (bool): Read a xml in a single expat pass instead of
+          building a minidom tree. The views are the same
+
+    Attributes:
+        table (NodeTable): the views
+        node_dicts (list): the views as dicts, see `NodeTable.to_dicts`
+        root_bounds ((int, int)): the right-bottom corner of the first
+          view with bounds (usually the root view), if it starts at (0, 0)
     """
     def __init__(self, xml_path: str, only_visible: bool = True,
-                 naive_xml: bool = False):
+                 naive_xml: bool = False, streaming: bool = False):
         self._logger = Logger()
         self.err_count: int = 0
         self.nodes = list()
-        self.node_dicts = list()
+        self.table = NodeTableBuilder().build()
+        self._node_dicts = None
+        self.root_bounds = None
         self._only_visible = only_visible
-        
+
         if xml_path.endswith('.json'):
             try:
-                with open(xml_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                self.read_json_nodes(data)
+                data = load_json(xml_path)
+                node_dicts = list()
+                self.read_json_nodes(data, node_dicts)
+                if len(node_dicts) > 0:
+                    self.root_bounds = self.root_size(node_dicts[0]['lt'],
+                                                      node_dicts[0]['rb'])
+                self.table = NodeTable.from_dicts(node_dicts)
                 self._logger.get_logger.debug(f"successfully extract nodes from {xml_path}")
             except Exception as e:
                 self.err_count += 1
@@ -35,44 +55,71 @@ class XMLReader:
                 xml = valid_xml(xml_path)
                 if xml is None:
                     self._logger.get_logger.warn(f"empty xml data in {xml_path}")
+                if streaming:
+                    self.read_xml_stream(xml, naive_xml)
+                    self._logger.get_logger.debug(f"successfully extract nodes from {xml_path}")
+                    return
                 self._root = parseString(xml)
                 xml_init(self._root)
+                element = self.first_bounds_element(self._root)
+                if element is not None:
+                    self.root_bounds = self.parse_root_bounds(
+                        element.getAttribute('bounds'))
                 if not self._only_visible:
                     read_all_nodes(self.nodes, self._root, True)
                 else:
                     self.read_all_visible_nodes(self.nodes, self._root, True, naive_xml)
-                self.node_dicts = [self.get_dict(i) for i in self.nodes]
-                self.node_dicts = [n for n in self.node_dicts if 'lt' in n]
+                self.table = NodeTable.from_dicts(
+                    [self.get_dict(i) for i in self.nodes])
                 self._logger.get_logger.debug(f"successfully extract nodes from {xml_path}")
             except expat.ExpatError as e:
                 self.err_count += 1
                 self._logger.get_logger.warn(f"invalid xml {xml_path}: {e}")
+            except ValueError as e:
+                self.err_count += 1
+                self._logger.get_logger.warn(f"invalid bounds in {xml_path}: {e}")
 
-    def read_json_nodes(self, node: dict):
-        """Recursively read nodes from Rico-format JSON"""
-        _dict = dict()
-        # Map componentLabel to name (class)
-        # Use filename-safe tag name if possible, or just the tag
-        _dict['name'] = node.get('componentLabel', 'view')
-        
-        # Map bounds [x1, y1, x2, y2] to lt/rb
-        if 'bounds' in node:
+    @staticmethod
+    def first_bounds_element(root: mdom.Node) -> Element or None:
+        """The first element with bounds in document order, usually the
+        root view. The walk stops there, instead of listing the tree"""
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.nodeType == node.ELEMENT_NODE and node.hasAttribute('bounds'):
+                return node
+            stack.extend(reversed(node.childNodes))
+        return None
+
+    @property
+    def node_dicts(self) -> list:
+        if self._node_dicts is None:
+            self._node_dicts = self.table.to_dicts()
+        return self._node_dicts
+
+    def read_json_nodes(self, root: dict, node_dicts: list):
+        """Read the nodes of a Rico-format JSON into `node_dicts`, in
+        pre-order. Deep trees are fine, see `iter_json_nodes`"""
+        for node in iter_json_nodes(root):
+            # Nodes without bounds are not views
+            if 'bounds' not in node:
+                continue
+            _dict = dict()
+            # Map componentLabel to name (class)
+            # Use filename-safe tag name if possible, or just the tag
+            _dict['name'] = node.get('componentLabel', 'view')
+
+            # Map bounds [x1, y1, x2, y2] to lt/rb
             b = node['bounds']
             _dict['lt'] = [str(b[0]), str(b[1])]
             _dict['rb'] = [str(b[2]), str(b[3])]
-        
-        # Web elements are generally visible if they are in the DOM and have bounds
-        # We can add more complex visibility logic later if needed
-        _dict['visible'] = 'true'
-        _dict['text'] = '' # Text extraction not implemented in crawler yet
-        _dict['interact'] = _dict['name'] in ['a', 'button', 'input', 'select', 'textarea']
-        
-        if 'lt' in _dict:
-            self.node_dicts.append(_dict)
-            
-        if 'children' in node:
-            for child in node['children']:
-                self.read_json_nodes(child)
+
+            # Web elements are generally visible if they are in the DOM and have bounds
+            # We can add more complex visibility logic later if needed
+            _dict['visible'] = 'true'
+            _dict['text'] = '' # Text extraction not implemented in crawler yet
+            _dict['interact'] = _dict['name'] in ['a', 'button', 'input', 'select', 'textarea']
+            node_dicts.append(_dict)
 
     def get_dict(self, node: mdom.Element) -> dict:
         _dict = dict()
@@ -88,6 +135,93 @@ class XMLReader:
             or node.getAttribute('checkable').startswith('t')
         return _dict
 
+    def read_xml_stream(self, xml: str, naive_xml: bool = False):
+        """Read the views of a xml in one pass. It does what `xml_init`,
+        `read_all_visible_nodes` (or `read_all_nodes`) and `get_dict` do,
+        while expat reports the elements: a removal node is skipped together
+        with its subtree, and the other elements are checked and added to
+        the table in document order
+
+        Args:
+            xml (str): A xml string given by `valid_xml`
+            naive_xml (bool): Same as `read_all_visible_nodes`
+        """
+        builder = NodeTableBuilder()
+        only_visible = self._only_visible
+        skip_depth = 0
+        root_found = False
+
+        def start_element(_, attrs: dict):
+            nonlocal skip_depth, root_found
+            if skip_depth:
+                skip_depth += 1
+                return
+            if is_removal_package(attrs.get('package', '')):
+                skip_depth = 1
+                return
+            if not root_found and 'bounds' in attrs:
+                root_found = True
+                self.root_bounds = self.parse_root_bounds(attrs['bounds'])
+            if only_visible and not self.is_visible(attrs, naive_xml):
+                return
+            bounds = attrs.get('bounds', '').replace(']', '').split('[')
+            if len(bounds) < 2:
+                return
+            lt, rb = bounds[1].split(','), bounds[2].split(',')
+            interact = attrs.get('clickable', '').startswith('t') \
+                or attrs.get('long-clickable', '').startswith('t') \
+                or attrs.get('checkable', '').startswith('t')
+            builder.append(attrs.get('class', ''), lt[0], lt[1], rb[0], rb[1],
+                           attrs.get('text', ''), interact,
+                           None if only_visible
+                           else attrs.get('visible-to-user', ''))
+
+        def end_element(_):
+            nonlocal skip_depth
+            if skip_depth:
+                skip_depth -= 1
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.Parse(xml, True)
+        self.table = builder.build()
+
+    @staticmethod
+    def parse_root_bounds(bounds: str) -> tuple or None:
+        """(right, bottom) of bounds like '[0,0][1080,1920]', or None
+        if they do not start at (0, 0) or are empty"""
+        bounds = bounds.replace(']', '').split('[')
+        if len(bounds) < 3:
+            return None
+        return XMLReader.root_size(bounds[1].split(','), bounds[2].split(','))
+
+    @staticmethod
+    def root_size(lt: list, rb: list) -> tuple or None:
+        """(right, bottom) of a root view given its corners, or None"""
+        try:
+            h1, v1, h2, v2 = int(lt[0]), int(lt[1]), int(rb[0]), int(rb[1])
+        except (ValueError, IndexError):
+            return None
+        if h1 != 0 or v1 != 0 or h2 <= 0 or v2 <= 0:
+            return None
+        return h2, v2
+
+    @staticmethod
+    def is_visible(attrs: dict, naive_xml: bool = False) -> bool:
+        """The rules of `read_all_visible_nodes`, on the attributes
+        of an element"""
+        _class = attrs.get('class', '')
+        if _class.endswith('Layout') or _class.endswith('Group') \
+                or _class.split('.')[-1].startswith('Scroll'):
+            return False
+        if not naive_xml and \
+                not attrs.get('visible-to-user', '').startswith('t'):
+            return False
+        if _class.endswith('TextView'):
+            return len(attrs.get('text', '').strip()) > 0
+        return True
+
     @classmethod
     def read_all_visible_nodes(cls, node_list: list, node: Element,
                                is_root: bool = True, naive_xml: bool = False):
@@ -0,0 +1,217 @@
+"""An approximate nearest neighbour index over the siamese embeddings of
+a UI set, e.g., the UIs of known apps, so that new UIs are checked
+against it without comparing them with every UI. It is an inverted file
+(IVF): the normalized embeddings are clustered by k-means, and a query
+is only scored against the UIs of its n_probe closest clusters"""
+
+import argparse
+import hashlib
+import json
+import os.path
+import sys
+from os.path import exists, join
+from typing import Tuple
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from similarity import embed_uis, to_csr, top_k_rows
+
+
+def model_file_fingerprint(path: str) -> str:
+    """ Hash of a model file, so that an index is not queried with
+    embeddings of another model """
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_file(siamese_model) -> str:
+    """ The artifact of a `SiameseModel` if it has one, or its model """
+    if len(siamese_model.artifact_path) > 0:
+        return siamese_model.artifact_path
+    return siamese_model.model_path
+
+
+class UIIndex:
+    """ IVF index of the UIs of a dataset
+
+    Args:
+        embeddings (np.ndarray): [n, d] normalized, grouped by cluster
+        ids (np.ndarray): [n] the position in the dataset of each row
+        names (np.ndarray): [n] "{app} {xml}" of the UIs of the dataset
+        centroids (np.ndarray): [clusters, d] normalized
+        list_offsets (np.ndarray): the rows of cluster c are
+          list_offsets[c]:list_offsets[c + 1]
+        meta (dict): the model and the dataset the index is built for
+        siamese_model (SiameseModel): to embed the queries
+    """
+    def __init__(self, embeddings: np.ndarray, ids: np.ndarray,
+                 names: np.ndarray, centroids: np.ndarray,
+                 list_offsets: np.ndarray, meta: dict, siamese_model=None):
+        self.embeddings = embeddings
+        self.ids = ids
+        self.names = names
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.meta = meta
+        self.model = siamese_model
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def default_path(dataset_name: str, hash_size: Tuple[int, int, int],
+                     siamese_model) -> str:
+        """ Next to the UI#s: output/hash/index_{dataset}_{size}_{model}.npz """
+        size_str = f"{hash_size[1]}x{hash_size[2]}x{hash_size[0]}"
+        model_name = os.path.splitext(os.path.basename(model_file(siamese_model)))[0]
+        return join(siamese_model.root_path, "output", "hash",
+                    f"index_{dataset_name.lower()}_{size_str}_{model_name}.npz")
+
+    @classmethod
+    def build(cls, siamese_model, uis, names, clusters: int = 0,
+              seed: int = 0, batch_size: int = 1024) -> 'UIIndex':
+        """ Embed the UIs and cluster them
+
+        Args:
+            siamese_model (SiameseModel): a trained model
+            uis: [n, c, h, v] UI#s
+            names: [n] "{app} {xml}" of the UIs
+            clusters (int): Default: about sqrt(n)
+            seed (int): the seed of k-means
+            batch_size (int): UIs per forward
+        """
+        if not siamese_model.model_ready:
+            siamese_model.load_model()
+        embeddings = embed_uis(siamese_model.net, uis, siamese_model.device,
+                               batch_size)
+        n = len(embeddings)
+        if n == 0:
+            raise ValueError("no ui to index")
+        clusters = min(n, clusters if clusters > 0 else int(np.sqrt(n)) + 1)
+        kmeans = MiniBatchKMeans(n_clusters=clusters, random_state=seed,
+                                 n_init=3, batch_size=4096).fit(embeddings)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-8)
+        ids = np.argsort(kmeans.labels_, kind='stable')
+        list_offsets = np.zeros(clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(kmeans.labels_, minlength=clusters),
+                  out=list_offsets[1:])
+        meta = {"model": os.path.basename(model_file(siamese_model)),
+                "fingerprint": model_file_fingerprint(model_file(siamese_model)),
+                "hash_size": list(siamese_model.hash_size),
+                "clusters": clusters}
+        return cls(embeddings[ids], ids, np.asarray(names, dtype=str), centroids,
+                   list_offsets, meta, siamese_model)
+
+    def save(self, path: str):
+        np.savez(path, embeddings=self.embeddings, ids=self.ids,
+                 names=self.names, centroids=self.centroids,
+                 list_offsets=self.list_offsets, meta=json.dumps(self.meta))
+        print(f"index of {len(self)} uis saved: {path}")
+
+    @classmethod
+    def load(cls, path: str, siamese_model) -> 'UIIndex':
+        """ Load an index saved by `save`, to query it with the model it
+        is built with """
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["fingerprint"] != model_file_fingerprint(model_file(siamese_model)):
+                raise ValueError(f"the index is built with another model: "
+                                 f"{meta['model']}")
+            return cls(data["embeddings"], data["ids"], data["names"],
+                       data["centroids"], data["list_offsets"], meta,
+                       siamese_model)
+
+    def query(self, ui_hashes, k: int = 10, threshold: float = 0.6,
+              n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ The k most similar UIs above the threshold of some UI#s
+
+        Args:
+            ui_hashes: [q, c, h, v] UI#s
+            k (int): the most neighbours of a query
+            threshold (float): the threshold of similar UIs
+            n_probe (int): clusters to search for a query. More is
+              slower, and finds more of the exact neighbours
+
+        Returns:
+            (indptr, indices, scores) in CSR, i.e., the neighbours of
+            query r are indices[indptr[r]:indptr[r + 1]], with their
+            scores, from the most similar one. The indices are the
+            positions in the dataset, see `names`
+        """
+        if not self.model.model_ready:
+            self.model.load_model()
+        queries = embed_uis(self.model.net, ui_hashes, self.model.device)
+        return self.search(queries, k, threshold, n_probe)
+
+    def search(self, queries: np.ndarray, k: int = 10, threshold: float = 0.6,
+               n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ `query` with embeddings, see `embed_uis` """
+        n_probe = min(n_probe, len(self.centroids))
+        centroid_scores = queries @ self.centroids.T
+        if n_probe < len(self.centroids):
+            probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probes = np.broadcast_to(np.arange(len(self.centroids)),
+                                     centroid_scores.shape)
+        starts, ends = self.list_offsets[:-1], self.list_offsets[1:]
+        indices, scores, counts = list(), list(), list()
+        for query, probe in zip(queries, probes):
+            lengths = ends[probe] - starts[probe]
+            # the rows of the probed clusters
+            rows = np.repeat(starts[probe] - np.cumsum(lengths) + lengths, lengths) \
+                + np.arange(lengths.sum())
+            top, top_scores, count = top_k_rows(
+                (self.embeddings[rows] @ query)[None, :], k, threshold)
+            indices.append(self.ids[rows[top]])
+            scores.append(top_scores)
+            counts.append(count)
+        return to_csr(len(queries), indices, scores, counts)
+
+
+def parse_arg_index(input_args: list):
+    parser = argparse.ArgumentParser(
+        description="Build the nearest neighbour index of the UI#s of a dataset")
+    parser.add_argument("dataset_name", type=str,
+                        help="make sure the hash files exist in output/hash")
+    parser.add_argument("--hash_size", "-hs", default='10,5,5', type=str,
+                        help="shape of UI#. format: channel,tick_horizontal,tick_vertical")
+    parser.add_argument("--epoch", "-e", default=36, type=int,
+                        help="training epoch of the model")
+    parser.add_argument("--batch_size", "-b", default=32, type=int,
+                        help="training batch size of the model")
+    parser.add_argument("--artifact", default="", type=str,
+                        help="embed with this TorchScript artifact")
+    parser.add_argument("--clusters", "-c", default=0, type=int,
+                        help="clusters of the index. default: about sqrt of the uis")
+    return parser.parse_args(input_args)
+
+
+if __name__ == '__main__':
+    from siamese import SiameseModel
+    args = parse_arg_index(sys.argv[1:])
+    try:
+        hash_shape = tuple(int(a) for a in args.hash_size.split(','))
+        assert len(hash_shape) == 3
+    except (ValueError, AssertionError):
+        print("invalid hash size. example: 10,5,5")
+        exit(1)
+    sm = SiameseModel(epoch=args.epoch, batch_size=args.batch_size,
+                      hash_size=hash_shape, load_labelled_dataset=False,
+                      artifact=args.artifact)
+    size_str = f"{hash_shape[1]}x{hash_shape[2]}x{hash_shape[0]}"
+    hash_path = join(sm.root_path, "output", "hash")
+    data_path = join(hash_path, f"hash_{args.dataset_name.lower()}_{size_str}.npy")
+    name_path = join(hash_path, f"name_{args.dataset_name.lower()}_{size_str}.npy")
+    if not exists(data_path) or not exists(name_path):
+        print(f"hash files not found: {data_path}")
+        exit(1)
+    all_data = np.load(data_path, allow_pickle=True)
+    all_data = np.stack([np.reshape(i, hash_shape) for i in all_data])
+    index = UIIndex.build(sm, all_data, np.load(name_path, allow_pickle=True),
+                          args.clusters)
+    index.save(UIIndex.default_path(args.dataset_name, hash_shape, sm))
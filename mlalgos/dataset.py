@@ -1,5 +1,7 @@
 """Generate input dataset for machine learning"""
 
+import copy
+from concurrent.futures import ProcessPoolExecutor
 from time import perf_counter
 from os import makedirs
 from os.path import exists, join
@@ -17,6 +19,26 @@ import torch
 import sys
 import argparse
 
+from similarity import PairIndex, embed_uis, keep_distinct
+
+
+# per-process states for `_filter_app`, see `_init_filter_worker`
+_filter_embeddings = None
+_filter_threshold = None
+
+
+def _init_filter_worker(embeddings: np.ndarray, threshold: float):
+    global _filter_embeddings, _filter_threshold
+    _filter_embeddings = embeddings
+    _filter_threshold = threshold
+
+
+def _filter_app(task: tuple) -> Tuple[int, np.ndarray]:
+    """ The kept uis of one app. A task is (app index, the indexes of
+    its uis), and the positions of the kept uis in them are returned """
+    k, xml_indexes = task
+    return k, keep_distinct(_filter_embeddings[xml_indexes], _filter_threshold)
+
 
 class WildDataSet(Dataset):
     """Dataset for an unlabelled app set, used for detecting only"""
@@ -24,18 +46,18 @@ class WildDataSet(Dataset):
     def __init__(self, dataset_name: str, transform=None,
                  reshape: bool = False,
                  hash_size: Tuple[int, int, int] = (10, 5, 5),
-                 siamese_model=None, threshold: float = 0.6):
+                 siamese_model=None, threshold: float = 0.6,
+                 workers: int = 1):
 
         size_str = f"{hash_size[1]}x{hash_size[2]}x{hash_size[0]}"
         base_path = join(os.path.abspath(os.path.dirname(__file__)),
                          "..", "output")
         npzfile_raw = join(base_path, "dataset",
                            f"{dataset_name}_{size_str}_raw.npz")
-        self.pairs_path = join(base_path, "dataset",
-                               f"{dataset_name}_{size_str}_pairs.npy")
         self.dataset_name = dataset_name
         self.transform = transform
         self.threshold = threshold
+        self.workers = workers
 
         if exists(npzfile_raw):
             self.raw_data = np.load(npzfile_raw, allow_pickle=True)['data']
@@ -66,72 +88,67 @@ class WildDataSet(Dataset):
             _t2 = perf_counter()
             print(f"filter similar uis in each app in {_t2 - _t1} s")
 
-        if exists(self.pairs_path):
-            self.pairs = np.load(self.pairs_path, allow_pickle=True)
-        else:
-            # generate ui pairs
-            self.generate_pairs()
-            print(f"{len(self.pairs)} ui pairs in total")
+        self.generate_pairs()
+        print(f"{len(self.pairs)} ui pairs in total")
 
     def generate_pairs(self):
         """
-        to save space, we only save indexes for pairs
-          format: (index_a (int), index_b (int))
+        index the pairs (index_a (int), index_b (int)) of uis in
+        different apps, without materializing them. see `PairIndex`
         """
-        self.pairs = []
-        print("generating pairs...")
-        for i in range(len(self.raw_name) - 1):
-            print(i)
-            app1 = self.raw_name[i].split(' ')[0]
-            for j in range(i + 1, len(self.raw_name)):
-                app2 = self.raw_name[j].split(' ')[0]
-                if app2 == app1:
-                    # we don't compare uis in one app
-                    continue
-                self.pairs.append((i, j))
-        np.save(self.pairs_path, self.pairs, allow_pickle=True)
+        # we don't compare uis in one app
+        self.pairs = PairIndex.of_names(self.raw_name)
+
+    def shard(self, index: int, count: int) -> 'WildDataSet':
+        """ a copy of the dataset with a shard of the pairs,
+        see `PairIndex.shard` """
+        shard = copy.copy(self)
+        shard.pairs = self.pairs.shard(index, count)
+        return shard
 
     def filter_ui_in_app(self):
+        """
+        remove the near duplicate uis in each app. every ui is embedded
+        once, and each app keeps its uis that are not similar to an
+        earlier kept ui of the app, see `keep_distinct`. the apps are
+        in the order of their first ui, and the kept uis of an app in
+        their order in the hash files
+        """
         # when generating uihash, all the xmls
         # for one app are arranged together, one after another
         xmls_in_apps = dict()
-        remove_total = 0
         for i, a in enumerate(self.all_name):
             app = a.split(' ')[0]
             if app not in xmls_in_apps:
                 xmls_in_apps[app] = [i]
             else:
                 xmls_in_apps[app].append(i)
-                
+
+        if not self.model.model_ready:
+            self.model.load_model()
+        embeddings = embed_uis(self.model.net, self.all_data, self.model.device)
+        tasks = [(k, np.array(xml_indexes))
+                 for k, xml_indexes in enumerate(xmls_in_apps.values())]
         # make pair-wise ui comparision in each app
+        if self.workers > 1:
+            pool = ProcessPoolExecutor(max_workers=self.workers,
+                                       initializer=_init_filter_worker,
+                                       initargs=(embeddings, self.threshold))
+            results = pool.map(_filter_app, tasks, chunksize=16)
+        else:
+            _init_filter_worker(embeddings, self.threshold)
+            pool, results = None, map(_filter_app, tasks)
+
         app_total = len(xmls_in_apps.keys())
-        for k, app in enumerate(xmls_in_apps.keys()):
-            print(f"({k + 1}/{app_total}) {app}")
-            xml_indexes = [x for x in xmls_in_apps[app]]
-            remove_set = set()
-            for i in range(len(xml_indexes) - 1):
-                if i in remove_set:
-                    continue
-                for j in range(i + 1, len(xml_indexes)):
-                    ui1 = self.all_data[xml_indexes[i]]
-                    ui2 = self.all_data[xml_indexes[j]]
-                    ui1, ui2, _ = self.model.deal_data((torch.from_numpy(ui1),
-                                                        torch.from_numpy(ui2),
-                                                        torch.tensor(-1)))
-                    ui = torch.stack((ui1, ui2), 0)
-                    ui = ui.unsqueeze(1)
-                    o = self.model.net(ui)
-                    row = int(o.shape[0] / 2)
-                    o1, o2 = o[:row, :], o[row:, :]
-                    o1 = torch.squeeze(o1, 0)
-                    o2 = torch.squeeze(o2, 0)
-                    distance = torch.cosine_similarity(o1, o2).item()
-                    if distance > self.threshold:
-                        remove_set.add(xml_indexes[j])
-                        remove_total += 1
-            xml_indexes_new = set(xml_indexes).difference(remove_set)
-            self.raw_data.extend([self.all_data[x] for x in xml_indexes_new])
-            self.raw_name.extend([self.all_name[x] for x in xml_indexes_new])
+        remove_total = 0
+        for (k, xml_indexes), (_, kept) in zip(tasks, results):
+            if (k + 1) % 100 == 0 or k + 1 == app_total:
+                print(f"({k + 1}/{app_total}) apps filtered")
+            remove_total += len(xml_indexes) - len(kept)
+            self.raw_data.extend([self.all_data[x] for x in xml_indexes[kept]])
+            self.raw_name.extend([self.all_name[x] for x in xml_indexes[kept]])
+        if pool is not None:
+            pool.shutdown()
 
         print("len of filtered data:", len(self.raw_data))
         print("xml removed:", remove_total)
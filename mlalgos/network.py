@@ -27,7 +27,8 @@ class SiameseNet(nn.Module):
 
     def forward_once(self, x):
         x = self.cnn(x)
-        x = x.view(x.size(0), -1)
+        # reshape: a quantized cnn may give a channels-last output
+        x = x.reshape(x.size(0), -1)
         x = self.fc(x)
         return x
 
@@ -1,5 +1,6 @@
 """Calculate similarity score via a Siamese network"""
 
+import copy
 import os.path
 import time
 from typing import Tuple
@@ -13,10 +14,12 @@ from sys import stdout
 import torch
 from time import perf_counter
 from dataset import LabelledDataSet
+from similarity import embed_uis, iter_cross_app_scores, top_k_neighbours
 from os.path import exists
 from os import makedirs
 from shutil import copyfile
 from os.path import join
+from numpy.lib.format import open_memmap
 from sklearn import metrics
 import sys
 import argparse
@@ -27,6 +30,8 @@ if rootpath not in sys.path:
     sys.path.append(rootpath)
 
 from util.util_draw import draw_roc, draw_history
+from util.util_export import QUANTIZE_MODES, load_artifact, quantize_net, \
+    save_artifact
 
 
 class SiameseModel:
@@ -38,7 +43,8 @@ class SiameseModel:
             epoch: int = 5, batch_size: int = 32,
             binary_loss: bool = False,
             retrain_model: bool = False,
-            load_labelled_dataset: bool = True):
+            load_labelled_dataset: bool = True,
+            artifact: str = ""):
         if torch.cuda.is_available():
             self.device = torch.device("cuda", 0)
         else:
@@ -99,11 +105,114 @@ class SiameseModel:
         model_root_path = join(self.root_path, "models")
         if not exists(model_root_path):
             makedirs(model_root_path)
-        if not self.retrain_model and exists(self.model_path):
+        self.artifact_path = artifact
+        if len(artifact) > 0 or (not self.retrain_model and exists(self.model_path)):
+            self.load_model()
+
+    def load_model(self):
+        """Load the trained model, or the artifact if given. An artifact
+        is made by `export`, and runs on the cpu"""
+        if len(self.artifact_path) > 0:
+            self.net, meta = load_artifact(self.artifact_path)
+            if meta.get("hash_size", list(self.hash_size)) != list(self.hash_size):
+                raise ValueError(f"the artifact is for UI# of {meta['hash_size']}")
+            self.device = torch.device("cpu")
+            print(f"artifact loaded: {self.artifact_path} "
+                  f"(quantization: {meta.get('quantize')})")
+        else:
             self.net.load_state_dict(torch.load(self.model_path,
                                                 map_location=self.device))
             print("model loaded")
-            self.model_ready = True
+        self.net.eval()
+        self.model_ready = True
+
+    def export(self, mode: str = "dynamic", artifact_path: str = "",
+               threshold: float = 0.6, calib_batches: int = 8) -> str:
+        """Export the model as a frozen TorchScript artifact for cpu
+        inference, and print a drift report against the float model
+        on the test subset of the labelled dataset
+
+        Args:
+            mode (str): Quantization, see `util.util_export.QUANTIZE_MODES`.
+              "static" quantizes the convs statically
+            artifact_path (str): The output file. Default: next to the
+              model, `{model name}_{mode}.pt`
+            threshold (float): The threshold of similar pairs
+            calib_batches (int): Training batches to calibrate the static
+              quantization
+
+        Returns:
+            The artifact path
+        """
+        if len(self.artifact_path) > 0:
+            raise ValueError("an artifact can not be exported again")
+        if not exists(self.model_path):
+            raise ValueError(f"train the model first: {self.model_path}")
+        if not self.model_ready:
+            self.load_model()
+        if len(artifact_path) == 0:
+            artifact_path = f"{os.path.splitext(self.model_path)[0]}_{mode}.pt"
+        loader = DataLoader(torch.utils.data.Subset(
+            self.set_repack, self.train_idx[:calib_batches * self.batch_size]),
+            batch_size=self.batch_size)
+        calib_inputs = list()
+        for data in loader:
+            ui1, ui2, _ = self.deal_data(data)
+            calib_inputs.append(torch.stack((ui1, ui2), 0).cpu())
+        # the convs only. quantized PReLUs drift too much
+        convs = [name for name, module in self.net.named_modules()
+                 if isinstance(module, nn.Conv2d)]
+        net = quantize_net(self.net, mode, calib_inputs, static_modules=convs)
+        save_artifact(net, calib_inputs[0], artifact_path,
+                      {"network": type(self.net).__name__,
+                       "hash_size": list(self.hash_size),
+                       "quantize": mode,
+                       "source": os.path.basename(self.model_path)})
+        self.drift_report(artifact_path, threshold)
+        return artifact_path
+
+    def drift_report(self, artifact_path: str, threshold: float):
+        """Compare an artifact with the float model on the test subset:
+        similarity scores, f1 and auc, and cpu latency"""
+        start = perf_counter()
+        artifact, meta = load_artifact(artifact_path)
+        artifact_startup = perf_counter() - start
+        float_net = copy.deepcopy(self.net).cpu().eval()
+        loader = DataLoader(torch.utils.data.Subset(self.set_repack, self.test_idx),
+                            batch_size=self.batch_size)
+        batches = [(torch.stack((i1.float(), i2.float()), 0), target)
+                   for i1, i2, target in loader]
+        targets = [t.item() for _, target in batches for t in target]
+        scores, costs = dict(), dict()
+        for name, net in (("float", float_net), ("artifact", artifact)):
+            distances = list()
+            with torch.no_grad():
+                if batches:
+                    # warm up, the first runs of a TorchScript module are slow
+                    net(batches[0][0])
+                start = perf_counter()
+                for ui, _ in batches:
+                    o = net(ui)
+                    distances.append(torch.cosine_similarity(o[0], o[1]).numpy())
+            costs[name] = (perf_counter() - start) / max(1, len(batches))
+            scores[name] = np.concatenate(distances) if distances else np.zeros(0)
+
+        print(f"drift report of {artifact_path} "
+              f"(quantization: {meta.get('quantize')}) on {len(targets)} test pairs")
+        if len(targets) > 0:
+            out_labels = {k: (v > threshold).astype(int) for k, v in scores.items()}
+            max_diff = np.max(np.abs(scores["float"] - scores["artifact"]))
+            label_agreement = np.mean(out_labels["float"] == out_labels["artifact"])
+            print(f"\tmax abs diff of the scores: {max_diff:.5f}")
+            print(f"\tlabel agreement (threshold={threshold}): "
+                  f"{label_agreement * 100:.2f}%")
+            for name in ("float", "artifact"):
+                f1 = metrics.f1_score(targets, out_labels[name], pos_label=1)
+                fpr, tpr, _ = metrics.roc_curve(
+                    targets, np.clip(scores[name], 0, None), pos_label=1)
+                print(f"\t{name}: f1 {f1:.5f}, auc {metrics.auc(fpr, tpr):.5f}, "
+                      f"{costs[name] * 1000:.2f} ms per batch of {self.batch_size} on cpu")
+        print(f"\tartifact startup: {artifact_startup * 1000:.1f} ms")
 
     def deal_data(self, data):
         i1, i2, label = data
@@ -376,43 +485,74 @@ class SiameseModel:
                 draw_roc(pset, tset, threshold, print_prf=False)
 
     def detect_on_wild_dataset(self, dataset, threshold: float,
-                               batch_size: int = 1024, save_score: bool = False):
-        test_loader = DataLoader(dataset, batch_size=batch_size)
-        self.net.load_state_dict(torch.load(self.model_path,
-                                            map_location=self.device))
-        print("model loaded")
-
-        # network forwarding
-        out_labels = []
-        scores = []
-        print("detecting on", len(dataset), "paris")
+                               batch_size: int = 1024, save_score: bool = False,
+                               top_k: int = 0):
+        """Detect similar UI pairs of different apps in a wild dataset.
+        Each UI is embedded once, and the scores of the pairs come from
+        blocked matrix products, see `similarity.py`. The labels (or
+        scores) are saved in the order of the pair index of the dataset.
+        With top_k, only the top_k most similar UIs of the other apps
+        above the threshold are kept for each UI, and saved in CSR as
+        "{name}_top{top_k}.npz" with the app and xml of each UI
+
+        Args:
+            dataset (WildDataSet): The filtered UIs, arranged by app, or
+              a shard of it (`WildDataSet.shard`), whose output is saved
+              as "{name}_label_{first pair}-{end pair}.npy"
+            threshold (float): The threshold of similar pairs
+            batch_size (int): UIs per forward
+            save_score (bool): Save the scores instead of the labels
+            top_k (int): Save the top_k neighbours of each UI instead of
+              the pairs, if above 0
+        """
+        self.load_model()
+        pair_index = dataset.pairs
+        pair_total = len(pair_index)
+        print("detecting on", pair_total, "pairs of", len(dataset.raw_name), "uis")
         t1 = perf_counter()
-        for i, data in enumerate(test_loader):
-            print(i)
-            ui1, ui2, _ = self.deal_data(data)
-            ui = torch.stack((ui1, ui2), 0)
-            o = self.net(ui)
-            row = int(o.shape[0] / 2)
-            o1, o2 = o[:row, :], o[row:, :]
-            o1 = torch.squeeze(o1, 0)
-            o2 = torch.squeeze(o2, 0)
-            distance = torch.cosine_similarity(o1, o2)
-            if not save_score:
-                output_lables = [1 if i.item() > threshold else 0 for i in distance]
-                out_labels.extend(output_lables)
-            else:
-                scores.extend([i.item() for i in distance])
-
+        embeddings = embed_uis(self.net, dataset.raw_data, self.device,
+                               batch_size, dataset.transform)
         t2 = perf_counter()
-        print(f"done in {t2 - t1} s")
-        if not save_score:
-            np.save(join(self.root_path, "output", "dataset",
-                         f"{dataset.dataset_name}_label.npy"),
-                    out_labels, allow_pickle=True)
-        else:
-            np.save(join(self.root_path, "output", "dataset",
-                         f"{dataset.dataset_name}_score.npy"),
-                    scores, allow_pickle=True)
+        print(f"{len(embeddings)} uis embedded in {t2 - t1} s")
+        if top_k > 0:
+            self._save_top_k(dataset, embeddings, top_k, threshold)
+            print(f"done in {perf_counter() - t1} s")
+            return
+
+        out_name = f"{dataset.dataset_name}_score" if save_score \
+            else f"{dataset.dataset_name}_label"
+        if pair_index.start > 0 or pair_index.stop < pair_index.total:
+            out_name += f"_{pair_index.start}-{pair_index.stop}"
+        # written block by block, as the pairs may not fit in memory
+        out_path = join(self.root_path, "output", "dataset", f"{out_name}.npy")
+        out = open_memmap(out_path, mode="w+", shape=(pair_total,),
+                          dtype=np.float64 if save_score else np.int64)
+        k = 0
+        for _, _, scores, mask in iter_cross_app_scores(embeddings, pair_index):
+            scores = scores[mask]
+            out[k:k + len(scores)] = scores if save_score else scores > threshold
+            k += len(scores)
+        out.flush()
+        del out
+        print(f"done in {perf_counter() - t1} s")
+
+    def _save_top_k(self, dataset, embeddings: np.ndarray, top_k: int,
+                    threshold: float):
+        pair_index = dataset.pairs
+        rows = pair_index.rows()
+        indptr, indices, scores = top_k_neighbours(
+            embeddings, pair_index.offsets, top_k, threshold, rows)
+        out_name = f"{dataset.dataset_name}_top{top_k}"
+        if rows != (0, len(embeddings)):
+            out_name += f"_{rows[0]}-{rows[1]}"
+        names = [str(n) for n in dataset.raw_name]
+        apps = [n.split(' ')[0] for n in names]
+        xmls = [n.replace(a, '', 1).strip() for n, a in zip(names, apps)]
+        # neighbours of ui rows[0] + r: indices[indptr[r]:indptr[r + 1]]
+        np.savez(join(self.root_path, "output", "dataset", f"{out_name}.npz"),
+                 indptr=indptr, indices=indices, scores=scores,
+                 rows=np.array(rows), app=np.array(apps), xml=np.array(xmls))
+        print(f"{len(indices)} neighbours of {rows[1] - rows[0]} uis saved")
 
 
 def mycopy(items, ui_path, out_path, sim_list):
@@ -516,6 +656,21 @@ def parse_arg_siamese(input_args: list):
                         help="draw and show roc figure")
     parser.add_argument("--hash_size", "-hs", default='10,5,5', type=str,
                         help="shape of UI#. format: channel,tick_horizontal,tick_vertical")
+    parser.add_argument("--export", choices=QUANTIZE_MODES,
+                        help="with the repack dataset, export the model as a TorchScript "
+                             "artifact with this quantization, and report the drift")
+    parser.add_argument("--artifact", default="", type=str,
+                        help="detect with this TorchScript artifact")
+    parser.add_argument("--shard", default="0/1", type=str,
+                        help="detect on a shard of the pairs of a wild dataset, "
+                             "shard index/shard count, e.g., 0/4")
+    parser.add_argument("--top_k", "-k", default=0, type=int,
+                        help="on a wild dataset, save the top k similar UIs of other "
+                             "apps above the threshold for each UI, instead of the "
+                             "scores of all the pairs")
+    parser.add_argument("--workers", "-w", default=1, type=int,
+                        help="processes to filter similar UIs in the apps "
+                             "of a wild dataset")
     _args = parser.parse_args(input_args)
     return _args
 
@@ -547,9 +702,12 @@ if __name__ == '__main__':
         lr_init=args.lr,
         retrain_model=args.retrain,
         hash_size=hash_shape,
-        load_labelled_dataset=args.Repack
+        load_labelled_dataset=args.Repack,
+        artifact=args.artifact
     )
-    if args.Repack:
+    if args.Repack and args.export is not None:
+        sm.export(args.export, threshold=args.threshold)
+    elif args.Repack:
         sm.train_and_test(args.threshold, drawroc=args.figure)
     else:
         if len(args.dataset_name) == 0:
@@ -558,7 +716,11 @@ if __name__ == '__main__':
         else:
             from dataset import WildDataSet
             wd = WildDataSet("rmv", hash_size=hash_shape, threshold=args.threshold,
-                             siamese_model=sm, reshape=True)
+                             siamese_model=sm, reshape=True,
+                             workers=args.workers)
+            shard_index, shard_count = (int(a) for a in args.shard.split('/'))
+            if shard_count > 1:
+                wd = wd.shard(shard_index, shard_count)
             sm.detect_on_wild_dataset(wd, threshold=args.threshold,
                                       batch_size=args.batch_size,
-                                      save_score=True)
+                                      save_score=True, top_k=args.top_k)
@@ -0,0 +1,322 @@
+"""Similarity scores of UI pairs from UI# embeddings. Each UI goes
+through the siamese network only once, and the cosine similarities of
+the pairs across apps come from blocked matrix products of the L2
+normalized embeddings"""
+
+from typing import Tuple
+
+import numpy as np
+import torch
+
+# the eps of torch.cosine_similarity
+NORM_EPS = 1e-8
+# elements of a block of scores, i.e., 64 MB of float32
+BLOCK_ELEMENTS = 1 << 24
+
+
+def app_offsets(names) -> np.ndarray:
+    """ Where the UIs of each app start, as in a CSR matrix. A name is
+    "{app} {xml}", and the UIs of an app are arranged together, one
+    after another, as when generating UI#s
+
+    Returns:
+        [apps + 1] int64, the UIs of app k are offsets[k]:offsets[k + 1]
+    """
+    offsets = [0]
+    seen = set()
+    last = None
+    for i, name in enumerate(names):
+        app = name.split(' ')[0]
+        if app == last:
+            continue
+        if app in seen:
+            raise ValueError(f"the uis of {app} are not arranged together")
+        seen.add(app)
+        if i > 0:
+            offsets.append(i)
+        last = app
+    if len(names) > 0:
+        offsets.append(len(names))
+    return np.array(offsets, dtype=np.int64)
+
+
+def app_ends(offsets: np.ndarray) -> np.ndarray:
+    """ For each UI, the end of the UIs of its app """
+    return np.repeat(offsets[1:], np.diff(offsets))
+
+
+class PairIndex:
+    """ The pairs (i, j), i < j, of UIs in different apps, indexed
+    without materializing them. Pair k is found by arithmetic over the
+    rows: row i has the pairs (i, end of its app), ..., (i, n - 1), so
+    the pairs are in the order of the rows, then of j
+
+    Args:
+        offsets (np.ndarray): see `app_offsets`
+        start (int): the first pair of this range
+        stop (int): the end of this range. Default: all the pairs
+    """
+    def __init__(self, offsets: np.ndarray, start: int = 0, stop: int = None):
+        self.offsets = offsets
+        self.ends = app_ends(offsets)
+        n = len(self.ends)
+        # the first pair of each row, and the total as the last one
+        self.row_starts = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(n - self.ends, out=self.row_starts[1:])
+        # the pairs of all the ranges
+        self.total = int(self.row_starts[-1])
+        self.start = min(max(start, 0), self.total)
+        self.stop = self.total if stop is None \
+            else min(max(stop, self.start), self.total)
+
+    @classmethod
+    def of_names(cls, names) -> 'PairIndex':
+        return cls(app_offsets(names))
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, k: int) -> Tuple[int, int]:
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError(f"pair {k} out of range")
+        i, j = self.pairs(np.array([k]))
+        return int(i[0]), int(j[0])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def pairs(self, ks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ The pairs of an array of indexes in this range
+
+        Returns:
+            (i, j), two int64 arrays
+        """
+        flat = np.asarray(ks, dtype=np.int64) + self.start
+        i = np.searchsorted(self.row_starts, flat, side='right') - 1
+        return i, self.ends[i] + (flat - self.row_starts[i])
+
+    def rows(self) -> Tuple[int, int]:
+        """ The rows whose first pair is in this range, so that the
+        shards of an index split the rows as well. The range that ends
+        the index also has the rows without pairs, i.e., the last app
+
+        Returns:
+            (first row, end row)
+        """
+        first = int(np.searchsorted(self.row_starts[:-1], self.start, side='left'))
+        if self.stop >= self.total:
+            return first, len(self.ends)
+        return first, int(np.searchsorted(self.row_starts[:-1], self.stop,
+                                          side='left'))
+
+    def shard(self, index: int, count: int) -> 'PairIndex':
+        """ The index-th of count contiguous ranges of nearly the same
+        number of pairs. The outputs of the shards, one after another,
+        are the output of the whole range """
+        if not 0 <= index < count:
+            raise ValueError(f"invalid shard {index} of {count}")
+        size = len(self)
+        return PairIndex(self.offsets, self.start + size * index // count,
+                         self.start + size * (index + 1) // count)
+
+
+def embed_uis(net, uis, device, batch_size: int = 1024,
+              transform=None) -> np.ndarray:
+    """ L2 normalized `SiameseNet.forward_once` outputs of UI#s
+
+    Args:
+        net: The siamese network, or a TorchScript artifact of it
+        uis: [n, c, h, v] UI#s
+        device: Where the network is
+        batch_size (int): UIs per forward
+        transform: Applied to each UI#, as in the datasets
+
+    Returns:
+        [n, d] float32
+    """
+    forward_once = getattr(net, "forward_once", None)
+    embeddings = list()
+    with torch.no_grad():
+        for i in range(0, len(uis), batch_size):
+            batch = uis[i:i + batch_size]
+            if transform:
+                x = torch.stack([torch.as_tensor(transform(u)) for u in batch])
+            else:
+                x = torch.from_numpy(np.stack(batch))
+            x = x.float().to(device)
+            if forward_once is not None:
+                o = forward_once(x)
+            else:
+                # an artifact only keeps `forward`, which takes a stacked pair
+                o = net(torch.stack((x, x), 0))[0]
+            embeddings.append(o.float().cpu().numpy())
+    if not embeddings:
+        return np.zeros((0, 0), dtype=np.float32)
+    embeddings = np.concatenate(embeddings)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, NORM_EPS)
+
+
+def keep_distinct(embeddings: np.ndarray, threshold: float) -> np.ndarray:
+    """ Greedy removal of near duplicates, e.g., among the UIs of an
+    app. The UIs are visited in their order, and a UI is kept unless
+    its score with an earlier kept UI is above the threshold. So the
+    first UI is always kept, and a removed UI removes nothing
+
+    Args:
+        embeddings (np.ndarray): [m, d], see `embed_uis`
+        threshold (float): the threshold of similar UIs
+
+    Returns:
+        the positions of the kept UIs, ascending
+    """
+    similar = embeddings @ embeddings.T > threshold
+    kept = np.ones(len(embeddings), dtype=bool)
+    for i in range(len(embeddings)):
+        if kept[i]:
+            kept[i + 1:] &= ~similar[i, i + 1:]
+    return np.flatnonzero(kept)
+
+
+def iter_cross_app_scores(embeddings: np.ndarray, pair_index: PairIndex,
+                          block_elements: int = BLOCK_ELEMENTS):
+    """ Cosine similarities of the pairs of a `PairIndex`, block by
+    block. A block covers some rows i and the columns from the end of
+    the app of its first row, so the blocks of an app against itself and
+    the lower triangle are never computed. `scores[mask]` of the blocks,
+    one after another, are in the order of the pair index
+
+    Args:
+        embeddings (np.ndarray): [n, d], see `embed_uis`
+        pair_index (PairIndex): the pairs, or a shard of them
+        block_elements (int): the most scores of a block, unless it has
+          only one row
+
+    Yields:
+        (row, col, scores, mask), the scores of UIs row:row + len(scores)
+        against UIs col:, and which of them are pairs of the index
+    """
+    if len(pair_index) == 0:
+        return
+    n = len(embeddings)
+    ends = pair_index.ends
+    (first_row, last_row), (first_col, last_col) = \
+        pair_index.pairs(np.array([0, len(pair_index) - 1]))
+    row = first_row
+    while row <= last_row:
+        col = int(ends[row])
+        rows = max(1, min(last_row + 1 - row, block_elements // (n - col)))
+        scores = embeddings[row:row + rows] @ embeddings[col:].T
+        cols = np.arange(col, n)
+        mask = cols[None, :] >= ends[row:row + rows, None]
+        # a range may start or stop inside a row
+        if row == first_row:
+            mask[0] &= cols >= first_col
+        if row + rows > last_row:
+            mask[-1] &= cols <= last_col
+        yield row, col, scores, mask
+        row += rows
+
+
+def top_k_neighbours(embeddings: np.ndarray, offsets: np.ndarray, k: int,
+                     floor: float, rows: Tuple[int, int] = None,
+                     block_elements: int = BLOCK_ELEMENTS
+                     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ For each UI, the k most similar UIs of the other apps whose
+    scores are above the floor. A block of rows is scored against all
+    the UIs, and the top k of each row are picked by partial sorting,
+    so the memory is bound by the block and n * k
+
+    Args:
+        embeddings (np.ndarray): [n, d], see `embed_uis`
+        offsets (np.ndarray): see `app_offsets`
+        k (int): the most neighbours of a UI
+        floor (float): the threshold of similar UIs
+        rows ((int, int)): the UIs to find neighbours for, e.g., from
+          `PairIndex.rows`. Default: all
+        block_elements (int): the most scores of a block, unless it has
+          only one row
+
+    Returns:
+        (indptr, indices, scores) in CSR, i.e., the neighbours of UI
+        rows[0] + r are indices[indptr[r]:indptr[r + 1]], with their
+        scores, from the most similar one
+    """
+    n = len(embeddings)
+    first, end = (0, n) if rows is None else rows
+    ends = app_ends(offsets)
+    starts = np.repeat(offsets[:-1], np.diff(offsets))
+    cols = np.arange(n)
+    indices, scores, counts = list(), list(), list()
+    step = max(1, block_elements // max(n, 1))
+    for row in range(first, end, step):
+        stop = min(row + step, end)
+        block = embeddings[row:stop] @ embeddings.T
+        # the uis of the same app
+        block[(cols[None, :] >= starts[row:stop, None]) &
+              (cols[None, :] < ends[row:stop, None])] = -np.inf
+        top, top_scores, count = top_k_rows(block, k, floor)
+        indices.append(top)
+        scores.append(top_scores)
+        counts.append(count)
+    return to_csr(end - first, indices, scores, counts)
+
+
+def top_k_search(queries: np.ndarray, embeddings: np.ndarray, k: int,
+                 floor: float, block_elements: int = BLOCK_ELEMENTS
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ The exact search of the k most similar UIs above the floor for
+    each query, by blocked matrix products
+
+    Args:
+        queries (np.ndarray): [q, d], see `embed_uis`
+        embeddings (np.ndarray): [n, d] of the UIs to search
+
+    Returns:
+        (indptr, indices, scores) in CSR, see `top_k_neighbours`
+    """
+    indices, scores, counts = list(), list(), list()
+    step = max(1, block_elements // max(len(embeddings), 1))
+    for row in range(0, len(queries), step):
+        top, top_scores, count = top_k_rows(
+            queries[row:row + step] @ embeddings.T, k, floor)
+        indices.append(top)
+        scores.append(top_scores)
+        counts.append(count)
+    return to_csr(len(queries), indices, scores, counts)
+
+
+def top_k_rows(block: np.ndarray, k: int, floor: float
+               ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ The top k columns above the floor of each row of a block of
+    scores, from the largest one
+
+    Returns:
+        (columns, scores, count of each row), the columns and scores of
+        the rows one after another
+    """
+    if block.shape[1] == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), \
+            np.zeros(len(block), dtype=np.int64)
+    # partial sorting, faster in torch than np.argpartition
+    top_scores, top = torch.topk(torch.from_numpy(block),
+                                 min(k, block.shape[1]), dim=1)
+    top_scores, top = top_scores.numpy(), top.numpy()
+    above = top_scores > floor
+    return top[above], top_scores[above], above.sum(axis=1)
+
+
+def to_csr(rows: int, indices: list, scores: list, counts: list
+           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Pack the outputs of `top_k_rows` of some blocks in CSR """
+    indptr = np.zeros(rows + 1, dtype=np.int64)
+    if counts:
+        np.cumsum(np.concatenate(counts), out=indptr[1:])
+    indices = np.concatenate(indices).astype(np.int64) if indices \
+        else np.zeros(0, dtype=np.int64)
+    scores = np.concatenate(scores).astype(np.float32) if scores \
+        else np.zeros(0, dtype=np.float32)
+    return indptr, indices, scores
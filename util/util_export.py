@@ -0,0 +1,99 @@
+"""Export networks as frozen TorchScript artifacts for CPU inference"""
+
+import copy
+import json
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+
+META_FILE = "meta.json"
+# none: float32. dynamic: int8 dynamic quantization of the Linear
+# layers. static: int8 static quantization of the convs as well
+QUANTIZE_MODES = ("none", "dynamic", "static")
+
+
+def quantize_net(net: nn.Module, mode: str, calib_inputs: list = None,
+                 static_modules: list = None) -> nn.Module:
+    """A quantized copy of a network, on the cpu and in eval mode
+
+    Args:
+        net (nn.Module): The float network
+        mode (str): One of `QUANTIZE_MODES`
+        calib_inputs (list): Inputs of the network, to calibrate the
+          activation ranges. Needed by "static"
+        static_modules (list): Names of the submodules to quantize
+          statically, e.g., ["cnn.0"]. The whole network if not given.
+          They have to be symbolically traceable (torch.fx)
+
+    Returns:
+        The quantized network
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"unknown quantization mode: {mode}")
+    net = copy.deepcopy(net).cpu().eval()
+    if mode == "static":
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+        if not calib_inputs:
+            raise ValueError("static quantization needs calibration inputs")
+        names = static_modules or [""]
+        # inputs of each submodule, captured while running the network
+        module_inputs = {name: list() for name in names}
+        hooks = [net.get_submodule(name).register_forward_pre_hook(
+            lambda _m, args, _name=name: module_inputs[_name].append(args[0]))
+            for name in names if name]
+        with torch.no_grad():
+            for x in calib_inputs if hooks else []:
+                net(x)
+        for hook in hooks:
+            hook.remove()
+        module_inputs[""] = calib_inputs
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        for name in names:
+            prepared = prepare_fx(net.get_submodule(name), qconfig_mapping,
+                                  (module_inputs[name][0],))
+            with torch.no_grad():
+                for x in module_inputs[name]:
+                    prepared(x)
+            module = convert_fx(prepared)
+            if name:
+                parent, _, attr = name.rpartition('.')
+                setattr(net.get_submodule(parent), attr, module)
+            else:
+                net = module
+    if mode != "none":
+        net = torch.ao.quantization.quantize_dynamic(
+            net, {nn.Linear}, dtype=torch.qint8)
+    return net
+
+
+def save_artifact(net: nn.Module, example_input: torch.Tensor,
+                  path: str, meta: dict):
+    """Trace and freeze a network, and save it with its metadata
+
+    Args:
+        net (nn.Module): The network, on the cpu
+        example_input (torch.Tensor): An input to trace the network.
+          The batch size does not need to match later inputs
+        path (str): The output file
+        meta (dict): Json serializable metadata, see `load_artifact`
+    """
+    net.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(net, example_input, check_trace=False)
+    frozen = torch.jit.freeze(traced)
+    torch.jit.save(frozen, path, _extra_files={META_FILE: json.dumps(meta)})
+    print(f"artifact saved: {path}")
+
+
+def load_artifact(path: str) -> Tuple[torch.jit.ScriptModule, dict]:
+    """Load an artifact saved by `save_artifact` on the cpu
+
+    Returns:
+        The network, and its metadata
+    """
+    extra_files = {META_FILE: ""}
+    net = torch.jit.load(path, map_location="cpu", _extra_files=extra_files)
+    meta = json.loads(extra_files[META_FILE]) if extra_files[META_FILE] else dict()
+    return net, meta
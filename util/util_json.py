@@ -0,0 +1,51 @@
+"""Help functions for reading Rico style json hierarchies (Rico and the
+web crawler), where a node may have "bounds", "componentLabel" and
+"children" """
+
+import json
+import sys
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the json decoders recurse once per level of nesting. orjson stops at
+# 1024 levels, and the json module at the recursion limit, which is
+# raised to this for deep files
+DEEP_RECURSION_LIMIT = 100000
+
+
+def load_json(json_path: str):
+    """ Load a json file, with orjson if it is installed. Files that
+    orjson rejects (e.g., with NaN, or too deep) are left to the json
+    module """
+    with open(json_path, mode='rb') as f:
+        data = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    try:
+        return json.loads(data)
+    except RecursionError:
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, DEEP_RECURSION_LIMIT))
+        try:
+            return json.loads(data)
+        finally:
+            sys.setrecursionlimit(limit)
+
+
+def iter_json_nodes(root: dict):
+    """ Yield the nodes of a json hierarchy in pre-order, i.e., a node
+    and then the subtrees of its children in order. An explicit stack is
+    used, so the depth of the tree is not bound by the recursion limit """
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        children = node.get('children')
+        if children:
+            stack.extend(reversed(children))
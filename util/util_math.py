@@ -80,6 +80,32 @@ def get_iou(boundary_view: Tuple[int, int, int, int],
     return common_area / garea
 
 
+def get_iou_matrix(boundary_views: np.array,
+                   boundary_grids: np.array) -> np.array:
+    """Calculate IoU for every (view, grid) combination at once. The
+    arithmetic follows `get_iou` operation by operation, so each item
+    is bit-for-bit equal to the corresponding `get_iou` call
+
+    Args:
+        boundary_views: An (n, 4) array of (h_left, v_top, h_right, v_bottom)
+        boundary_grids: An (m, 4) array of (h_left, v_top, h_right, v_bottom)
+
+    Returns:
+        An (n, m) float array of IoU values
+    """
+    views = np.asarray(boundary_views, dtype=np.float64)
+    grids = np.asarray(boundary_grids, dtype=np.float64)
+    garea = (grids[:, 2] - grids[:, 0]) * (grids[:, 3] - grids[:, 1])
+
+    h1 = np.maximum(views[:, None, 0], grids[None, :, 0])
+    v1 = np.maximum(views[:, None, 1], grids[None, :, 1])
+    h2 = np.minimum(views[:, None, 2], grids[None, :, 2])
+    v2 = np.minimum(views[:, None, 3], grids[None, :, 3])
+    w = np.maximum(0, h2 - h1)
+    h = np.maximum(0, v2 - v1)
+    return w * h / garea[None, :]
+
+
 def amp_small_scaler(x: float) -> float:
     """Amplify small signals in UI#
 
@@ -94,6 +120,21 @@ def amp_small_scaler(x: float) -> float:
     return (ex(x) - ex(0)) / (ex(1) - ex(0))
 
 
+def amp_small_scaler_array(x: np.array) -> np.array:
+    """Vectorized `amp_small_scaler`. The results may differ from the
+    scalar version in the last bit, since numpy and libm do not share
+    the same log implementation
+
+    Args:
+        x (np.array): Input values
+
+    Returns:
+        Amplified values (np.array)
+    """
+    ex0, ex1 = math.log(0.01, 2), math.log(1.01, 2)
+    return (np.log2(np.asarray(x) + 0.01) - ex0) / (ex1 - ex0)
+
+
 def standardization(data: np.array) -> np.array:
     mu = np.mean(data, axis=0)
     sigma = np.std(data, axis=0)
@@ -111,5 +152,13 @@ if __name__ == '__main__':
     assert get_iou((1, 1, 8, 8), (0, 0, 10, 10)) == 0.49
     assert get_iou((-2, -2, 4, 5), (0, 0, 10, 10)) == 0.2
     assert get_iou((9, 8, 12, 13), (0, 0, 10, 10)) == 0.02
+    _views = [(1, 1, 8, 8), (-2, -2, 4, 5), (9, 8, 12, 13)]
+    _grids = [(0, 0, 10, 10), (2.5, 0, 5.0, 7.5)]
+    _mat = get_iou_matrix(_views, _grids)
+    for _i, _v in enumerate(_views):
+        for _j, _g in enumerate(_grids):
+            assert _mat[_i, _j] == get_iou(_v, _g)
+    assert np.allclose(amp_small_scaler_array([0, 0.3, 1]),
+                       [amp_small_scaler(0), amp_small_scaler(0.3), 1])
     assert c(15934, 2) == 126938211
     print('test pass')
@@ -0,0 +1,160 @@
+"""A compact, column-based container for the views of a UI"""
+
+from array import array
+
+import numpy as np
+
+
+class NodeTable:
+    """The views of a UI, stored by columns instead of a list of dicts
+    holding string coordinates. Class names are interned, so a UI with
+    hundreds of views only keeps a handful of name strings
+
+    Args:
+        bounds (np.array): (n, 4) int32 (left, top, right, bottom)
+        class_ids (np.array): (n,) int32 indexes into `class_names`
+        class_names (list): the interned class names
+        texts (list): view texts
+        interact (np.array): (n,) bool, whether a view is clickable,
+          long-clickable or checkable
+        visible (list): `visible-to-user` values. None when the
+          reader only keeps visible views
+
+    Attributes:
+        has_text (np.array): (n,) bool, whether a view has a non-blank text
+    """
+    def __init__(self, bounds: np.array, class_ids: np.array,
+                 class_names: list, texts: list, interact: np.array,
+                 visible: list = None):
+        self.bounds = bounds
+        self.class_ids = class_ids
+        self.class_names = class_names
+        self.texts = texts
+        self.has_text = np.array([len(t.strip()) > 0 for t in texts],
+                                 dtype=bool)
+        self.interact = interact
+        self.visible = visible
+
+    def __len__(self) -> int:
+        return len(self.class_ids)
+
+    def name(self, i: int) -> str:
+        return self.class_names[self.class_ids[i]]
+
+    @property
+    def names(self) -> list:
+        """The class name of every view"""
+        return [self.class_names[i] for i in self.class_ids.tolist()]
+
+    def centers(self) -> np.array:
+        """(n, 2) int centers of the views"""
+        b = self.bounds.astype(np.float64)
+        return np.stack((b[:, 0] + 0.5 * (b[:, 2] - b[:, 0]),
+                         b[:, 1] + 0.5 * (b[:, 3] - b[:, 1])),
+                        axis=1).astype(int)
+
+    def take(self, index) -> 'NodeTable':
+        """A new table with the selected views
+
+        Args:
+            index: a bool mask or an index array
+        """
+        index = np.flatnonzero(index) if np.asarray(index).dtype == bool \
+            else np.asarray(index, dtype=np.int64)
+        rows = index.tolist()
+        return NodeTable(self.bounds[index], self.class_ids[index],
+                         self.class_names, [self.texts[i] for i in rows],
+                         self.interact[index],
+                         None if self.visible is None
+                         else [self.visible[i] for i in rows])
+
+    def to_dicts(self) -> list:
+        """Turn the table into the node dicts given by `XMLReader` before,
+        like {'name': ..., 'lt': ['0', '63'], 'rb': [...], 'text': ...,
+        'interact': ...}, to keep the existing callers working"""
+        dicts = list()
+        names = self.names
+        for i, (h1, v1, h2, v2) in enumerate(self.bounds.tolist()):
+            _dict = {'name': names[i],
+                     'lt': [str(h1), str(v1)],
+                     'rb': [str(h2), str(v2)]}
+            if self.visible is not None:
+                _dict['visible'] = self.visible[i]
+            _dict['text'] = self.texts[i]
+            _dict['interact'] = bool(self.interact[i])
+            dicts.append(_dict)
+        return dicts
+
+    @classmethod
+    def from_dicts(cls, dicts: list) -> 'NodeTable':
+        """Build a table from node dicts. Views without bounds are skipped"""
+        builder = NodeTableBuilder()
+        for n in dicts:
+            if 'lt' not in n:
+                continue
+            builder.append(n.get('name', ''),
+                           n['lt'][0], n['lt'][1], n['rb'][0], n['rb'][1],
+                           n.get('text', ''), n.get('interact', False),
+                           n.get('visible'))
+        return builder.build()
+
+    @classmethod
+    def from_elements(cls, elements: list) -> 'NodeTable':
+        """Build a table from the elements of a hierarchy (minidom).
+        Elements without bounds are skipped"""
+        builder = NodeTableBuilder()
+        for node in elements:
+            bounds = node.getAttribute('bounds').replace(']', '').split('[')
+            if len(bounds) < 2:
+                continue
+            lt, rb = bounds[1].split(','), bounds[2].split(',')
+            interact = node.getAttribute('clickable').startswith('t') \
+                or node.getAttribute('long-clickable').startswith('t') \
+                or node.getAttribute('checkable').startswith('t')
+            builder.append(node.getAttribute('class'), lt[0], lt[1], rb[0], rb[1],
+                           node.getAttribute('text'), interact)
+        return builder.build()
+
+
+class NodeTableBuilder:
+    """Collect views one by one (e.g., while parsing a hierarchy),
+    then turn them into a `NodeTable`"""
+    def __init__(self):
+        self._bounds = array('i')
+        self._class_ids = array('i')
+        self._class_index = dict()
+        self._texts = list()
+        self._interact = bytearray()
+        self._visible = list()
+
+    def __len__(self) -> int:
+        return len(self._class_ids)
+
+    def append(self, name: str, h1, v1, h2, v2, text: str,
+               interact: bool, visible: str = None):
+        """Add a view. The coordinates can be int or str
+
+        Raises:
+            ValueError: if a coordinate is not an integer
+        """
+        self._bounds.extend((int(h1), int(v1), int(h2), int(v2)))
+        class_id = self._class_index.get(name)
+        if class_id is None:
+            class_id = self._class_index[name] = len(self._class_index)
+        self._class_ids.append(class_id)
+        self._texts.append(text)
+        self._interact.append(1 if interact else 0)
+        if visible is not None:
+            self._visible.append(visible)
+
+    def build(self) -> NodeTable:
+        bounds = np.frombuffer(self._bounds, dtype=np.intc) \
+            .astype(np.int32).reshape(-1, 4)
+        class_ids = np.frombuffer(self._class_ids, dtype=np.intc) \
+            .astype(np.int32)
+        interact = np.frombuffer(bytes(self._interact), dtype=np.uint8) \
+            .astype(bool)
+        visible = self._visible if len(self._visible) == len(self._texts) \
+            and len(self._texts) > 0 else None
+        return NodeTable(bounds, class_ids, list(self._class_index),
+                         self._texts, interact, visible)
@@ -101,7 +101,21 @@ def is_removal(node: Element,
     Returns:
         whether a n is of no sense
     """
-    package = node.getAttribute('package')
+    return is_removal_package(node.getAttribute('package'), keywords)
+
+
+def is_removal_package(package: str,
+                       keywords: str = 'com.microvirt') -> bool:
+    """Same as `is_removal`, but takes the package attribute of a
+    node directly, so that it can be used while streaming a xml
+
+    Args:
+        package (str): The package attribute of a xml node
+        keywords (str): See `is_removal`
+
+    Returns:
+        whether a node from the package is of no sense
+    """
     if package == 'android':
         return True
     if package.count('com.android.systemui'):